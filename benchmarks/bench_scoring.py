@@ -0,0 +1,60 @@
+'''
+Micro-benchmark for the vectorized scoring engine.
+
+    python -m benchmarks.bench_scoring [--users 500] [--days 30 90 365]
+
+Times calculate_diet_score_with_penalty against the vectorized engine, one
+user at a time and in batch. That both give the same scores is checked by
+tests/test_scoring.py on sheets from random_user.
+'''
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from utils.llm_utils.agents import calculate_diet_score_with_penalty
+from utils.score_utils.scoring_engine import calculate_diet_score_vectorized, score_batch
+
+NUTRIENTS = {
+    "Calories (kcal)": 2000, "Protein (g)": 50, "Carbohydrates (g)": 275,
+    "Fat (g)": 70, "Fiber (g)": 28, "Sugar (g)": 50, "Sodium (mg)": 2300,
+    "Potassium (mg)": 3500, "Calcium (mg)": 1000, "Iron (mg)": 18,
+    "Magnesium (mg)": 400, "Zinc (mg)": 11, "Vitamin A (mcg)": 900,
+    "Vitamin C (mg)": 90, "Vitamin D (mg)": 0.02, "Vitamin B12 (mcg)": 2.4,
+}
+
+def random_user(rng, days):
+    sheet = {
+        nutrient: [round(rng.uniform(0, 2.5) * ideal, 2) if rng.random() > 0.2 else 0 for _ in range(days)]
+        for nutrient, ideal in NUTRIENTS.items()
+    }
+    frequency = [rng.randint(0, 8) for _ in range(days)]
+    return {
+        "overall_nutrient_intake_sheet": sheet,
+        "daily_frequency_list": frequency,
+        "frequency_of_missing": sum(1 for freq in frequency if freq == 0),
+        "start_date": datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 300)),
+    }
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 90, 365])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    print(f"{'days':>5} {'users':>6} {'loop (s)':>10} {'vector (s)':>11} {'batch (s)':>10} {'speedup':>8}")
+    for days in args.days:
+        users = [random_user(rng, days) for _ in range(args.users)]
+        loop = timed(lambda: [calculate_diet_score_with_penalty(balanced_diet_sheet=NUTRIENTS, **user) for user in users])
+        vector = timed(lambda: [calculate_diet_score_vectorized(balanced_diet_sheet=NUTRIENTS, **user) for user in users])
+        batch = timed(lambda: score_batch(users, NUTRIENTS))
+        print(f"{days:>5} {args.users:>6} {loop:>10.4f} {vector:>11.4f} {batch:>10.4f} {loop / batch:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
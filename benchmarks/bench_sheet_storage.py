@@ -0,0 +1,45 @@
+'''
+Document size and BSON decode time of one user's sheet in each layout.
+
+    python -m benchmarks.bench_sheet_storage [--days 30 90 365] [--nutrients 16]
+'''
+import argparse
+import random
+import time
+import bson
+from utils.db_utils.sheet_store import SHEET_FORMATS, encode_sheet
+
+def random_sheet(rng, nutrients, days):
+    return {
+        "overall_nutrient_sheet": {
+            f"Nutrient {n} (mg)": [round(rng.uniform(0, 3000), 2) if rng.random() > 0.2 else 0 for _ in range(days)]
+            for n in range(nutrients)
+        },
+        "attendance": [rng.random() > 0.2 for _ in range(days)],
+        "frequency": [rng.randint(0, 8) for _ in range(days)],
+        "day_scores": [rng.uniform(0, nutrients) for _ in range(days)],
+    }
+
+def decode_time(data, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        bson.decode(data)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 90, 365])
+    parser.add_argument("--nutrients", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    print(f"{'days':>5} {'layout':>7} {'bytes':>9} {'decode (ms)':>12}")
+    for days in args.days:
+        sheet = random_sheet(rng, args.nutrients, days)
+        for storage in SHEET_FORMATS:
+            data = bson.encode(encode_sheet(sheet, storage))
+            print(f"{days:>5} {storage:>7} {len(data):>9} {decode_time(data, args.repeat) * 1000:>12.3f}")
+
+if __name__ == "__main__":
+    main()
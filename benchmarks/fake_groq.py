@@ -0,0 +1,188 @@
+'''
+Local stand-in for the Groq chat completions endpoint.
+
+    uvicorn benchmarks.fake_groq:app --port 8001
+    GROQ_BASE_URL=http://127.0.0.1:8001 uvicorn server:app
+
+Every api key gets FAKE_GROQ_REQUESTS_PER_WINDOW requests per
+FAKE_GROQ_WINDOW_SECONDS. Responses carry the same x-ratelimit-* headers
+as Groq and a 429 with retry-after once a key's budget is spent.
+Streamed requests get the reply one word per chunk, FAKE_GROQ_TOKEN_MS
+apart; GET /stats counts requests by kind, injected 429s and streams the
+client closed before the end.
+
+Replies follow the request unless FAKE_GROQ_REPLY fixes one for all:
+JSON mode requests get a filled nutrient sheet (keys from NUTRIENTS_LIST,
+one object per numbered meal for batches), short classification calls get
+yes/no, everything else FAKE_GROQ_TEXT_WORDS words of text.
+FAKE_GROQ_429_RATE injects 429s on top of the budget, seeded by
+FAKE_GROQ_SEED so runs are repeatable.
+'''
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+load_dotenv()
+
+REQUESTS_PER_WINDOW = int(os.getenv("FAKE_GROQ_REQUESTS_PER_WINDOW", "30"))
+TOKENS_PER_WINDOW = int(os.getenv("FAKE_GROQ_TOKENS_PER_WINDOW", "6000"))
+WINDOW_SECONDS = float(os.getenv("FAKE_GROQ_WINDOW_SECONDS", "60"))
+LATENCY_MS = float(os.getenv("FAKE_GROQ_LATENCY_MS", "200"))
+LATENCY_JITTER_MS = float(os.getenv("FAKE_GROQ_LATENCY_JITTER_MS", "0"))
+REPLY = os.getenv("FAKE_GROQ_REPLY")
+TOKEN_MS = float(os.getenv("FAKE_GROQ_TOKEN_MS", "20"))
+TEXT_WORDS = int(os.getenv("FAKE_GROQ_TEXT_WORDS", "40"))
+RATE_429 = float(os.getenv("FAKE_GROQ_429_RATE", "0"))
+RETRY_AFTER_429 = float(os.getenv("FAKE_GROQ_429_RETRY_AFTER", "1"))
+
+NUTRIENTS = json.loads(os.getenv("NUTRIENTS_LIST") or "[]")
+FOOD_WORDS = ("ate", "had", "eaten", "breakfast", "lunch", "dinner", "snack", "drank")
+
+app = FastAPI()
+
+_random = random.Random(int(os.getenv("FAKE_GROQ_SEED", "0")))
+# api key -> {"window_start", "requests", "tokens"}
+_budgets = {}
+_stream_stats = {"streams": 0, "completed": 0, "closed_early": 0, "chunks_sent": 0}
+_request_stats = {"requests": 0, "json": 0, "batch": 0, "classify": 0, "text": 0, "budget_429": 0, "injected_429": 0}
+
+def _budget(api_key):
+    now = time.monotonic()
+    budget = _budgets.get(api_key)
+    if budget is None or now - budget["window_start"] >= WINDOW_SECONDS:
+        budget = {"window_start": now, "requests": 0, "tokens": 0}
+        _budgets[api_key] = budget
+    return budget
+
+def _rate_limit_headers(budget):
+    reset = max(0.0, WINDOW_SECONDS - (time.monotonic() - budget["window_start"]))
+    return {
+        "x-ratelimit-limit-requests": str(REQUESTS_PER_WINDOW),
+        "x-ratelimit-remaining-requests": str(max(0, REQUESTS_PER_WINDOW - budget["requests"])),
+        "x-ratelimit-reset-requests": f"{reset:.2f}s",
+        "x-ratelimit-limit-tokens": str(TOKENS_PER_WINDOW),
+        "x-ratelimit-remaining-tokens": str(max(0, TOKENS_PER_WINDOW - budget["tokens"])),
+        "x-ratelimit-reset-tokens": f"{reset:.2f}s",
+    }
+
+def _nutrients(text):
+    # same meal text, same numbers
+    seed = int(hashlib.sha256(text.strip().lower().encode()).hexdigest()[:8], 16)
+    return {nutrient: round(((seed >> position) % 50 + 1) * 4.2, 1) for position, nutrient in enumerate(NUTRIENTS)}
+
+def _meal(text):
+    return {"nutrients": _nutrients(text), "remarks": "Balanced meal, add some vegetables."}
+
+def _reply(body):
+    '''
+    The reply text and the kind of request it answers.
+    '''
+    if REPLY is not None:
+        return REPLY, "text"
+    prompt = body["messages"][-1]["content"]
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        meals = re.findall(r"^\s*(\d+)\.\s+(.+)$", prompt.split("Meals:", 1)[1], re.M) if "Meals:" in prompt else []
+        if meals:
+            return json.dumps({number: _meal(text) for number, text in meals}), "batch"
+        return json.dumps(_meal(prompt)), "json"
+    if (body.get("max_tokens") or 1024) <= 8:
+        return ("yes" if any(word in prompt.lower().split() for word in FOOD_WORDS) else "no"), "classify"
+    words = "Try adding more protein and fibre to your next meals and keep logging every day".split()
+    return " ".join(words[i % len(words)] for i in range(TEXT_WORDS)), "text"
+
+def _too_many(headers, retry_after):
+    headers["retry-after"] = retry_after
+    return JSONResponse(
+        status_code=429,
+        content={"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}},
+        headers=headers
+    )
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    api_key = request.headers.get("authorization", "").removeprefix("Bearer ")
+    body = await request.json()
+    budget = _budget(api_key)
+    if budget["requests"] >= REQUESTS_PER_WINDOW or budget["tokens"] >= TOKENS_PER_WINDOW:
+        _request_stats["budget_429"] += 1
+        headers = _rate_limit_headers(budget)
+        return _too_many(headers, headers["x-ratelimit-reset-requests"].removesuffix("s"))
+    if RATE_429 and _random.random() < RATE_429:
+        _request_stats["injected_429"] += 1
+        return _too_many(_rate_limit_headers(budget), f"{RETRY_AFTER_429:.2f}")
+
+    reply, kind = _reply(body)
+    _request_stats["requests"] += 1
+    _request_stats[kind] += 1
+    prompt_tokens = sum(len(message["content"].split()) for message in body["messages"])
+    completion_tokens = len(reply.split())
+    budget["requests"] += 1
+    budget["tokens"] += prompt_tokens + completion_tokens
+
+    await asyncio.sleep((LATENCY_MS + _random.uniform(0, LATENCY_JITTER_MS)) / 1000)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    if body.get("stream"):
+        return StreamingResponse(
+            _stream(body["model"], reply, usage),
+            media_type="text/event-stream",
+            headers=_rate_limit_headers(budget)
+        )
+    return JSONResponse(
+        content={
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        },
+        headers=_rate_limit_headers(budget)
+    )
+
+def _chunk(completion_id, model, delta, finish_reason=None, usage=None):
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        chunk["x_groq"] = {"id": completion_id, "usage": usage}
+    return f"data: {json.dumps(chunk)}\n\n"
+
+async def _stream(model, reply, usage):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    words = reply.split(" ")
+    _stream_stats["streams"] += 1
+    finished = False
+    try:
+        yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+        for position, word in enumerate(words):
+            await asyncio.sleep(TOKEN_MS / 1000)
+            _stream_stats["chunks_sent"] += 1
+            yield _chunk(completion_id, model, {"content": word if position == 0 else " " + word})
+        yield _chunk(completion_id, model, {}, finish_reason="stop", usage=usage)
+        yield "data: [DONE]\n\n"
+        finished = True
+    finally:
+        _stream_stats["completed" if finished else "closed_early"] += 1
+
+@app.get("/stats")
+async def stats():
+    return {**_request_stats, **_stream_stats}
@@ -0,0 +1,285 @@
+'''
+Scripted user journeys against the API: signup, login, start, a number of
+/query calls (meal logs and questions), /review and /calculate_score.
+Reports throughput, p50/p95/p99 latency per route and model calls per
+request, and can save the result as a baseline or compare against one.
+
+    python -m benchmarks.load_test --users 20 --queries 10 --spawn-fake
+    python -m benchmarks.load_test --users 20 --queries 10 --spawn-fake --save baseline.json
+    python -m benchmarks.load_test --users 20 --queries 10 --spawn-fake --compare baseline.json
+
+By default the app runs in this process (httpx ASGI transport, no
+network) on an in-memory mongomock database, with METRICS_MODE=full so
+every response's Server-Timing header tells how many model calls it made.
+--mongo env uses MONGOURL instead; --url sends the journeys to a running
+server, where per-request model calls are only known if it runs with
+METRICS_MODE=full.
+
+--spawn-fake starts benchmarks.fake_groq on --fake-port and points the app
+at it (in process only; a server given by --url must already use it).
+Model calls in total are read from the fake's /stats, retries included.
+
+Latencies depend on the machine, so a baseline is only worth comparing
+against on the one it was recorded on; model calls per request and error
+rates compare anywhere. Needs httpx, and mongomock-motor for --mongo memory. Seeded, so two runs
+with the same arguments send the same requests in the same order per user.
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+MEALS = [
+    "I ate 2 idlis with sambar for breakfast",
+    "had a bowl of dal and rice for lunch",
+    "I ate a banana and a glass of milk",
+    "had chicken curry with 2 rotis for dinner",
+    "I ate a masala dosa",
+    "had a cup of tea and 2 biscuits",
+    "I ate an omelette with 2 eggs and toast",
+    "had curd rice and pickle",
+]
+QUESTIONS = [
+    "how much protein is in an egg",
+    "is brown rice better than white rice",
+    "what are good sources of iron",
+    "how much water should I drink a day",
+]
+MEAL_SHARE = 0.7
+# a tail percentile of fewer samples is mostly noise and is not compared
+MIN_SAMPLES = {"p50_ms": 1, "p95_ms": 20, "p99_ms": 100}
+
+def percentile(values, share):
+    # nearest rank
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered) + 0.5) - 1))]
+
+def llm_calls(response):
+    '''
+    Model calls of one response, from the llm_* entries of Server-Timing,
+    or None without that header.
+    '''
+    header = response.headers.get("server-timing")
+    if header is None:
+        return None
+    calls = 0
+    for entry in header.split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        if name.startswith("llm_"):
+            for param in params:
+                if param.startswith('desc="x'):
+                    calls += int(param[len('desc="x'):-1])
+    return calls
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self.reported = set()
+
+    async def call(self, route, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            status, calls = response.status_code, llm_calls(response)
+            if status >= 400 and route not in self.reported:
+                # the first failure of each route, the rest only counts
+                self.reported.add(route)
+                print(f"❌ {route}: {status} {response.text[:200]}")
+        except Exception as e:
+            print(f"❌ {route}: {e!r}")
+            response, status, calls = None, 0, None
+        self.samples.append((route, status, time.perf_counter() - start, calls))
+        return response
+
+async def journey(client, recorder, name, rng, queries):
+    credentials = {"username": name, "email": f"{name}@example.com", "password": "load-test-pw"}
+    await recorder.call("/signup", client.post("/signup", json=credentials))
+    await recorder.call("/login", client.post("/login", json=credentials))
+    await recorder.call("/start", client.post("/start", json={"time_frame": 30}))
+    for _ in range(queries):
+        text = rng.choice(MEALS) if rng.random() < MEAL_SHARE else rng.choice(QUESTIONS)
+        await recorder.call("/query", client.post("/query", json={"query": text}))
+    await recorder.call("/review", client.get("/review"))
+    await recorder.call("/calculate_score", client.get("/calculate_score"))
+
+def summarize(samples, wall):
+    def stats(rows):
+        latencies = [seconds for _, _, seconds, _ in rows]
+        calls = [count for _, _, _, count in rows if count is not None]
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for _, status, _, _ in rows if not 200 <= status < 300),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "llm_calls_per_request": round(sum(calls) / len(calls), 3) if calls else None,
+        }
+    routes = {}
+    for row in samples:
+        routes.setdefault(row[0], []).append(row)
+    total = stats(samples)
+    total["throughput_rps"] = round(len(samples) / wall, 2) if wall else 0.0
+    total["wall_seconds"] = round(wall, 3)
+    return {"total": total, "routes": {route: stats(rows) for route, rows in sorted(routes.items())}}
+
+def compare(result, baseline, tolerance, slack_ms):
+    '''
+    Returns the regressions of result against baseline as readable lines.
+    Latencies get `tolerance` (relative) plus slack_ms, model calls and
+    error rates none.
+    '''
+    problems = []
+    if result["config"] != baseline.get("config"):
+        print("⚠️  baseline was recorded with other arguments:", baseline.get("config"))
+    base_total, total = baseline["total"], result["total"]
+    if total["throughput_rps"] < base_total["throughput_rps"] * (1 - tolerance):
+        problems.append(f"throughput {total['throughput_rps']} rps < baseline {base_total['throughput_rps']} rps")
+    for route, stats in result["routes"].items():
+        base = baseline["routes"].get(route)
+        if base is None:
+            continue
+        for key, min_samples in MIN_SAMPLES.items():
+            if stats["requests"] < min_samples:
+                continue
+            if stats[key] > base[key] * (1 + tolerance) + slack_ms:
+                problems.append(f"{route} {key} {stats[key]} > baseline {base[key]}")
+        if stats["llm_calls_per_request"] is not None and base["llm_calls_per_request"] is not None \
+                and stats["llm_calls_per_request"] > base["llm_calls_per_request"] + 1e-9:
+            problems.append(f"{route} llm calls/request {stats['llm_calls_per_request']} > baseline {base['llm_calls_per_request']}")
+        if stats["errors"] / stats["requests"] > base["errors"] / max(base["requests"], 1):
+            problems.append(f"{route} errors {stats['errors']}/{stats['requests']} > baseline {base['errors']}/{base['requests']}")
+    if total.get("llm_calls") is not None and base_total.get("llm_calls") is not None \
+            and total["llm_calls"] > base_total["llm_calls"]:
+        problems.append(f"model calls {total['llm_calls']} > baseline {base_total['llm_calls']}")
+    return problems
+
+def spawn_fake(args):
+    env = {
+        **os.environ,
+        "FAKE_GROQ_LATENCY_MS": str(args.fake_latency_ms),
+        "FAKE_GROQ_429_RATE": str(args.fake_429_rate),
+        "FAKE_GROQ_SEED": str(args.seed),
+        # the journeys measure the app, not the fake's rate limits
+        "FAKE_GROQ_REQUESTS_PER_WINDOW": os.getenv("FAKE_GROQ_REQUESTS_PER_WINDOW", "1000000"),
+        "FAKE_GROQ_TOKENS_PER_WINDOW": os.getenv("FAKE_GROQ_TOKENS_PER_WINDOW", "1000000000"),
+    }
+    env.pop("FAKE_GROQ_REPLY", None)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.fake_groq:app", "--port", str(args.fake_port), "--log-level", "warning"],
+        env=env
+    )
+
+async def fake_stats(httpx, fake_url):
+    if fake_url is None:
+        return None
+    async with httpx.AsyncClient(base_url=fake_url) as client:
+        for _ in range(50):
+            try:
+                return (await client.get("/stats")).json()
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"fake Groq at {fake_url} is not answering")
+
+async def in_process_app(mongo):
+    os.environ.setdefault("METRICS_MODE", "full")
+    import utils.db_utils.db as database
+    if mongo == "memory":
+        try:
+            import mongomock_motor
+        except ImportError:
+            sys.exit("--mongo memory needs mongomock-motor (pip install mongomock-motor)")
+        database.set_client(mongomock_motor.AsyncMongoMockClient())
+    from server import app
+    await database.init_db()
+    return app
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=None, help="journeys at once, default all")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--mongo", choices=("memory", "env"), default="memory")
+    parser.add_argument("--spawn-fake", action="store_true")
+    parser.add_argument("--fake-url", default=None, help="fake Groq to read call counts from")
+    parser.add_argument("--fake-port", type=int, default=8011)
+    parser.add_argument("--fake-latency-ms", type=float, default=50)
+    parser.add_argument("--fake-429-rate", type=float, default=0.0)
+    parser.add_argument("--save", default=None)
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--slack-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    import httpx
+
+    fake = None
+    fake_url = args.fake_url
+    if args.spawn_fake:
+        fake = spawn_fake(args)
+        fake_url = f"http://127.0.0.1:{args.fake_port}"
+        os.environ["GROQ_BASE_URL"] = fake_url
+    try:
+        before = await fake_stats(httpx, fake_url)
+        if args.url is None:
+            transport = httpx.ASGITransport(app=await in_process_app(args.mongo))
+            base_url = "http://load.test"
+        else:
+            transport = None
+            base_url = args.url
+
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:6]
+        semaphore = asyncio.Semaphore(args.concurrency or args.users)
+
+        async def one(number):
+            async with semaphore:
+                # the journeys authenticate with the login cookie, like the app
+                headers = {"X-Requested-With": "load_test"}
+                async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120, headers=headers) as client:
+                    await journey(client, recorder, f"load_{run_id}_{number}", random.Random(args.seed * 100003 + number), args.queries)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(number) for number in range(args.users)))
+        wall = time.perf_counter() - start
+        after = await fake_stats(httpx, fake_url)
+    finally:
+        if fake is not None:
+            fake.terminate()
+            fake.wait()
+
+    result = summarize(recorder.samples, wall)
+    result["config"] = {
+        "users": args.users, "queries": args.queries, "concurrency": args.concurrency, "seed": args.seed,
+        "target": "url" if args.url else f"in-process/{args.mongo}",
+        "fake_latency_ms": args.fake_latency_ms if args.spawn_fake else None,
+        "fake_429_rate": args.fake_429_rate if args.spawn_fake else None,
+    }
+    if before is not None and after is not None:
+        result["total"]["llm_calls"] = after["requests"] - before["requests"]
+        result["total"]["llm_429s"] = (after["budget_429"] + after["injected_429"]) - (before["budget_429"] + before["injected_429"])
+
+    print(json.dumps(result, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(result, json.load(f), args.tolerance, args.slack_ms)
+        for problem in problems:
+            print("❌", problem)
+        if problems:
+            sys.exit(1)
+        print("✅ no regression against", args.compare)
+
+if __name__ == "__main__":
+    asyncio.run(main())
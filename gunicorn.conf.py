@@ -0,0 +1,40 @@
+'''
+Multi-worker deployment, which needs gunicorn and uvicorn-worker:
+
+    pip install gunicorn uvicorn-worker
+    gunicorn -c gunicorn.conf.py server:app
+
+Every worker is a full copy of the app with its own Mongo and Groq
+clients, bcrypt threads, caches and job workers, all opened by the app's
+lifespan. Caches that must agree across workers (users, verified tokens,
+revocations) hear about each other's writes through the cache_events
+collection, which is turned on when WEB_CONCURRENCY is above 1.
+
+PRELOAD_APP=true imports the app once in the parent before forking, which
+saves memory and boot time and surfaces import errors before any worker
+starts. It is safe because nothing at import opens a socket, thread or
+task. Plain `uvicorn server:app --workers N` also works, with
+WEB_CONCURRENCY=N set so cache events are turned on.
+'''
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# uvicorn.workers is deprecated in favour of the uvicorn-worker package
+worker_class = os.getenv("WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+preload_app = os.getenv("PRELOAD_APP", "false").lower() == "true"
+
+# a worker silent this long is killed and replaced
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+# on SIGTERM a worker stops accepting, finishes its requests and then runs
+# the lifespan shutdown, which waits up to LLM_DRAIN_SECONDS for model
+# calls; this must cover both or the worker is killed mid-reply
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "45"))
+keepalive = int(os.getenv("KEEPALIVE_SECONDS", "5"))
+# recycling workers bounds slow leaks; the jitter keeps them from all
+# restarting at once. 0 disables it
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+
+# the app reads WEB_CONCURRENCY to decide on cross-worker cache events
+os.environ["WEB_CONCURRENCY"] = str(workers)
@@ -1,28 +1,66 @@
 from schemas.user import UserCreate, UserPublic
 from utils.db_utils.db import db
-from passlib.context import CryptContext
 from bson import ObjectId
-from fastapi import APIRouter, HTTPException
+from pymongo.errors import DuplicateKeyError
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Literal
+import os
 from fastapi.responses import JSONResponse
 from utils.auth_utils.jwt_create_validate import create_access_token
+from utils.auth_utils.password_pool import hash_password, verify_password, PasswordPoolBusy
+from utils.db_utils.user_cache import load_user
+from utils.db_utils.nutrient_sheet import load_sheet_summary
+from utils.auth_utils.route_checkup import get_current_user, revoke_user_tokens
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=['bcrypt'],deprecated='auto')
+
+# what /login sends of the sheet unless asked otherwise: "full" sends every
+# day as clients have always read it, "summary" (opt-in, or ?sheet=summary)
+# keeps the reply the same size however long the challenge
+LOGIN_SHEET = os.getenv("LOGIN_SHEET", "full")
+
+LOGIN_PROJECTION = {"username": 1, "email": 1, "hashed_password": 1, "token_version": 1}
+
+def _identity_filter(user):
+    # username is optional; without one only the email identifies the user
+    clauses = [{"email": user.email}]
+    if user.username is not None:
+        clauses.insert(0, {"username": user.username})
+    return {"$or": clauses}
+
+async def _find_identity(user, projection):
+    '''
+    Users matching the username or the email, in one query. At most two
+    can match thanks to the unique indexes.
+    '''
+    return await db.users.find(_identity_filter(user), projection).to_list(2)
+
+async def _run_password_check(check, *args):
+    try:
+        return await check(*args)
+    except PasswordPoolBusy as e:
+        raise HTTPException(status_code=503,detail=str(e))
 
 @router.post("/signup",response_model=UserPublic)
 async def signup(user: UserCreate):
-    if await db.users.find_one({"username":user.username}):
+    existing = await _find_identity(user,{"username":1})
+    if any(user.username is not None and doc.get("username") == user.username for doc in existing):
         raise HTTPException(status_code=400,detail="User already exists with such username.")
-    if await db.users.find_one({"email":user.email}):
+    if existing:
         raise HTTPException(status_code=400,detail="User already exists with such email.")
     
-    hashed_pw = pwd_context.hash(user.password)
+    hashed_pw = await _run_password_check(hash_password,user.password)
     
     user_dict = user.dict()
     user_dict["hashed_password"] = hashed_pw
     del user_dict["password"]
     
-    result = await db.users.insert_one(user_dict)
+    try:
+        result = await db.users.insert_one(user_dict)
+    except DuplicateKeyError as e:
+        # lost a race with another signup; the unique indexes have the last word
+        field = "email" if "email" in str((e.details or {}).get("keyPattern", e)) else "username"
+        raise HTTPException(status_code=400,detail=f"User already exists with such {field}.")
     
     return UserPublic(
         id=str(result.inserted_id),
@@ -31,28 +69,39 @@ async def signup(user: UserCreate):
     )
     
 @router.post("/login")
-async def login(user: UserCreate):
-    db_user = await db.users.find_one({"username":user.username})
-    if not db_user:
-        db_user = await db.users.find_one({"email":user.email})
+async def login(user: UserCreate, sheet: Literal["summary","full","none"] = Query(LOGIN_SHEET)):
+    matches = await _find_identity(user,LOGIN_PROJECTION)
+    # a username match wins over an email match, as before
+    db_user = next((doc for doc in matches if user.username is not None and doc.get("username") == user.username), None)
+    if db_user is None and matches:
+        db_user = matches[0]
         
     if not db_user:
         raise HTTPException(status_code=404,detail="User not found!")
     
-    if not pwd_context.verify(user.password,db_user["hashed_password"]):
+    valid,new_hash = await _run_password_check(verify_password,user.password,db_user["hashed_password"])
+    if not valid:
         raise HTTPException(status_code=401,detail="Invalid Credentials") 
+    if new_hash:
+        # stored hash was made with an older bcrypt cost
+        await db.users.update_one({"_id":db_user["_id"]},{"$set":{"hashed_password":new_hash}})
     
-    access_token = create_access_token(data={"sub":str(db_user["_id"])})
+    access_token = create_access_token(data={"sub":str(db_user["_id"]),"ver":db_user.get("token_version",0)})
+    
+    user_content = {
+        "id": str(db_user["_id"]),
+        "username": db_user.get("username"),
+        "email": db_user["email"],
+    }
+    if sheet == "full":
+        user_content["overall_nutrients_sheet"] = (await load_user(str(db_user["_id"]),("overall_nutrient_sheet",)) or {}).get("overall_nutrient_sheet")
+    elif sheet == "summary":
+        user_content["sheet_summary"] = await load_sheet_summary(db_user["_id"])
     
     response = JSONResponse(
         content={
             "message": "login successful!",
-            "user":{
-                "id": str(db_user["_id"]),
-                "username": db_user["username"],
-                "email": db_user["email"],
-                "overall_nutrients_sheet": db_user["overall_nutrient_sheet"]
-            }
+            "user":user_content
         }
     )
     
@@ -65,4 +114,15 @@ async def login(user: UserCreate):
         max_age=3600,
     )
     
-    return response
\ No newline at end of file
+    return response
+
+@router.post("/logout")
+async def logout(user: dict = Depends(get_current_user)):
+    '''
+    Signs the user out on every device: all tokens issued so far are
+    revoked, and the cookie of this one is cleared.
+    '''
+    await revoke_user_tokens(str(user["_id"]))
+    response = JSONResponse(content={"message": "logout successful!"})
+    response.delete_cookie(key="access_token", httponly=True, samesite="lax")
+    return response
@@ -1,43 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from utils.auth_utils.route_checkup import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from utils.auth_utils.route_checkup import BearerUser, CurrentUser, get_current_user
 from utils.db_utils.db import db
+from utils.db_utils.user_cache import invalidate_user
+from utils.config_utils.registry import get_settings
+from pymongo import ReturnDocument
 from pydantic import BaseModel, Field
+from typing import List
 from datetime import datetime,timedelta,date
-from bson import ObjectId
 from dotenv import load_dotenv
 load_dotenv()
 import os
-import json
-from utils.llm_utils.agents import nutri_orchestrator,omni_knowledge_bot,nutri_scanner,gap_detector,diet_builder,nutri_reflector,clean_json,missy_monitor,calculate_diet_score_with_penalty
+import asyncio
+from utils.llm_utils.agents import is_food_log,omni_knowledge_bot,diet_builder,nutri_reflector,missy_monitor
+from utils.llm_utils.agents import stream_omni_knowledge_bot,stream_diet_builder,stream_nutri_reflector
+from utils.llm_utils.sse import sse_response,token_events,single_event,replay
+from utils.llm_utils.advice_cache import cached_advice,lookup_advice,store_advice
+from utils.score_utils.aggregates import initial_aggregates, gap_from_aggregates, score_from_aggregates, missed_days
+from utils.llm_utils.scanner_cache import scan_meal
+from utils.db_utils.nutrient_sheet import day_index, log_meal, log_meals, load_aggregates, load_miss_dates, new_generation, SheetBusy
+from utils.db_utils.sheet_store import encode_sheet, decode_sheet
+from utils.jobs_utils.digest import digest_comment, digest_score, request_digest, KUDOS
 
 router = APIRouter()
 
+# /query/batch: entries per request and meals scanned at once
+QUERY_BATCH_MAX_ENTRIES = int(os.getenv("QUERY_BATCH_MAX_ENTRIES", "200"))
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "4"))
+# client clocks run a little ahead; meals further in the future are refused
+CLOCK_SKEW = timedelta(minutes=5)
+
 class Query(BaseModel):
     query: str
+
+class MealEntry(BaseModel):
+    query: str = Field(...,min_length=1)
+    logged_at: datetime
+
+class MealBatch(BaseModel):
+    entries: List[MealEntry] = Field(...,min_length=1,max_length=QUERY_BATCH_MAX_ENTRIES)
     
 class TimeFrame(BaseModel):
     time_frame: int = Field(...,ge=1)
 
 @router.post('/start')
-async def start(payload: TimeFrame,user_id: dict = Depends(get_current_user)):
+async def start(payload: TimeFrame,user: dict = Depends(get_current_user)):
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
-        
-        user["start_date"] = datetime.utcnow()
-        user["time_frame"] = payload.time_frame
-        nutrients_list = json.loads(os.getenv("NUTRIENTS_LIST"))
+        settings = get_settings()
+        nutrients_list = settings.nutrients_list
         overall_nutrient_intake_sheet = {nutrient: [0] * payload.time_frame for nutrient in nutrients_list}
-        user["overall_nutrient_sheet"] = overall_nutrient_intake_sheet
-        user["attendance" ] = [False] * payload.time_frame
-        user["frequency"] = [0] * payload.time_frame
-        
-        await db.users.replace_one(
-            {"_id": ObjectId(user_id)},
-            user,
-            upsert=True
+        aggregates, day_scores = initial_aggregates(nutrients_list, payload.time_frame, settings.balanced_diet_sheet)
+        user = await db.users.find_one_and_update(
+            {"_id": user["_id"]},
+            {"$set": {
+                "start_date": datetime.utcnow(),
+                "time_frame": payload.time_frame,
+                "aggregates": new_generation(aggregates),
+                **encode_sheet({
+                    "overall_nutrient_sheet": overall_nutrient_intake_sheet,
+                    "attendance": [False] * payload.time_frame,
+                    "frequency": [0] * payload.time_frame,
+                    "day_scores": day_scores,
+                }),
+            },
+            "$inc": {"sheet_rev": 1}},
+            projection={"hashed_password": 0, "day_scores": 0},
+            return_document=ReturnDocument.AFTER
         )
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found.")
+        invalidate_user(user["_id"])
+        decode_sheet(user)
         user["_id"] = str(user["_id"])
         user["start_date"] = user["start_date"].isoformat()
         
@@ -48,47 +80,111 @@ async def start(payload: TimeFrame,user_id: dict = Depends(get_current_user)):
             detail=f"An error occurred at start: {str(e)}"
         )
 
+async def log_food(user_query,user):
+    try:
+        cleaned_json_output,remarks = await scan_meal(user_query=user_query)
+    except Exception as e:
+        raise ValueError("Error during cleaning: ",e)
+    try:
+        index = day_index(user["start_date"],user["time_frame"],datetime.today())
+        user = await log_meal(user["_id"],index,cleaned_json_output)
+        user["_id"] = str(user["_id"])
+        user["start_date"] = user["start_date"].isoformat()
+    except SheetBusy:
+        raise
+    except Exception as e:
+        raise ValueError("Error while modifying overall nutrient sheet: ",e)
+    return {"nutri_scanner":remarks,"updated_user_details":user}
+
 @router.post('/query')
-async def query(payload: Query,user_id: dict = Depends(get_current_user)):
+async def query(payload: Query,user: dict = Depends(CurrentUser("start_date","time_frame"))):
     '''
     1. call nutriscanner and returns back response
     2. update the overall_nutrient_intake_sheet
     '''
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")         
-        
-        initial_response = nutri_orchestrator(user_query=payload.query)
+        if await is_food_log(user_query=payload.query):
+            return await log_food(payload.query,user)
+        else:
+            response = await omni_knowledge_bot(user_query=payload.query)
+            return {"omni_knowledge_bot":response}
+    except SheetBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred: {str(e)}"
+        )
 
-        if isinstance(initial_response,str):
-            initial_response = initial_response.strip().lower()
-        if initial_response == "yes":
-            json_output = nutri_scanner(nutrient_sheet_per_food_item=os.getenv("NUTRIENT_SHEET_PER_FOOD_ITEM"),user_query=payload.query)
-            try:
-                cleaned_json_output,remarks = clean_json(json_output)
-            except Exception as e:
-                raise ValueError("Error during cleaning: ",e)
+def _local_time(when):
+    # day_index counts in server local time, like datetime.today() in /query
+    return when.astimezone().replace(tzinfo=None) if when.tzinfo is not None else when
+
+@router.post('/query/batch')
+async def query_batch(payload: MealBatch,user: dict = Depends(CurrentUser("start_date","time_frame"))):
+    '''
+    Offline sync: logs meals queued on the device in one request. Every
+    entry is a meal eaten at logged_at and goes to that day of the
+    challenge. Meals are scanned a few at a time and written together in
+    one update. Entries that cannot be logged are reported in `results`
+    (same order as `entries`) and do not stop the others.
+    '''
+    try:
+        entries = payload.entries
+        results = [None] * len(entries)
+        latest = datetime.today() + CLOCK_SKEW
+        indexed = []
+        for position in sorted(range(len(entries)), key=lambda position: _local_time(entries[position].logged_at)):
+            when = _local_time(entries[position].logged_at)
             try:
-                for key,val in cleaned_json_output.items():
-                    index = (datetime.today()-user["start_date"]).days
-                    user["overall_nutrient_sheet"][key][index] += val
-                index = (datetime.today()-user["start_date"]).days
-                user["attendance"][index] = True
-                user["frequency"][index] = user["frequency"][index] + 1
-                await db.users.replace_one(
-                    {"_id": ObjectId(user_id)},
-                    user,
-                    upsert=True
-                )
-                user["_id"] = str(user["_id"])
-                user["start_date"] = user["start_date"].isoformat()
-            except Exception as e:
-                raise ValueError("Error while modifying overall nutrient sheet: ",e)
-            return {"nutri_scanner":remarks,"updated_user_details":user}
+                if when > latest:
+                    raise ValueError("Meal is logged in the future.")
+                indexed.append((position, day_index(user["start_date"],user["time_frame"],when)))
+            except ValueError as e:
+                results[position] = {"logged": False, "error": str(e)}
+
+        semaphore = asyncio.Semaphore(QUERY_BATCH_CONCURRENCY)
+        async def scan(position):
+            async with semaphore:
+                return await scan_meal(user_query=entries[position].query)
+        scanned = await asyncio.gather(*(scan(position) for position, _ in indexed), return_exceptions=True)
+
+        meals = []
+        for (position, index), outcome in zip(indexed, scanned):
+            if isinstance(outcome, Exception):
+                results[position] = {"logged": False, "error": f"Error during cleaning: {outcome}"}
+                continue
+            nutrients, remarks = outcome
+            meals.append((index, nutrients))
+            results[position] = {"logged": True, "day": index, "nutri_scanner": remarks}
+
+        updated = None
+        if meals:
+            updated = await log_meals(user["_id"],meals)
+            updated["_id"] = str(updated["_id"])
+            updated["start_date"] = updated["start_date"].isoformat()
+        return {"results": results, "updated_user_details": updated}
+    except SheetBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred in batch query: {str(e)}"
+        )
+
+@router.post('/query/stream')
+async def query_stream(payload: Query,request: Request,user: dict = Depends(CurrentUser("start_date","time_frame"))):
+    '''
+    /query as server-sent events: knowledge-bot answers arrive as "token"
+    events; a food log is answered with a single "done" event.
+    '''
+    try:
+        if await is_food_log(user_query=payload.query):
+            return sse_response(single_event(await log_food(payload.query,user)))
         else:
-            response = omni_knowledge_bot(user_query=payload.query)
-            return {"omni_knowledge_bot":response}
+            return sse_response(token_events(request,stream_omni_knowledge_bot(user_query=payload.query),"omni_knowledge_bot"))
+    except SheetBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -96,20 +192,18 @@ async def query(payload: Query,user_id: dict = Depends(get_current_user)):
         )
 
 @router.get('/diet_suggestions')
-async def diet_suggestions(user_id: dict = Depends(get_current_user)):
+async def diet_suggestions(user: dict = Depends(CurrentUser("aggregates","sheet_rev","advice"))):
     '''
     1. calls gap detector
     2. calls diet_builder and returns back response
     '''
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
         try:            
-            gap_sheet = gap_detector(overall_nutrient_intake_sheet=user["overall_nutrient_sheet"],balanced_diet_sheet=json.loads(os.getenv("BALANCED_DIET_SHEET")))
+            aggregates = await load_aggregates(user)
+            gap_sheet = gap_from_aggregates(aggregates,get_settings().balanced_diet_sheet)
         except Exception as e:
             raise ValueError("Error in gap_detector: ",e)
-        response = diet_builder(gap_sheet=gap_sheet)
+        response = await cached_advice("diet_builder",gap_sheet,user,diet_builder)
         return {"diet_builder":response}
     except Exception as e:
         raise HTTPException(
@@ -117,20 +211,41 @@ async def diet_suggestions(user_id: dict = Depends(get_current_user)):
             detail=f"An error occurred in dietbuilder: {str(e)}"
         )    
 
+@router.get('/diet_suggestions/stream')
+async def diet_suggestions_stream(request: Request,user: dict = Depends(CurrentUser("aggregates","sheet_rev","advice"))):
+    '''
+    /diet_suggestions as server-sent events: "token" events while diet_builder
+    writes, then "done" with the full reply.
+    '''
+    try:
+        try:            
+            aggregates = await load_aggregates(user)
+            gap_sheet = gap_from_aggregates(aggregates,get_settings().balanced_diet_sheet)
+        except Exception as e:
+            raise ValueError("Error in gap_detector: ",e)
+        cached = await lookup_advice("diet_builder",gap_sheet,user)
+        if cached is not None:
+            return sse_response(token_events(request,replay(cached),"diet_builder"))
+        on_done = lambda reply: store_advice("diet_builder",gap_sheet,user,reply)
+        return sse_response(token_events(request,stream_diet_builder(gap_sheet=gap_sheet),"diet_builder",on_done=on_done))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred in dietbuilder: {str(e)}"
+        )
+
 @router.get('/review')
-async def review(user_id: dict = Depends(get_current_user)):
+async def review(user: dict = Depends(CurrentUser("aggregates","sheet_rev","advice"))):
     '''
     1. calls nutriReflector and returns back the response
     '''
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
         try:            
-            gap_sheet = gap_detector(overall_nutrient_intake_sheet=user["overall_nutrient_sheet"],balanced_diet_sheet=json.loads(os.getenv("BALANCED_DIET_SHEET")))
+            aggregates = await load_aggregates(user)
+            gap_sheet = gap_from_aggregates(aggregates,get_settings().balanced_diet_sheet)
         except Exception as e:
             raise ValueError("Error in gap_detector: ",e)
-        response = nutri_reflector(gap_sheet=gap_sheet)
+        response = await cached_advice("nutri_reflector",gap_sheet,user,nutri_reflector)
         return {"nutri_reflector":response}
     except Exception as e:
         raise HTTPException(
@@ -138,20 +253,56 @@ async def review(user_id: dict = Depends(get_current_user)):
             detail=f"An error occurred review: {str(e)}"
         )
 
+@router.get('/review/stream')
+async def review_stream(request: Request,user: dict = Depends(CurrentUser("aggregates","sheet_rev","advice"))):
+    '''
+    /review as server-sent events: "token" events while nutri_reflector
+    writes, then "done" with the full reply.
+    '''
+    try:
+        try:            
+            aggregates = await load_aggregates(user)
+            gap_sheet = gap_from_aggregates(aggregates,get_settings().balanced_diet_sheet)
+        except Exception as e:
+            raise ValueError("Error in gap_detector: ",e)
+        cached = await lookup_advice("nutri_reflector",gap_sheet,user)
+        if cached is not None:
+            return sse_response(token_events(request,replay(cached),"nutri_reflector"))
+        on_done = lambda reply: store_advice("nutri_reflector",gap_sheet,user,reply)
+        return sse_response(token_events(request,stream_nutri_reflector(gap_sheet=gap_sheet),"nutri_reflector",on_done=on_done))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred review: {str(e)}"
+        )
+
 @router.get('/reset')
-async def reset(user_id: dict = Depends(get_current_user)):
+async def reset(user: dict = Depends(BearerUser())):
+    '''
+    Wipes the challenge. Bearer token only: with the login cookie any
+    cross-site link or image could reset a user.
+    '''
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
+        user = await db.users.find_one_and_update(
+            {"_id": user["_id"]},
+            {"$set": {
+                "time_frame": None,
+                "start_date": None,
+                "overall_nutrient_sheet": None,
+                "attendance": None,
+                "frequency": None,
+                "aggregates": None,
+                "day_scores": None,
+                "sheet_format": None,
+            },
+            "$inc": {"sheet_rev": 1}},
+            projection={"hashed_password": 0, "day_scores": 0},
+            return_document=ReturnDocument.AFTER
+        )
         if not user:
             raise HTTPException(status_code=404, detail="User not found.")
-        
-        user["time_frame"] = None
-        user["start_date"] = None
-        user["overall_nutrient_sheet"] = None
-        user["attendance"] = None
-        user["frequency"] = None
-        
-        await db.users.replace_one({"_id": ObjectId(user_id)},user,upsert=True)
+        invalidate_user(user["_id"])
+        decode_sheet(user)
         
         user["_id"] = str(user["_id"])
         return {"reset_status":True,"updated_user_details":user}
@@ -162,29 +313,29 @@ async def reset(user_id: dict = Depends(get_current_user)):
         )
         
 @router.get('/check_skips')
-async def check_skips(user_id: dict = Depends(get_current_user)):
+async def check_skips(user: dict = Depends(CurrentUser("start_date","aggregates","sheet_rev","daily_digest"))):
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
         try:            
             today = date.today()
             start_date = user["start_date"].date()  # convert to date only
-            attendance = user["attendance"]
-            miss_dates = [
-                start_date + timedelta(days=i)
-                for i, attended in enumerate(attendance)
-                if not attended and (start_date + timedelta(days=i)) <= today
-            ]
-            if len(miss_dates)>0:
+            aggregates = await load_aggregates(user)
+            missed = missed_days(aggregates,start_date,today)
+            if missed>0:
+                # the nightly digest usually has the comment already
+                comments = digest_comment(user.get("daily_digest"),missed,today)
+                if comments is not None:
+                    return {"Miss_Flag":True,"missy_monitor":comments}
+                await request_digest(user,today)
+                days_elapsed = min((today - start_date).days + 1,aggregates["days"])
+                miss_dates = await load_miss_dates(user["_id"],start_date,days_elapsed)
                 miss_dates_str = [d.strftime("%d-%m-%Y") for d in miss_dates]
                 try:
-                    comments = missy_monitor(miss_dates_str)
+                    comments = await missy_monitor(miss_dates_str)
                     return {"Miss_Flag":True,"missy_monitor":comments}
                 except Exception as e:
                     raise ValueError("Error in missy_monitor: ",e) 
             else:
-                return {"Miss_Flag":False,"missy_monitor":"Kudos! for your discipline!"}
+                return {"Miss_Flag":False,"missy_monitor":KUDOS}
         except Exception as e:
             raise ValueError("Error in gap_detector: ",e)
     except Exception as e:
@@ -193,24 +344,50 @@ async def check_skips(user_id: dict = Depends(get_current_user)):
             detail=f"An error occurred check skips: {str(e)}"
         )
 
+@router.get('/home')
+async def home(user: dict = Depends(CurrentUser("start_date","aggregates","sheet_rev","daily_digest","overall_nutrient_sheet"))):
+    '''
+    Everything the home screen shows, without calling a model: the sheet,
+    the missed days comment from the nightly digest and the score. When the
+    digest does not cover the current state, missy_monitor is None, a digest
+    is queued and the app can ask /check_skips instead.
+    '''
+    try:
+        if user.get("start_date") is None:
+            return {"overall_nutrient_sheet":None,"Miss_Flag":False,"missy_monitor":None,"score_calculator":None,"dates in which you have cheated":[]}
+        today = date.today()
+        start_date = user["start_date"].date()
+        aggregates = await load_aggregates(user)
+        missed = missed_days(aggregates,start_date,today)
+        comments = digest_comment(user.get("daily_digest"),missed,today)
+        if comments is None:
+            await request_digest(user,today)
+        score = digest_score(user.get("daily_digest"),user.get("sheet_rev"),today) or score_from_aggregates(aggregates,start_date,today)
+        return {
+            "overall_nutrient_sheet":user["overall_nutrient_sheet"],
+            "Miss_Flag":missed>0,
+            "missy_monitor":comments,
+            "score_calculator":score[0],
+            "dates in which you have cheated":score[1]
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred home: {str(e)}"
+        )
+
 @router.get('/calculate_score')
-async def score_calculator(user_id: dict = Depends(get_current_user)):
+async def score_calculator(user: dict = Depends(CurrentUser("start_date","aggregates","sheet_rev","daily_digest"))):
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
         try:            
             today = date.today()
             start_date = user["start_date"].date()  # convert to date only
-            attendance = user["attendance"]
-            miss_dates = [
-                start_date + timedelta(days=i)
-                for i, attended in enumerate(attendance)
-                if not attended and (start_date + timedelta(days=i)) <= today
-            ]
-            frequency_of_missing = len(miss_dates)
-            overall_nutrient_intake_sheet = user["overall_nutrient_sheet"]
-            score,cheat_dates = calculate_diet_score_with_penalty(overall_nutrient_intake_sheet=overall_nutrient_intake_sheet,balanced_diet_sheet=json.loads(os.getenv("BALANCED_DIET_SHEET")),daily_frequency_list=user["frequency"],frequency_of_missing=frequency_of_missing,start_date=start_date)
+            stored = digest_score(user.get("daily_digest"),user.get("sheet_rev"),today)
+            if stored is not None:
+                score,cheat_dates = stored
+            else:
+                aggregates = await load_aggregates(user)
+                score,cheat_dates = score_from_aggregates(aggregates,start_date,today)
             return {"score_calculator" : score,"dates in which you have cheated" : cheat_dates}
         except Exception as e:
             raise ValueError("Error in score calculator: ",e)
@@ -0,0 +1,47 @@
+'''
+Converts existing users' nutrient sheets between the list and packed layouts.
+
+    python -m scripts.migrate_sheet_storage --to packed [--batch 500] [--dry-run]
+
+Safe to run against a live database: each user is rewritten only if no meal
+was logged since it was read, and users skipped that way are picked up by
+running the script again. Set SHEET_STORAGE to the same layout so /start
+creates new sheets in it too.
+'''
+import argparse
+import asyncio
+from utils.db_utils.db import db
+from utils.db_utils.sheet_store import SHEET_FORMATS
+from utils.db_utils.nutrient_sheet import migrate_sheet
+
+def _pending_filter(storage):
+    current = {"sheet_format": storage}
+    if storage == "lists":
+        current = {"sheet_format": {"$in": ["lists", None]}}
+    return {"overall_nutrient_sheet": {"$ne": None}, "$nor": [current]}
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--to", choices=SHEET_FORMATS, required=True)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    pending = _pending_filter(args.to)
+    total = await db.users.count_documents(pending)
+    print(f"{total} users to convert to {args.to}")
+    if args.dry_run:
+        return
+
+    converted = skipped = 0
+    async for doc in db.users.find(pending, {"_id": 1}, batch_size=args.batch):
+        if await migrate_sheet(doc["_id"], args.to):
+            converted += 1
+        else:
+            skipped += 1
+        if (converted + skipped) % args.batch == 0:
+            print(f"{converted + skipped}/{total}")
+    print(f"converted {converted}, skipped {skipped}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,49 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from routes.routes import router
 from routes.auth import router as auth_router
+from utils.llm_utils.gateway import close_clients, drain, key_stats
+from utils.llm_utils.model_routing import agent_stats
+from utils.llm_utils.fast_classifier import classifier_stats
+from utils.llm_utils.scanner_cache import cache_stats
+from utils.llm_utils.food_store import food_store_stats
+from utils.llm_utils.advice_cache import advice_cache_stats
+from utils.llm_utils.inflight import inflight_stats
+from utils.llm_utils.scanner_batcher import batcher_stats
+from utils.llm_utils.structured_output import parse_stats
+from utils.auth_utils.password_pool import password_pool_stats, shutdown_pool
+from utils.config_utils.registry import get_settings, install_reload_handler
+from utils.db_utils.db import init_db, close_db, pool_stats
+from utils.db_utils.cache_events import start_cache_events, stop_cache_events, cache_events_stats
+from utils.jobs_utils.job_queue import start_jobs, stop_jobs, jobs_stats
+from utils.metrics_utils.metrics import MetricsMiddleware, render_prometheus
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    '''
+    Runs once per worker process. Everything holding sockets, threads or
+    tasks is opened here rather than at import, so a preloaded app (see
+    gunicorn.conf.py) forks before any of it exists.
+    '''
+    # a malformed setting or prompt fails the boot instead of a request
+    get_settings()
+    install_reload_handler()
+    await init_db()
+    await start_cache_events()
+    start_jobs()
+    yield
+    # the server has stopped taking requests and finished the open ones;
+    # background jobs stop first so nothing starts new model calls
+    await stop_jobs()
+    await drain()
+    await close_clients()
+    shutdown_pool()
+    await stop_cache_events()
+    close_db()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(router)
 app.include_router(auth_router)
@@ -15,6 +56,25 @@ def home():
     1. we fetch overall_nutrient_intake_sheet
     2. Check missing dates and call missy monitor if required
     '''
-    print("Welcome to Home...!")
     return {"message":"Home called!" }
 
+@app.get('/llm_stats')
+def llm_stats():
+    return {"api_keys": key_stats(), "agents": agent_stats(), "classifier": classifier_stats(), "scanner_cache": cache_stats(), "food_store": food_store_stats(), "advice_cache": advice_cache_stats(), "inflight": inflight_stats(), "scanner_batcher": batcher_stats(), "structured_output": parse_stats()}
+
+@app.get('/job_stats')
+def job_stats():
+    return {"jobs": jobs_stats()}
+
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get('/db_stats')
+def db_stats():
+    return {"pool": pool_stats(), "cache_events": cache_events_stats()}
+
+@app.get('/auth_stats')
+def auth_stats():
+    return {"password_pool": password_pool_stats()}
+
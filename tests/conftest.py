@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# settings are read at import, so they are set before any app module loads
+TEST_ENV = {
+    "API_KEYS": '["test-key-1","test-key-2"]',
+    "SECRET_KEY": "test-secret-key-that-is-long-enough-for-hs256",
+    "MONGOURL": "mongodb://localhost:1",
+    "NUTRIENTS_LIST": '["Calories (kcal)","Protein (g)","Sodium (mg)"]',
+    "BALANCED_DIET_SHEET": '{"Calories (kcal)":2000,"Protein (g)":50,"Sodium (mg)":2000}',
+    "CLASSIFICATION_PROMPT": "Q: {user_query}",
+    "CLASSIFICATION_SYSTEM_PROMPT": "c",
+    "OMNI_KNOWLEDGE_BOT_PROMPT": "{user_query}",
+    "OMNI_KNOWLEDGE_BOT_SYSTEM_MESSAGE": "o",
+    "NUTRISCANNER_PROMPT": "{nutrient_sheet_per_food_item} {user_query}",
+    "NUTRISCANNER_SYSTEM_MESSAGE": "n",
+    "NUTRIENT_SHEET_PER_FOOD_ITEM": "{}",
+    "DIET_BUILDER_PROMPT": "{gap_sheet}",
+    "DIET_BUILDER_SYSTEM_MESSAGE": "d",
+    "NUTRI_REFLECTOR_PROMPT": "{gap_sheet}",
+    "NUTRI_REFLECTOR_SYSTEM_MESSAGE": "r",
+    "MISSY_MONITOR_PROMPT": "{days_string}",
+    "MISSY_MONITOR_SYSTEM_MESSAGE": "m",
+    "JOBS_ENABLED": "false",
+    "BCRYPT_ROUNDS": "4",
+}
+for name, value in TEST_ENV.items():
+    os.environ.setdefault(name, value)
+
+import pytest
+import mongomock_motor
+import utils.db_utils.db as database
+
+@pytest.fixture(autouse=True)
+def memory_db():
+    '''
+    A fresh in-memory database per test.
+    '''
+    database.set_client(mongomock_motor.AsyncMongoMockClient())
+    yield database.db
+    database.set_client(None)
+
+async def signed_in(client, name="alice"):
+    '''
+    Signs a user up and logs in. Returns the login response, whose cookie
+    the client keeps.
+    '''
+    credentials = {"username": name, "email": f"{name}@example.com", "password": "secret123"}
+    response = await client.post("/signup", json=credentials)
+    assert response.status_code == 200, response.text
+    response = await client.post("/login", json=credentials)
+    assert response.status_code == 200, response.text
+    return response
+
+@pytest.fixture
+def app_client():
+    '''
+    Returns a function making an httpx client on the app, without network.
+    '''
+    import httpx
+    from server import app
+    return lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver")
@@ -0,0 +1,22 @@
+import asyncio
+from types import SimpleNamespace
+from bson import ObjectId
+import utils.llm_utils.advice_cache as advice_cache
+
+def test_user_memo_expires_with_the_prompt(memory_db, monkeypatch):
+    gap_sheet = {"Calories (kcal)": 500.0, "Protein (g)": 10.0, "Sodium (mg)": 0.0}
+
+    async def ask(reply):
+        user = await memory_db.users.find_one({}, {"sheet_rev": 1, "advice": 1})
+        async def generate(gap_sheet):
+            return reply
+        return await advice_cache.cached_advice("diet_builder", gap_sheet, user, generate)
+
+    async def run():
+        await memory_db.users.insert_one({"_id": ObjectId(), "sheet_rev": 4})
+        first = await ask("old advice")
+        again = await ask("unused")
+        monkeypatch.setattr(advice_cache, "get_prompt", lambda agent: SimpleNamespace(version="reloaded"))
+        return first, again, await ask("new advice")
+
+    assert asyncio.run(run()) == ("old advice", "old advice", "new advice")
@@ -0,0 +1,50 @@
+import asyncio
+from conftest import signed_in
+
+def test_cookie_does_not_reset(app_client):
+    async def run():
+        async with app_client() as client:
+            await signed_in(client)
+            assert (await client.post("/start", json={"time_frame": 30}, headers={"X-Requested-With": "fetch"})).status_code == 200
+            # a cross-site link or form only carries the cookie
+            assert (await client.get("/reset")).status_code == 401
+            assert (await client.post("/start", json={"time_frame": 10})).status_code == 401
+            # reads still work with the cookie alone
+            assert (await client.get("/calculate_score")).status_code == 200
+            token = client.cookies["access_token"].strip('"').partition(" ")[2]
+            client.cookies.clear()
+            response = await client.get("/reset", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200, response.text
+            assert response.json()["updated_user_details"]["time_frame"] is None
+
+    asyncio.run(run())
+
+def test_logout_revokes_every_token(app_client):
+    async def run():
+        async with app_client() as client:
+            await signed_in(client, "carol")
+            token = client.cookies["access_token"].strip('"').partition(" ")[2]
+            bearer = {"Authorization": f"Bearer {token}"}
+            assert (await client.get("/home", headers=bearer)).status_code == 200
+            assert (await client.post("/logout", headers=bearer)).status_code == 200
+            client.cookies.clear()
+            # issued before the logout, so refused although it is still fresh
+            assert (await client.get("/home", headers=bearer)).status_code == 401
+            assert (await client.post("/start", json={"time_frame": 5}, headers=bearer)).status_code == 401
+
+    asyncio.run(run())
+
+def test_login_sends_the_full_sheet_by_default(app_client):
+    async def run():
+        async with app_client() as client:
+            response = await signed_in(client, "bob")
+            assert set(response.json()["user"]) == {"id", "username", "email", "overall_nutrients_sheet"}
+            assert response.json()["user"]["overall_nutrients_sheet"] is None
+            await client.post("/start", json={"time_frame": 3}, headers={"X-Requested-With": "fetch"})
+            credentials = {"username": "bob", "email": "bob@example.com", "password": "secret123"}
+            user = (await client.post("/login", json=credentials)).json()["user"]
+            assert user["overall_nutrients_sheet"]["Calories (kcal)"] == [0, 0, 0]
+            summary = (await client.post("/login?sheet=summary", json=credentials)).json()["user"]
+            assert "overall_nutrients_sheet" not in summary and summary["sheet_summary"]["time_frame"] == 3
+
+    asyncio.run(run())
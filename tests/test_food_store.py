@@ -0,0 +1,31 @@
+import asyncio
+import utils.llm_utils.food_store as food_store
+
+def test_items_without_nutrients_are_not_stored(memory_db, monkeypatch):
+    replies = {
+        "1 dosa": ({"Calories (kcal)": 170.0, "Protein (g)": 4.0}, "A dosa."),
+        "1 blah": ({}, "Not a food."),
+    }
+    async def scan_text(description):
+        return replies[description]
+    monkeypatch.setattr(food_store, "scan_text", scan_text)
+    monkeypatch.setattr(food_store, "_index", {})
+
+    async def run():
+        resolved = await food_store.resolve_meal("a dosa and blah")
+        stored = await memory_db.food_items.distinct("_id")
+        return resolved, stored
+
+    resolved, stored = asyncio.run(run())
+    assert resolved is None
+    assert stored == [food_store.item_key("dosa", "")]
+
+def test_item_scan_failure_leaves_the_meal_to_the_whole_scan(memory_db, monkeypatch):
+    async def scan_text(description):
+        if description == "1 idli":
+            raise TimeoutError("model timed out")
+        return {"Calories (kcal)": 170.0}, "A dosa."
+    monkeypatch.setattr(food_store, "scan_text", scan_text)
+    monkeypatch.setattr(food_store, "_index", {})
+
+    assert asyncio.run(food_store.resolve_meal("a dosa and an idli")) is None
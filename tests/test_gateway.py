@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import utils.llm_utils.gateway as gateway
+import utils.llm_utils.model_routing as model_routing
+from utils.config_utils.registry import load_settings
+from utils.llm_utils.key_scheduler import KeyScheduler
+
+class HeldClient:
+    '''
+    Stands in for AsyncGroq: every completion waits until `release` is set.
+    '''
+
+    def __init__(self, started, release):
+        self.started = started
+        self.release = release
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=self))
+
+    async def create(self, **kwargs):
+        self.started.set()
+        await self.release.wait()
+        async def parse():
+            return SimpleNamespace(usage=None)
+        return SimpleNamespace(headers={}, parse=parse)
+
+@pytest.mark.parametrize("new_keys", [["key-a", "key-c"], ["key-c"]])
+def test_reload_during_a_call(monkeypatch, new_keys):
+    monkeypatch.setattr(gateway, "scheduler", KeyScheduler(["key-a"]))
+
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        monkeypatch.setattr(gateway, "get_client", lambda api_key: HeldClient(started, release))
+        call = asyncio.ensure_future(gateway.chat_completion("model", [], timeout=5))
+        await started.wait()
+        # key-a is kept in the first case and removed in the second
+        gateway._on_settings_reload(SimpleNamespace(api_keys=new_keys))
+        release.set()
+        await call
+
+    asyncio.run(run())
+    stats = gateway.key_stats()
+    assert all(key["in_flight"] == 0 for key in stats.values())
+    assert gateway.scheduler.pick() in new_keys
+    if "key-a" in new_keys:
+        assert stats[gateway.scheduler.label("key-a")]["requests"] == 1
+
+def test_reload_picks_up_routing(monkeypatch):
+    monkeypatch.setattr(model_routing, "routes", None)
+    assert model_routing.get_route("diet_builder")["model"] == model_routing.LARGE_MODEL
+    monkeypatch.setenv("LLM_ROUTING", '{"diet_builder": {"model": "llama-3.1-8b-instant"}}')
+    settings, _ = load_settings()
+    model_routing._on_settings_reload(settings)
+    assert model_routing.get_route("diet_builder")["model"] == "llama-3.1-8b-instant"
+    assert model_routing.get_route("diet_builder")["fallback_model"] == model_routing.FAST_MODEL
+
+class HeldStream:
+    def __init__(self):
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+def test_stream_cancelled_as_it_opens(monkeypatch):
+    monkeypatch.setattr(gateway, "scheduler", KeyScheduler(["key-a"]))
+    stream = HeldStream()
+
+    class StreamClient(HeldClient):
+        async def create(self, **kwargs):
+            self.started.set()
+            await self.release.wait()
+            async def parse():
+                return stream
+            return SimpleNamespace(headers={}, parse=parse)
+
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        monkeypatch.setattr(gateway, "get_client", lambda api_key: StreamClient(started, release))
+        async def consume():
+            async for _ in gateway.stream_completion("model", [], timeout=5):
+                pass
+        consumer = asyncio.ensure_future(consume())
+        await started.wait()
+        # the stream opens in the same turn of the loop as the client leaves
+        release.set()
+        consumer.cancel()
+        # depending on the Python version wait_for hands back the stream or drops it
+        await asyncio.gather(consumer, return_exceptions=True)
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert gateway._active == 0
+    assert gateway._semaphore._value == gateway.LLM_MAX_CONCURRENCY
+    assert all(key["in_flight"] == 0 for key in gateway.key_stats().values())
+    assert stream.closed
+
+def test_stream_cancelled_waiting_for_a_slot(monkeypatch):
+    monkeypatch.setattr(gateway, "scheduler", KeyScheduler(["key-a"]))
+
+    async def run():
+        monkeypatch.setattr(gateway, "_semaphore", asyncio.Semaphore(1))
+        started, release = asyncio.Event(), asyncio.Event()
+        monkeypatch.setattr(gateway, "get_client", lambda api_key: HeldClient(started, release))
+        call = asyncio.ensure_future(gateway.chat_completion("model", [], timeout=5))
+        await started.wait()
+        async def consume():
+            async for _ in gateway.stream_completion("model", [], timeout=5):
+                pass
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        # the slot frees up in the same turn of the loop as the client leaves
+        release.set()
+        consumer.cancel()
+        await asyncio.gather(call, consumer, return_exceptions=True)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return gateway._semaphore._value
+
+    assert asyncio.run(run()) == 1
+    assert gateway._active == 0
@@ -0,0 +1,43 @@
+import asyncio
+from datetime import date
+from conftest import signed_in
+from utils.db_utils.nutrient_sheet import log_meal
+from utils.jobs_utils import digest
+from utils.jobs_utils.digest import KUDOS, DIGEST_PROJECTION
+
+def test_home_without_a_digest(app_client, memory_db):
+    async def run():
+        async with app_client() as client:
+            await signed_in(client)
+            await client.post("/start", json={"time_frame": 7}, headers={"X-Requested-With": "fetch"})
+            user = await memory_db.users.find_one({}, {"_id": 1})
+            await log_meal(user["_id"], 0, {"Calories (kcal)": 300.0})
+            response = await client.get("/home")
+            assert response.status_code == 200, response.text
+            return response.json(), await memory_db.users.find_one({}, {"daily_digest": 1})
+
+    home, user = asyncio.run(run())
+    # a user who ate today has missed nothing, so no digest is needed for the comment
+    assert home["Miss_Flag"] is False
+    assert home["missy_monitor"] == KUDOS
+    assert "daily_digest" not in user
+
+def test_nightly_digest_leaves_a_missed_today_alone(app_client, memory_db, monkeypatch):
+    asked = []
+    async def fake_missy_monitor(miss_dates):
+        asked.append(miss_dates)
+        return "where were you?"
+    monkeypatch.setattr(digest, "missy_monitor", fake_missy_monitor)
+
+    async def run():
+        async with app_client() as client:
+            await signed_in(client)
+            await client.post("/start", json={"time_frame": 7}, headers={"X-Requested-With": "fetch"})
+        user = await memory_db.users.find_one({}, DIGEST_PROJECTION)
+        return await digest.build_digest(user, date.today()), await digest.build_digest(user, date.today(), on_demand=True)
+
+    nightly, on_demand = asyncio.run(run())
+    # only today is missed, which a meal later today can still change
+    assert nightly["missy_monitor_with_today"] is None
+    assert on_demand["missy_monitor_with_today"] == "where were you?"
+    assert asked == [[date.today().strftime(digest.DATE_FORMAT)]]
@@ -0,0 +1,17 @@
+import asyncio
+import mongomock_motor
+import utils.db_utils.db as database
+from conftest import signed_in
+
+def test_app_starts_again_after_shutdown(app_client):
+    from server import app, lifespan
+
+    async def run():
+        for name in ("first", "second"):
+            # shutdown closes the client, so every start gets its own
+            database.set_client(mongomock_motor.AsyncMongoMockClient())
+            async with lifespan(app):
+                async with app_client() as client:
+                    await signed_in(client, name)
+
+    asyncio.run(run())
@@ -0,0 +1,22 @@
+import pytest
+from utils.llm_utils.meal_text import normalize_meal, split_meal
+
+@pytest.mark.parametrize("text, items", [
+    ("2 idlis with sambar", [("idli", 2.0, ""), ("sambar", 1.0, "")]),
+    ("1/2 cup oats", [("oat", 0.5, "cup")]),
+    ("1 1/2 cups rice", [("rice", 1.5, "cup")]),
+    ("½ cup dal", [("dal", 0.5, "cup")]),
+    ("paneer 200 g", [("paneer", 200.0, "g")]),
+    ("paneer 200g and a bowl of hummus", [("paneer", 200.0, "g"), ("hummus", 1.0, "bowl")]),
+    ("had a cup of tea and 2 biscuits", [("tea", 1.0, "cup"), ("biscuit", 2.0, "")]),
+])
+def test_split_meal(text, items):
+    assert split_meal(text) == items
+
+@pytest.mark.parametrize("text", [
+    "I ate 2 idlis, it was delicious",
+    "2 eggs 3 toasts",
+])
+def test_split_meal_gives_up_on_text_that_is_not_food(text):
+    assert split_meal(text) == []
+    assert normalize_meal(text) == ""
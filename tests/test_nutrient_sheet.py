@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+import pytest
+from utils.config_utils.registry import get_settings
+from utils.db_utils.nutrient_sheet import day_index, log_meal, log_meals, load_aggregates, new_generation
+from utils.db_utils.sheet_store import encode_sheet, decode_sheet
+from utils.score_utils.aggregates import build_aggregates, initial_aggregates
+
+NUTRIENTS = ["Calories (kcal)", "Protein (g)", "Sodium (mg)"]
+
+async def _user_with_sheet(db, storage, days=3):
+    # no aggregates stored, as after a balanced diet sheet change
+    fields = {
+        "overall_nutrient_sheet": {nutrient: [0.0] * days for nutrient in NUTRIENTS},
+        "attendance": [False] * days,
+        "frequency": [0] * days,
+        "day_scores": None,
+    }
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "start_date": datetime(2026, 1, 1, 9), "time_frame": days, "sheet_rev": 0, **encode_sheet(fields, storage)})
+    return user_id
+
+@pytest.mark.parametrize("storage", ["lists", "packed"])
+def test_log_meals_with_stale_aggregates(memory_db, storage):
+    async def run():
+        user_id = await _user_with_sheet(memory_db, storage)
+        sheet = await log_meals(user_id, [(0, {"Calories (kcal)": 300.0}), (0, {"Calories (kcal)": 200.0, "Protein (g)": 10.0}), (2, {"Sodium (mg)": 5.0})])
+        stored = await memory_db.users.find_one({"_id": user_id}, {"sheet_rev": 1, "aggregates": 1})
+        return sheet, stored
+
+    sheet, stored = asyncio.run(run())
+    assert sheet["overall_nutrient_sheet"]["Calories (kcal)"] == [500.0, 0.0, 0.0]
+    assert sheet["overall_nutrient_sheet"]["Protein (g)"] == [10.0, 0.0, 0.0]
+    assert sheet["frequency"] == [2, 0, 1]
+    assert sheet["attendance"] == [True, False, True]
+    assert stored["sheet_rev"] == 1
+    assert "aggregates" not in stored
+
+def test_packed_batch_with_a_nutrient_new_to_the_sheet(memory_db):
+    async def run():
+        user_id = await _user_with_sheet(memory_db, "packed")
+        # as if Sodium was added to NUTRIENTS_LIST after the sheet was packed
+        await memory_db.users.update_one({"_id": user_id}, {"$unset": {"overall_nutrient_sheet.Sodium (mg)": ""}})
+        return await log_meals(user_id, [(1, {"Sodium (mg)": 3.0}), (1, {"Sodium (mg)": 5.0, "Calories (kcal)": 100.0})])
+
+    sheet = asyncio.run(run())
+    assert sheet["overall_nutrient_sheet"]["Sodium (mg)"] == [0.0, 8.0, 0.0]
+    assert sheet["overall_nutrient_sheet"]["Calories (kcal)"] == [0.0, 100.0, 0.0]
+    assert sheet["frequency"] == [0, 2, 0]
+
+async def _started_user(db, days=3):
+    # as /start leaves it
+    aggregates, day_scores = initial_aggregates(NUTRIENTS, days, get_settings().balanced_diet_sheet)
+    fields = {
+        "overall_nutrient_sheet": {nutrient: [0.0] * days for nutrient in NUTRIENTS},
+        "attendance": [False] * days,
+        "frequency": [0] * days,
+        "day_scores": day_scores,
+    }
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "start_date": datetime(2026, 1, 1, 9), "time_frame": days, "sheet_rev": 0, "aggregates": new_generation(aggregates), **encode_sheet(fields)})
+    return user_id
+
+async def _rebuilt(db, user_id):
+    doc = decode_sheet(await db.users.find_one({"_id": user_id}))
+    aggregates, _ = build_aggregates(doc["overall_nutrient_sheet"], doc["attendance"], doc["frequency"], get_settings().balanced_diet_sheet)
+    return doc, aggregates
+
+def _assert_same_aggregates(aggregates, expected):
+    assert aggregates["nutrient_totals"] == pytest.approx(expected["nutrient_totals"])
+    assert aggregates["attended_days"] == expected["attended_days"]
+    assert aggregates["day_score_total"] == pytest.approx(expected["day_score_total"])
+    assert aggregates["freq_score_total"] == pytest.approx(expected["freq_score_total"])
+    assert sorted(aggregates["cheat_days"]) == sorted(expected["cheat_days"])
+
+def test_aggregates_follow_meal_logs(memory_db):
+    async def run():
+        user_id = await _started_user(memory_db)
+        for index, calories in [(0, 700.0), (0, 900.0), (1, 400.0), (0, 300.0), (0, 200.0)]:
+            await log_meal(user_id, index, {"Calories (kcal)": calories, "Protein (g)": 12.0})
+        doc, expected = await _rebuilt(memory_db, user_id)
+        return doc, expected
+
+    doc, expected = asyncio.run(run())
+    assert doc["aggregates"]["lag"] == 0
+    _assert_same_aggregates(doc["aggregates"], expected)
+
+def test_concurrent_meal_logs_all_count(memory_db):
+    meals = [(index % 3, {"Calories (kcal)": 100.0 + index, "Sodium (mg)": 1.0}) for index in range(24)]
+
+    async def run():
+        user_id = await _started_user(memory_db)
+        await asyncio.gather(*(log_meal(user_id, index, nutrients) for index, nutrients in meals))
+        doc, expected = await _rebuilt(memory_db, user_id)
+        return doc, expected, await load_aggregates({"_id": user_id, "aggregates": doc.get("aggregates")})
+
+    doc, expected, loaded = asyncio.run(run())
+    assert doc["frequency"] == [8, 8, 8]
+    assert sum(doc["overall_nutrient_sheet"]["Calories (kcal)"]) == sum(nutrients["Calories (kcal)"] for _, nutrients in meals)
+    # either every follow-up applied or the aggregates were left to rebuild
+    if doc.get("aggregates") is not None and doc["aggregates"].get("lag") == 0:
+        _assert_same_aggregates(doc["aggregates"], expected)
+    _assert_same_aggregates(loaded, expected)
+
+def test_meal_behind_another_write_leaves_aggregates_to_rebuild(memory_db):
+    async def run():
+        user_id = await _started_user(memory_db)
+        # another worker's meal is in, its aggregates not yet
+        await memory_db.users.update_one({"_id": user_id}, {"$inc": {"overall_nutrient_sheet.Calories (kcal).0": 800.0, "frequency.0": 1, "sheet_rev": 1, "aggregates.lag": 1}, "$set": {"attendance.0": True}})
+        await log_meal(user_id, 0, {"Calories (kcal)": 500.0})
+        doc, expected = await _rebuilt(memory_db, user_id)
+        return doc, expected, await load_aggregates({"_id": user_id, "aggregates": doc.get("aggregates")})
+
+    doc, expected, loaded = asyncio.run(run())
+    assert doc["overall_nutrient_sheet"]["Calories (kcal)"][0] == 1300.0
+    assert doc.get("aggregates") is None
+    _assert_same_aggregates(loaded, expected)
+
+def test_day_index_counts_calendar_days():
+    start_date = datetime(2026, 1, 1, 9, 30)
+    # earlier on the start date than the challenge was started
+    assert day_index(start_date, 30, datetime(2026, 1, 1, 7, 0)) == 0
+    assert day_index(start_date, 30, datetime(2026, 1, 2, 8, 0)) == 1
+    with pytest.raises(ValueError):
+        day_index(start_date, 30, datetime(2025, 12, 31, 23, 0))
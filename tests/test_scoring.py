@@ -0,0 +1,36 @@
+import random
+from datetime import timedelta
+import pytest
+from benchmarks.bench_scoring import NUTRIENTS, random_user
+from utils.llm_utils.agents import calculate_diet_score_with_penalty, gap_detector
+from utils.score_utils.scoring_engine import calculate_diet_score_vectorized, score_batch, gap_detector_vectorized
+from utils.score_utils.aggregates import build_aggregates, score_from_aggregates, gap_from_aggregates
+
+def _users(days, count=50, seed=7):
+    rng = random.Random(seed * 1000 + days)
+    return [random_user(rng, days) for _ in range(count)]
+
+@pytest.mark.parametrize("days", [1, 30, 90, 365])
+def test_vectorized_scores_match_the_loop(days):
+    users = _users(days)
+    batch = score_batch(users, NUTRIENTS)
+    for user, batch_result in zip(users, batch):
+        expected = calculate_diet_score_with_penalty(balanced_diet_sheet=NUTRIENTS, **user)
+        assert calculate_diet_score_vectorized(balanced_diet_sheet=NUTRIENTS, **user) == expected
+        assert batch_result == expected
+        sheet = user["overall_nutrient_intake_sheet"]
+        assert gap_detector_vectorized(sheet, NUTRIENTS) == gap_detector(sheet, NUTRIENTS)
+
+@pytest.mark.parametrize("days", [1, 30, 365])
+def test_aggregate_scores_match_the_loop(days):
+    for user in _users(days):
+        expected = calculate_diet_score_with_penalty(balanced_diet_sheet=NUTRIENTS, **user)
+        frequency = user["daily_frequency_list"]
+        sheet = user["overall_nutrient_intake_sheet"]
+        aggregates, _ = build_aggregates(sheet, [meals > 0 for meals in frequency], frequency, NUTRIENTS)
+        last_day = user["start_date"].date() + timedelta(days=len(frequency) - 1)
+        score, cheat_days = score_from_aggregates(aggregates, user["start_date"], last_day)
+        assert score == expected[0]
+        assert cheat_days == expected[1]
+        gaps = gap_detector(sheet, NUTRIENTS)
+        assert gap_from_aggregates(aggregates, NUTRIENTS) == pytest.approx(gaps, rel=1e-6, abs=1e-6)
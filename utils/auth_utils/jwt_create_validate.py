@@ -1,25 +1,46 @@
 import jwt
+import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-import os
+from fastapi import HTTPException
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+
+# token -> verified claims, dropped once the token's exp has passed
+_verified = OrderedDict()
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire, "iat": now})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def verify_access_token(token: str):
+    cached = _verified.get(token)
+    if cached is not None:
+        if cached["exp"] > time.time():
+            return cached
+        del _verified[token]
+        raise HTTPException(status_code=401, detail="Token expired")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError as e:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=403, detail="Invalid token")
+    if "exp" in payload:
+        _verified[token] = payload
+        if len(_verified) > TOKEN_CACHE_MAX_ENTRIES:
+            _verified.popitem(last=False)
+    return payload
 
+def forget_user_tokens(user_id: str):
+    for token in [token for token, claims in _verified.items() if claims.get("sub") == user_id]:
+        del _verified[token]
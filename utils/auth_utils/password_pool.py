@@ -0,0 +1,73 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# hashes beyond this many waiting + running are rejected instead of queued
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", "256"))
+
+# min/max pinned to the configured cost so a changed BCRYPT_ROUNDS marks
+# older hashes as needing an update
+pwd_context = CryptContext(
+    schemes=['bcrypt'],
+    deprecated='auto',
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+# bcrypt releases the GIL, so threads give real parallelism here; made on
+# first use, so it can be shut down and started again with the app
+_executor = None
+_stats = {"pending": 0, "running": 0, "max_pending": 0, "completed": 0, "rejected": 0}
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+class PasswordPoolBusy(Exception):
+    pass
+
+def _tracked(fn, *args):
+    _stats["running"] += 1
+    try:
+        return fn(*args)
+    finally:
+        _stats["running"] -= 1
+
+async def _run(fn, *args):
+    if _stats["pending"] >= PASSWORD_POOL_MAX_PENDING:
+        _stats["rejected"] += 1
+        raise PasswordPoolBusy("Too many password checks in progress, try again shortly.")
+    _stats["pending"] += 1
+    _stats["max_pending"] = max(_stats["max_pending"], _stats["pending"])
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), _tracked, fn, *args)
+    finally:
+        _stats["pending"] -= 1
+        _stats["completed"] += 1
+
+async def hash_password(password):
+    return await _run(pwd_context.hash, password)
+
+async def verify_password(password, hashed_password):
+    '''
+    Returns (valid, new_hash). new_hash is set when the stored hash was made
+    with another cost and should be replaced.
+    '''
+    return await _run(pwd_context.verify_and_update, password, hashed_password)
+
+def password_pool_stats():
+    return {**_stats, "workers": PASSWORD_POOL_WORKERS, "queued": max(0, _stats["pending"] - _stats["running"])}
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
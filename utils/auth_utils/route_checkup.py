@@ -1,24 +1,139 @@
-from fastapi import Depends
+import os
+import time
+from fastapi import Depends, Request
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException, status
 from bson import ObjectId
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+load_dotenv()
 from utils.db_utils.db import db
-from utils.auth_utils.jwt_create_validate import verify_access_token
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
-
-# Assuming you have this function already
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = verify_access_token(token)  # your JWT verification function
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if user is None:
-            raise HTTPException(status_code=404, detail="User not found")
-        return user_id
-    except HTTPException as e:
-        raise e
-    except Exception:
-        raise HTTPException(status_code=403, detail="Could not validate credentials")
+from utils.db_utils.user_cache import load_user, invalidate_user
+from utils.db_utils.cache_events import on_event, publish
+from utils.auth_utils.jwt_create_validate import verify_access_token, forget_user_tokens
+
+# a token issued less than this many seconds ago, whose "ver" claim is not
+# older than the last revocation seen by this process, is trusted without
+# checking that the user still exists
+AUTH_TRUST_WINDOW_SECONDS = float(os.getenv("AUTH_TRUST_WINDOW_SECONDS", "300"))
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
+
+# user id -> lowest token version still accepted
+_min_token_versions = {}
+
+# the access_token cookie is sent with cross-site navigations too, so it
+# only authenticates requests that cannot change anything, or ones with a
+# header that a cross-site page cannot add without a CORS preflight
+COOKIE_SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+COOKIE_CSRF_HEADER = "X-Requested-With"
+
+def _unauthorized(detail="Not authenticated"):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+def get_bearer_token(token: str = Depends(oauth2_scheme)):
+    '''
+    Bearer header only, for routes that must not be reachable by a link.
+    '''
+    if token:
+        return token
+    raise _unauthorized()
+
+def get_token(request: Request, token: str = Depends(oauth2_scheme)):
+    '''
+    Bearer header first, then the access_token cookie set by /login.
+    '''
+    if token:
+        return token
+    cookie = request.cookies.get("access_token")
+    if cookie:
+        scheme, _, value = cookie.strip('"').partition(" ")
+        if scheme.lower() == "bearer" and value:
+            if request.method not in COOKIE_SAFE_METHODS and COOKIE_CSRF_HEADER not in request.headers:
+                raise _unauthorized(f"Cookie authentication needs the {COOKIE_CSRF_HEADER} header.")
+            return value
+    raise _unauthorized()
+
+def _token_is_fresh(payload):
+    user_id = payload["sub"]
+    version = payload.get("ver")
+    issued_at = payload.get("iat")
+    if version is None or issued_at is None:
+        return False
+    if version < _min_token_versions.get(user_id, 0):
+        return False
+    return time.time() - issued_at < AUTH_TRUST_WINDOW_SECONDS
+
+async def revoke_user_tokens(user_id: str):
+    '''
+    Invalidates every token issued so far for the user by bumping the
+    token_version stored on the user document.
+    '''
+    user = await db.users.find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$inc": {"token_version": 1}},
+        projection={"token_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if user is not None:
+        _min_token_versions[user_id] = user["token_version"]
+        await publish("tokens", user_id, {"version": user["token_version"]})
+    forget_user_tokens(user_id)
+    invalidate_user(user_id)
+
+def _tokens_revoked(user_id, data):
+    # another worker revoked them; its tokens may sit in this one's caches
+    _min_token_versions[user_id] = max(_min_token_versions.get(user_id, 0), data["version"])
+    forget_user_tokens(user_id)
+
+on_event("tokens", _tokens_revoked)
+
+class CurrentUser:
+    '''
+    Dependency returning the authenticated user's document with only the
+    given fields, e.g. Depends(CurrentUser("start_date", "attendance")).
+    Handlers reuse it instead of reading the user again. Only routes that
+    need no fields skip the database for a fresh token; the others read the
+    user anyway, and the revocation check rides along in the same query.
+    '''
+
+    def __init__(self, *fields):
+        self.fields = fields
+
+    async def __call__(self, token: str = Depends(get_token)):
+        return await self.user(token)
+
+    async def user(self, token):
+        try:
+            payload = verify_access_token(token)  # your JWT verification function
+            user_id = payload.get("sub")
+            if user_id is None:
+                raise HTTPException(status_code=401, detail="Invalid token payload")
+            if not self.fields and _token_is_fresh(payload):
+                return {"_id": ObjectId(user_id)}
+            user = await load_user(user_id, self.fields + ("token_version",))
+            if user is None:
+                raise HTTPException(status_code=404, detail="User not found")
+            token_version = user.pop("token_version", 0)
+            if payload.get("ver", 0) < token_version:
+                _min_token_versions[user_id] = token_version
+                raise HTTPException(status_code=401, detail="Token revoked")
+            return user
+        except HTTPException as e:
+            raise e
+        except Exception:
+            raise HTTPException(status_code=403, detail="Could not validate credentials")
+
+class BearerUser(CurrentUser):
+    '''
+    CurrentUser that ignores the cookie, for routes that destroy data.
+    '''
+
+    async def __call__(self, token: str = Depends(get_bearer_token)):
+        return await self.user(token)
+
+get_current_user = CurrentUser()
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+import os
+import signal
+from string import Formatter
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from pydantic import BaseModel
+load_dotenv()
+
+# agent -> (system message env var, prompt env var, placeholders the prompt may use)
+PROMPT_SOURCES = {
+    "nutri_orchestrator": ("CLASSIFICATION_SYSTEM_PROMPT", "CLASSIFICATION_PROMPT", {"user_query"}),
+    "omni_knowledge_bot": ("OMNI_KNOWLEDGE_BOT_SYSTEM_MESSAGE", "OMNI_KNOWLEDGE_BOT_PROMPT", {"user_query"}),
+    "nutri_scanner": ("NUTRISCANNER_SYSTEM_MESSAGE", "NUTRISCANNER_PROMPT", {"user_query", "nutrient_sheet_per_food_item"}),
+    "diet_builder": ("DIET_BUILDER_SYSTEM_MESSAGE", "DIET_BUILDER_PROMPT", {"gap_sheet"}),
+    "nutri_reflector": ("NUTRI_REFLECTOR_SYSTEM_MESSAGE", "NUTRI_REFLECTOR_PROMPT", {"gap_sheet"}),
+    "missy_monitor": ("MISSY_MONITOR_SYSTEM_MESSAGE", "MISSY_MONITOR_PROMPT", {"days_string"}),
+    "nutri_scanner_batch": ("NUTRISCANNER_SYSTEM_MESSAGE", "NUTRISCANNER_BATCH_PROMPT", {"meals", "nutrient_sheet_per_food_item"}),
+}
+
+# used when the variable is not set, so newer prompts don't break older .env files
+PROMPT_DEFAULTS = {
+    "NUTRISCANNER_BATCH_PROMPT": (
+        "Estimate the nutrients of each numbered meal below. Use this nutrient sheet for every meal, "
+        "with the same keys and units:\n{nutrient_sheet_per_food_item}\n\n"
+        "Meals:\n{meals}\n\n"
+        "Reply with a single JSON object and nothing else. Its keys are the meal numbers as strings, "
+        "each value is a two element array: the filled nutrient sheet for that meal and a short remark about it."
+    ),
+}
+
+def _digest(*parts):
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:12]
+
+class PromptTemplate:
+    '''
+    A prompt parsed once into literal text and placeholders, so rendering
+    is a join instead of a str.format parse on every call.
+    '''
+
+    def __init__(self, name, system_message, template, allowed_fields):
+        self.name = name
+        self.system_message = system_message
+        self.template = template
+        self.parts = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            if field is not None and field not in allowed_fields:
+                raise ValueError(f"{name} prompt uses unknown placeholder {{{field}}}, expected one of {sorted(allowed_fields)}")
+            if field == "":
+                raise ValueError(f"{name} prompt uses a positional placeholder {{}}")
+            self.parts.append((literal, field, spec, conversion))
+        self.version = _digest(system_message, template)
+
+    def render(self, **values):
+        out = []
+        for literal, field, spec, conversion in self.parts:
+            out.append(literal)
+            if field is not None:
+                value = values[field]
+                if conversion == "r":
+                    value = repr(value)
+                elif conversion == "s":
+                    value = str(value)
+                out.append(format(value, spec or ""))
+        return "".join(out)
+
+class Settings(BaseModel):
+    api_keys: List[str]
+    nutrients_list: List[str]
+    balanced_diet_sheet: Dict[str, float]
+    nutrient_sheet_per_food_item: str
+    prompt_version: str
+    food_sheet_version: str
+    # agent -> route overrides, see model_routing
+    llm_routing: Dict[str, Dict[str, Any]]
+
+def _require(name, default=None):
+    value = os.getenv(name) or default
+    if value is None or value == "":
+        raise ValueError(f"Missing required setting {name}")
+    return value
+
+def _json(name, default=None):
+    try:
+        return json.loads(_require(name, default))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"{name} is not valid JSON: {e}")
+
+def load_settings():
+    '''
+    Reads and validates every setting and prompt from the environment.
+    Raises ValueError naming the offending variable.
+    '''
+    prompts = {
+        agent: PromptTemplate(agent, _require(system_var), _require(prompt_var, PROMPT_DEFAULTS.get(prompt_var)), fields)
+        for agent, (system_var, prompt_var, fields) in PROMPT_SOURCES.items()
+    }
+    settings = Settings(
+        api_keys=_json("API_KEYS"),
+        nutrients_list=_json("NUTRIENTS_LIST"),
+        balanced_diet_sheet=_json("BALANCED_DIET_SHEET"),
+        nutrient_sheet_per_food_item=_require("NUTRIENT_SHEET_PER_FOOD_ITEM"),
+        prompt_version=os.getenv("PROMPT_VERSION") or _digest(*(prompts[agent].version for agent in sorted(prompts))),
+        food_sheet_version=_digest(_require("NUTRIENT_SHEET_PER_FOOD_ITEM")),
+        llm_routing=_json("LLM_ROUTING", "{}"),
+    )
+    if not settings.api_keys:
+        raise ValueError("API_KEYS must list at least one key")
+    if not settings.nutrients_list:
+        raise ValueError("NUTRIENTS_LIST must not be empty")
+    return settings, prompts
+
+_settings = None
+_prompts = None
+_reload_callbacks = []
+
+def _install(loaded):
+    global _settings, _prompts
+    _settings, _prompts = loaded
+    for callback in _reload_callbacks:
+        callback(_settings)
+
+def get_settings():
+    if _settings is None:
+        _install(load_settings())
+    return _settings
+
+def get_prompt(agent):
+    get_settings()
+    return _prompts[agent]
+
+def on_reload(callback):
+    _reload_callbacks.append(callback)
+
+def reload_settings():
+    '''
+    Re-reads .env and the environment. A broken config is reported and the
+    running one is kept.
+    '''
+    load_dotenv(override=True)
+    try:
+        loaded = load_settings()
+    except Exception as e:
+        print(f"❌ Settings reload failed, keeping prompt version {_settings.prompt_version if _settings else None}: {e}")
+        return False
+    _install(loaded)
+    print(f"Settings reloaded, prompt version {_settings.prompt_version}")
+    return True
+
+def install_reload_handler():
+    signal_name = os.getenv("SETTINGS_RELOAD_SIGNAL", "SIGHUP")
+    signum = getattr(signal, signal_name, None)
+    if signum is None:
+        return
+    asyncio.get_running_loop().add_signal_handler(signum, reload_settings)
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import socket
+from collections import deque
+from datetime import datetime, timedelta
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from dotenv import load_dotenv
+load_dotenv()
+from utils.db_utils.db import db
+
+# per-process caches (users, verified tokens, revocations) are told about
+# writes made by other workers through a capped collection, which works on a
+# standalone server too; change streams would need a replica set.
+# auto: on when WEB_CONCURRENCY asks for more than one worker
+CACHE_EVENTS = os.getenv("CACHE_EVENTS", "auto")
+CACHE_EVENTS_SIZE_BYTES = int(os.getenv("CACHE_EVENTS_SIZE_BYTES", str(8 * 1024 * 1024)))
+# pause before the tail is reopened, e.g. after an error or on a server
+# without tailable cursors
+CACHE_EVENTS_POLL_SECONDS = float(os.getenv("CACHE_EVENTS_POLL_SECONDS", "1"))
+# events this much older than the last one seen are read again on reopen,
+# for inserts that commit out of order
+CACHE_EVENTS_CATCHUP_SECONDS = float(os.getenv("CACHE_EVENTS_CATCHUP_SECONDS", "5"))
+
+if CACHE_EVENTS not in ("auto", "true", "false"):
+    raise ValueError(f"CACHE_EVENTS must be auto, true or false, got {CACHE_EVENTS!r}")
+
+# kind -> [handler(key, data)]
+HANDLERS = {}
+
+# set by start_cache_events, so a preloaded app gets the worker's pid
+ORIGIN = None
+_listener = None
+_pending = set()
+_stats = {"published": 0, "received": 0, "handled": 0, "failed": 0, "reopened": 0}
+
+def enabled():
+    if CACHE_EVENTS == "auto":
+        return int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+    return CACHE_EVENTS == "true"
+
+def on_event(kind, handler):
+    '''
+    Registers handler(key, data) for events of `kind` published by other
+    workers. Handlers only touch local state; they must not publish again.
+    '''
+    HANDLERS.setdefault(kind, []).append(handler)
+
+async def publish(kind, key, data=None):
+    if _listener is None:
+        return
+    await db.cache_events.insert_one({"kind": kind, "key": key, "data": data, "origin": ORIGIN, "ts": datetime.utcnow()})
+    _stats["published"] += 1
+
+def publish_soon(kind, key, data=None):
+    '''
+    publish() for sync callers, e.g. cache invalidation. Runs in the
+    background; a failure is reported, the local cache is already updated.
+    '''
+    if _listener is None:
+        return
+    task = asyncio.ensure_future(publish(kind, key, data))
+    _pending.add(task)
+    task.add_done_callback(_published)
+
+def _published(task):
+    _pending.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        _stats["failed"] += 1
+        print(f"❌ Could not publish cache event: {task.exception()}")
+
+def _dispatch(event):
+    _stats["received"] += 1
+    for handler in HANDLERS.get(event["kind"], ()):
+        try:
+            handler(event["key"], event.get("data"))
+            _stats["handled"] += 1
+        except Exception as e:
+            _stats["failed"] += 1
+            print(f"❌ Cache event {event['kind']} failed: {e}")
+
+async def _listen(since):
+    # ids of recently seen events, as the catch-up window reads some twice
+    seen = set()
+    order = deque()
+    while True:
+        try:
+            cursor = db.cache_events.find(
+                {"ts": {"$gte": since - timedelta(seconds=CACHE_EVENTS_CATCHUP_SECONDS)}},
+                cursor_type=CursorType.TAILABLE_AWAIT
+            )
+            async for event in cursor:
+                if event["_id"] in seen:
+                    continue
+                seen.add(event["_id"])
+                order.append(event["_id"])
+                if len(order) > 10000:
+                    seen.discard(order.popleft())
+                since = max(since, event["ts"])
+                if event["origin"] != ORIGIN:
+                    _dispatch(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Cache event listener: {e}")
+        _stats["reopened"] += 1
+        await asyncio.sleep(CACHE_EVENTS_POLL_SECONDS)
+
+async def start_cache_events():
+    '''
+    Creates the capped collection if needed and starts following it. Does
+    nothing unless enabled(), a single worker has nobody to tell.
+    '''
+    global _listener, ORIGIN
+    if not enabled() or _listener is not None:
+        return
+    ORIGIN = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        await db.create_collection("cache_events", capped=True, size=CACHE_EVENTS_SIZE_BYTES)
+    except CollectionInvalid:
+        pass
+    except Exception as e:
+        # e.g. a server without capped collections: the tail is polled instead
+        print(f"❌ Could not create capped cache_events collection: {e}")
+    _listener = asyncio.create_task(_listen(datetime.utcnow()))
+
+async def stop_cache_events():
+    global _listener
+    if _listener is None:
+        return
+    if _pending:
+        await asyncio.gather(*_pending, return_exceptions=True)
+    _listener.cancel()
+    try:
+        await _listener
+    except asyncio.CancelledError:
+        pass
+    _listener = None
+
+def cache_events_stats():
+    return {**_stats, "enabled": _listener is not None, "origin": ORIGIN}
@@ -1,8 +1,153 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReadPreference
+from pymongo.errors import OperationFailure
+from pymongo.monitoring import ConnectionPoolListener
 from dotenv import load_dotenv
 import os
 load_dotenv()
+from utils.metrics_utils.metrics import mongo_listeners
 
-client = AsyncIOMotorClient(os.getenv("MONGOURL"))
+DB_NAME = os.getenv("MONGO_DB_NAME", "dietvite")
 
-db=client["dietvite"]
+# pool and timeouts, passed to the driver as is
+MONGO_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_MS", "60000")),
+    # a request waits at most this long for a free connection
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000")),
+}
+# sheet writes re-read what they just wrote, so anything but primary is only
+# safe for deployments that accept stale reads
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+if MONGO_READ_PREFERENCE not in READ_PREFERENCES:
+    raise ValueError(f"MONGO_READ_PREFERENCE must be one of {sorted(READ_PREFERENCES)}, got {MONGO_READ_PREFERENCE!r}")
+
+# (collection, keys, options) created by init_db; collections with a TTL
+# create their own index next to the setting that drives it
+INDEXES = [
+    # username is optional at signup; only set ones have to be unique
+    ("users", [("username", ASCENDING)], {"unique": True, "name": "username_unique", "partialFilterExpression": {"username": {"$type": "string"}}}),
+    ("users", [("email", ASCENDING)], {"unique": True, "name": "email_unique"}),
+]
+
+class PoolStats(ConnectionPoolListener):
+    '''
+    Counts connections of the driver's pools. Events arrive on driver
+    threads; the counters are plain ints, which is enough for monitoring.
+    '''
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = {}
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_checked_out(self, event):
+        self.checkouts += 1
+        self.checked_out += 1
+        self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        reason = str(event.reason)
+        self.checkout_failures[reason] = self.checkout_failures.get(reason, 0) + 1
+
+_pool_stats = PoolStats()
+_client = None
+
+def get_client():
+    '''
+    The process wide client, created on first use. The driver connects
+    lazily, so importing this module does not touch the network.
+    '''
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            os.getenv("MONGOURL"),
+            read_preference=READ_PREFERENCES[MONGO_READ_PREFERENCE],
+            event_listeners=[_pool_stats, *mongo_listeners()],
+            **MONGO_OPTIONS
+        )
+    return _client
+
+def set_client(client):
+    '''
+    Replaces the client, e.g. with an in-memory one for local runs.
+    '''
+    global _client
+    _client = client
+
+class _Database:
+    '''
+    Stands in for the database of get_client(), so modules can keep
+    `from utils.db_utils.db import db` while the client is made later.
+    '''
+
+    def __getattr__(self, name):
+        return getattr(get_client()[DB_NAME], name)
+
+    def __getitem__(self, name):
+        return get_client()[DB_NAME][name]
+
+db = _Database()
+
+async def init_db():
+    '''
+    Runs at startup: fails the boot if the server cannot be reached and
+    makes sure the indexes exist. An index that cannot be built (e.g.
+    duplicate usernames from before it existed) is reported, not fatal.
+    '''
+    await db.command("ping")
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            print(f"❌ Could not create index {options['name']} on {collection}: {e}")
+
+def close_db():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+def pool_stats():
+    max_pool_size = MONGO_OPTIONS["maxPoolSize"]
+    return {
+        "max_pool_size": max_pool_size,
+        "open": _pool_stats.open,
+        "checked_out": _pool_stats.checked_out,
+        "max_checked_out": _pool_stats.max_checked_out,
+        "utilization": round(_pool_stats.checked_out / max_pool_size, 3) if max_pool_size else 0.0,
+        "checkouts": _pool_stats.checkouts,
+        "checkout_failures": dict(_pool_stats.checkout_failures),
+        "read_preference": MONGO_READ_PREFERENCE,
+    }
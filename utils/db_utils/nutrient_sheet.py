@@ -0,0 +1,415 @@
+import asyncio
+import os
+import random
+import uuid
+from datetime import date, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+load_dotenv()
+from utils.db_utils.db import db
+from utils.db_utils.user_cache import invalidate_user
+from utils.config_utils.registry import get_settings
+from utils.db_utils.sheet_store import sheet_format, unpack, encode_sheet, decode_sheet, packed_meal_set
+from utils.score_utils.aggregates import aggregates_version, build_aggregates, meal_aggregates_update
+
+# a meal log on a packed sheet re-reads the days and retries when another
+# write bumped sheet_rev in between
+LOG_MEAL_MAX_ATTEMPTS = int(os.getenv("LOG_MEAL_MAX_ATTEMPTS", "5"))
+
+# fields a meal log touches, plus what is needed to interpret them
+SHEET_PROJECTION = {
+    "start_date": 1,
+    "time_frame": 1,
+    "overall_nutrient_sheet": 1,
+    "attendance": 1,
+    "frequency": 1,
+    "sheet_format": 1,
+}
+
+# Aggregates move in a second write after a meal on a lists sheet, tracked
+# by two fields inside them:
+#   lag  meal writes whose aggregate part is still to come; only a write
+#        that finds lag 1 (itself) knows the days as they were before it
+#   gen  set on every build, so a late second write cannot apply to
+#        aggregates rebuilt (and so already counting the meal) meanwhile
+
+# user id -> [lock, meal logs holding or waiting for it], for packed sheets
+_packed_locks = {}
+
+class SheetBusy(Exception):
+    '''
+    A packed sheet kept changing under a meal log; the caller should try
+    again rather than fail the meal.
+    '''
+
+def new_generation(aggregates):
+    # freshly built aggregates, nothing lagging behind them
+    return {**aggregates, "gen": uuid.uuid4().hex, "lag": 0}
+
+def day_index(start_date, time_frame, when):
+    if start_date is None or time_frame is None:
+        raise ValueError("No active challenge, call /start first.")
+    # calendar days: a meal on the start date counts for day 0 even if it
+    # was eaten earlier in the day than the challenge was started
+    index = (when.date() - start_date.date()).days
+    if not 0 <= index < time_frame:
+        raise ValueError(f"Day {index} is outside the {time_frame} day challenge.")
+    return index
+
+def meal_update(index, nutrients):
+    '''
+    Targeted update for one meal on day `index`: increments only the touched
+    cells, so concurrent meal logs of the same user cannot overwrite each other.
+    '''
+    nutrients_list = get_settings().nutrients_list
+    unknown = [key for key in nutrients if key not in nutrients_list]
+    if unknown:
+        raise ValueError(f"Unknown nutrients: {unknown}")
+    increments = {f"overall_nutrient_sheet.{key}.{index}": val for key, val in nutrients.items()}
+    increments[f"frequency.{index}"] = 1
+    return {
+        "$inc": increments,
+        "$set": {f"attendance.{index}": True},
+    }
+
+def _days_or_whole(path, indices):
+    # lists give back the elements for the days, packed binaries come back whole
+    pick = {"$map": {"input": {"$literal": indices}, "as": "day", "in": {"$arrayElemAt": [path, "$$day"]}}}
+    return {"$cond": [{"$isArray": path}, pick, path]}
+
+async def _read_days(user_id, indices, nutrients_list):
+    '''
+    Reads sheet_rev, the aggregate header and the given days of the sheet,
+    whatever its layout, as current["days"][index] = {"day", "meals",
+    "day_score"}. Returns None if the user does not exist.
+    '''
+    projection = {
+        "sheet_rev": 1,
+        "sheet_format": 1,
+        "aggregates.version": 1,
+        "aggregates.nutrients": 1,
+        "day_scores": _days_or_whole("$day_scores", indices),
+        "frequency": _days_or_whole("$frequency", indices),
+        "attendance": _days_or_whole("$attendance", indices),
+    }
+    # nutrient names are not safe as output field names, so they go by position
+    for position, nutrient in enumerate(nutrients_list):
+        projection[f"n{position}"] = _days_or_whole(f"$overall_nutrient_sheet.{nutrient}", indices)
+    async for doc in db.users.aggregate([{"$match": {"_id": user_id}}, {"$project": projection}]):
+        columns = {
+            nutrient: doc.pop(f"n{position}")
+            for position, nutrient in enumerate(nutrients_list)
+            if doc.get(f"n{position}") is not None
+        }
+        if sheet_format(doc) == "packed":
+            _unpack_days(doc, columns, indices)
+            return doc
+        if doc.get("frequency") is None:
+            raise ValueError("No active challenge, call /start first.")
+        day_scores = doc.get("day_scores")
+        doc["days"] = {
+            index: {
+                "day": {nutrient: values[k] for nutrient, values in columns.items() if values[k] is not None},
+                "meals": doc["frequency"][k],
+                "day_score": day_scores[k] if day_scores is not None else None,
+            }
+            for k, index in enumerate(indices)
+        }
+        return doc
+    return None
+
+def _unpack_days(current, columns, indices):
+    if current.get("frequency") is None:
+        raise ValueError("No active challenge, call /start first.")
+    current["arrays"] = arrays = {
+        "sheet": {nutrient: unpack("overall_nutrient_sheet", blob) for nutrient, blob in columns.items()},
+        "frequency": unpack("frequency", current["frequency"]),
+        "attendance": unpack("attendance", current["attendance"]),
+        "day_scores": unpack("day_scores", current["day_scores"]) if current.get("day_scores") is not None else None,
+    }
+    current["days"] = {
+        index: {
+            "day": {nutrient: float(values[index]) for nutrient, values in arrays["sheet"].items()},
+            "meals": int(arrays["frequency"][index]),
+            "day_score": float(arrays["day_scores"][index]) if arrays["day_scores"] is not None else None,
+        }
+        for index in indices
+    }
+
+def _merge(update, extra):
+    '''
+    Adds the operators of `extra` to `update`. Increments of the same field
+    are summed and $addToSet values collected, so several meals can go into
+    one write; other operators keep the last value.
+    '''
+    for operator, fields in extra.items():
+        target = update.setdefault(operator, {})
+        for field, value in fields.items():
+            if operator == "$inc" and field in target:
+                target[field] += value
+            elif operator == "$addToSet":
+                each = target.setdefault(field, {"$each": []})["$each"]
+                if value not in each:
+                    each.append(value)
+            else:
+                target[field] = value
+    return update
+
+def _aggregates_update(current, day, index, nutrients, settings):
+    '''
+    The aggregate part of a meal log and the day's new score, or (None, None)
+    when the stored aggregates are missing or stale; those are rebuilt by
+    the next read instead.
+    '''
+    aggregates = current.get("aggregates") or {}
+    if aggregates.get("version") != aggregates_version(settings.balanced_diet_sheet):
+        return None, None
+    if any(day["day"].get(nutrient) is None for nutrient in aggregates["nutrients"]):
+        return None, None
+    if day.get("day_score") is None or day.get("meals") is None:
+        return None, None
+    return meal_aggregates_update(aggregates, day["day"], day["day_score"], day["meals"], index, nutrients, settings.balanced_diet_sheet)
+
+def _aggregates_steps(current, meals, settings):
+    '''
+    Walks the meals in order, each starting from the day as the meals
+    before it left it, and returns the aggregate update ($inc / $addToSet)
+    with every meal's new day score. Returns (None, None) as soon as one
+    meal cannot move the aggregates along. Updates current["days"].
+    '''
+    update = {}
+    day_scores = []
+    for index, nutrients in meals:
+        day = current["days"][index]
+        aggregates_update, new_day_score = _aggregates_update(current, day, index, nutrients, settings)
+        if aggregates_update is None:
+            return None, None
+        update = _merge(update, aggregates_update)
+        day_scores.append(new_day_score)
+        for nutrient, val in nutrients.items():
+            day["day"][nutrient] = day["day"].get(nutrient, 0) + val
+        day["meals"] += 1
+        day["day_score"] = new_day_score
+    return update, day_scores
+
+def _packed_update(current, meals, settings):
+    '''
+    Packed arrays cannot be $inc'ed in place, so a meal log on a packed
+    sheet rewrites the arrays it touches, aggregates included.
+    '''
+    aggregates_update, day_scores = _aggregates_steps(current, meals, settings)
+    arrays = current["arrays"]
+    update = {"$set": {}}
+    for position, (index, nutrients) in enumerate(meals):
+        meal_update(index, nutrients)  # rejects unknown nutrients
+        update["$set"].update(packed_meal_set(
+            arrays["sheet"], arrays["frequency"], arrays["attendance"], arrays["day_scores"],
+            index, nutrients, day_scores[position] if day_scores is not None else None
+        ))
+    if aggregates_update is None:
+        update["$unset"] = {"aggregates": ""}
+    else:
+        update = _merge(update, aggregates_update)
+    return _merge(update, {"$inc": {"sheet_rev": 1}})
+
+async def _log_packed(user_id, meals, settings):
+    '''
+    Read, then write if sheet_rev is unchanged since. Meal logs of the same
+    user in this process take turns, so only other workers can get in
+    between.
+    '''
+    indices = sorted({index for index, _ in meals})
+    entry = _packed_locks.setdefault(user_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            for attempt in range(LOG_MEAL_MAX_ATTEMPTS):
+                current = await _read_days(user_id, indices, settings.nutrients_list)
+                if current is None:
+                    return None
+                user = await db.users.find_one_and_update(
+                    {"_id": user_id, "sheet_rev": current.get("sheet_rev")},
+                    _packed_update(current, meals, settings),
+                    projection=SHEET_PROJECTION,
+                    return_document=ReturnDocument.AFTER
+                )
+                if user is not None:
+                    return user
+                await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _packed_locks.pop(user_id, None)
+    raise SheetBusy("The nutrient sheet is being updated from elsewhere, try again.")
+
+def _days_before(after, meals):
+    '''
+    The touched days as they were before `meals`, from the document that
+    the meal write returned.
+    '''
+    sheet = after["overall_nutrient_sheet"]
+    day_scores = after.get("day_scores")
+    days = {}
+    for index, _ in meals:
+        days[index] = {
+            "day": {nutrient: values[index] for nutrient, values in sheet.items() if values[index] is not None},
+            "meals": after["frequency"][index],
+            "day_score": day_scores[index] if day_scores is not None else None,
+        }
+    for index, nutrients in meals:
+        for nutrient, val in nutrients.items():
+            days[index]["day"][nutrient] -= val
+        days[index]["meals"] -= 1
+    return days
+
+async def _follow_aggregates(user_id, after, meals, settings):
+    '''
+    Second step of a meal log on a lists sheet: moves the aggregates and
+    day scores along with the meals the first step wrote. That is only
+    possible when every earlier meal write had done so already (lag is 1,
+    this one) and no rebuild happened since (same gen). Otherwise the
+    aggregates are unset and the next read rebuilds them; a meal log never
+    fails here.
+    '''
+    aggregates = after.get("aggregates") or {}
+    generation = aggregates.get("gen")
+    try:
+        if aggregates.get("lag") == 1 and generation is not None:
+            current = {"aggregates": aggregates, "days": _days_before(after, meals)}
+            update, day_scores = _aggregates_steps(current, meals, settings)
+            if update is not None:
+                # later meals of the same day leave the last score
+                update = _merge(update, {"$set": {f"day_scores.{index}": score for (index, _), score in zip(meals, day_scores)}})
+                update = _merge(update, {"$inc": {"aggregates.lag": -1}})
+                result = await db.users.update_one({"_id": user_id, "aggregates.gen": generation}, update)
+                if result.matched_count == 1:
+                    return
+        await db.users.update_one({"_id": user_id, "aggregates.gen": generation}, {"$unset": {"aggregates": ""}})
+    except Exception as e:
+        print(f"❌ Could not move the aggregates of {user_id} along: {e}")
+
+async def log_meals(user_id, meals):
+    '''
+    Logs (day index, nutrients) meals and returns the sheet, always as
+    lists. On a lists sheet the meals go in with one unconditional $inc, so
+    concurrent logs never conflict, and the aggregates follow in a second
+    write that can only mark them stale, never fail the log. Packed sheets
+    are read and written back with a check on sheet_rev.
+    '''
+    settings = get_settings()
+    user_id = ObjectId(user_id)
+    update = {}
+    for index, nutrients in meals:
+        update = _merge(update, meal_update(index, nutrients))
+    update = _merge(update, {"$inc": {"sheet_rev": 1, "aggregates.lag": 1}})
+    projection = {**SHEET_PROJECTION, "day_scores": 1, "aggregates": 1}
+    user = await db.users.find_one_and_update(
+        # packed sheets and users without a challenge take the other path
+        {"_id": user_id, "sheet_format": {"$ne": "packed"}, "frequency": {"$type": "array"}},
+        update,
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if user is not None:
+        await _follow_aggregates(user_id, user, meals, settings)
+        user.pop("day_scores", None)
+        user.pop("aggregates", None)
+    else:
+        user = await _log_packed(user_id, meals, settings)
+        if user is None:
+            return None
+    invalidate_user(user_id)
+    return decode_sheet(user)
+
+async def log_meal(user_id, index, nutrients):
+    return await log_meals(user_id, [(index, nutrients)])
+
+async def load_aggregates(user):
+    '''
+    Returns the user's aggregates, rebuilding and storing them from the full
+    sheet when they are missing, behind the sheet or were built with another
+    balanced sheet. `user` must carry _id and aggregates.
+    '''
+    balanced_diet_sheet = get_settings().balanced_diet_sheet
+    aggregates = user.get("aggregates")
+    # aggregates with meal writes still to follow do not count them yet
+    if (aggregates and aggregates.get("version") == aggregates_version(balanced_diet_sheet)
+            and aggregates.get("gen") is not None and not aggregates.get("lag")):
+        return aggregates
+    doc = await db.users.find_one(
+        {"_id": user["_id"]},
+        {"sheet_rev": 1, "sheet_format": 1, "overall_nutrient_sheet": 1, "attendance": 1, "frequency": 1}
+    )
+    if not doc or doc.get("overall_nutrient_sheet") is None:
+        raise ValueError("No active challenge, call /start first.")
+    storage = sheet_format(doc)
+    decode_sheet(doc)
+    aggregates, day_scores = build_aggregates(doc["overall_nutrient_sheet"], doc["attendance"], doc["frequency"], balanced_diet_sheet)
+    aggregates = new_generation(aggregates)
+    # skipped if a meal was logged meanwhile; the next read rebuilds again
+    await db.users.update_one(
+        {"_id": user["_id"], "sheet_rev": doc.get("sheet_rev")},
+        {"$set": {"aggregates": aggregates, **encode_sheet({"day_scores": day_scores}, storage)}}
+    )
+    invalidate_user(user["_id"])
+    return aggregates
+
+async def load_sheet_summary(user_id, today=None):
+    '''
+    A fixed-size view of the sheet for the login reply: the running totals
+    and today's row instead of every day. None without a challenge.
+    '''
+    today = today or date.today()
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, {"start_date": 1, "aggregates": 1})
+    if not user or user.get("start_date") is None:
+        return None
+    aggregates = await load_aggregates(user)
+    start_date = user["start_date"].date()
+    index = (today - start_date).days
+    summary = {
+        "start_date": start_date.isoformat(),
+        "time_frame": aggregates["days"],
+        "days_elapsed": min(max(index + 1, 0), aggregates["days"]),
+        "attended_days": aggregates["attended_days"],
+        "nutrient_totals": aggregates["nutrient_totals"],
+        "today": None,
+    }
+    if 0 <= index < aggregates["days"]:
+        current = await _read_days(user["_id"], [index], get_settings().nutrients_list)
+        day = current["days"][index]
+        summary["today"] = {"nutrients": day["day"], "meals": day["meals"]}
+    return summary
+
+async def load_miss_dates(user_id, start_date, days_elapsed):
+    '''
+    Reads only the elapsed part of attendance (all of it when packed, which
+    is one byte a day) and returns the missed dates.
+    '''
+    attendance = {"$cond": [{"$isArray": "$attendance"}, {"$slice": ["$attendance", days_elapsed]}, "$attendance"]}
+    doc = None
+    async for doc in db.users.aggregate([{"$match": {"_id": ObjectId(user_id)}}, {"$project": {"sheet_format": 1, "attendance": attendance}}]):
+        decode_sheet(doc)
+    attendance = ((doc or {}).get("attendance") or [])[:days_elapsed]
+    return [start_date + timedelta(days=i) for i, attended in enumerate(attendance) if not attended]
+
+async def migrate_sheet(user_id, storage):
+    '''
+    Rewrites one user's sheet in the given layout. Returns True if the
+    document was converted, False if it was already in that layout, had no
+    sheet or was written to meanwhile (run again to pick it up).
+    '''
+    doc = await db.users.find_one(
+        {"_id": ObjectId(user_id)},
+        {"sheet_rev": 1, "sheet_format": 1, "overall_nutrient_sheet": 1, "attendance": 1, "frequency": 1, "day_scores": 1}
+    )
+    if not doc or doc.get("overall_nutrient_sheet") is None or sheet_format(doc) == storage:
+        return False
+    decode_sheet(doc)
+    fields = {field: doc.get(field) for field in ("overall_nutrient_sheet", "attendance", "frequency", "day_scores")}
+    result = await db.users.update_one(
+        {"_id": doc["_id"], "sheet_rev": doc.get("sheet_rev")},
+        {"$set": encode_sheet(fields, storage), "$inc": {"sheet_rev": 1}}
+    )
+    invalidate_user(doc["_id"])
+    return result.modified_count == 1
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+load_dotenv()
+
+# How /start lays out a new sheet. Documents carry their own `sheet_format`,
+# so both layouts can be read at any time and existing users keep theirs
+# until migrated (python -m scripts.migrate_sheet_storage).
+#   lists:  nutrient -> [value per day], attendance [bool], frequency [int]
+#   packed: the same arrays as little-endian binary, see PACKED_DTYPES
+SHEET_STORAGE = os.getenv("SHEET_STORAGE", "lists")
+SHEET_FORMATS = ("lists", "packed")
+
+PACKED_DTYPES = {
+    "overall_nutrient_sheet": "<f4",
+    "attendance": "u1",
+    "frequency": "<u2",
+    "day_scores": "<f8",
+}
+SHEET_FIELDS = tuple(PACKED_DTYPES)
+
+# float32 keeps about 7 significant digits; decoded intakes are rounded so
+# 300.7 reads back as 300.7 and not 300.70001220703125
+FLOAT32_DECIMALS = 4
+
+if SHEET_STORAGE not in SHEET_FORMATS:
+    raise ValueError(f"SHEET_STORAGE must be one of {SHEET_FORMATS}, got {SHEET_STORAGE!r}")
+
+def sheet_format(doc):
+    return doc.get("sheet_format") or "lists"
+
+def pack(field, values):
+    return Binary(np.asarray(values, dtype=PACKED_DTYPES[field]).tobytes())
+
+def unpack(field, blob):
+    '''
+    Returns a writable numpy array for one packed field.
+    '''
+    return np.frombuffer(bytes(blob), dtype=PACKED_DTYPES[field]).copy()
+
+def _to_list(field, array):
+    if field == "overall_nutrient_sheet":
+        return array.astype(float).round(FLOAT32_DECIMALS).tolist()
+    if field == "attendance":
+        return array.astype(bool).tolist()
+    return array.tolist()
+
+def encode_sheet(fields, storage=None):
+    '''
+    fields: any of SHEET_FIELDS in list form. Returns the fields to $set for
+    the given storage (SHEET_STORAGE by default), including sheet_format.
+    '''
+    storage = storage or SHEET_STORAGE
+    encoded = {"sheet_format": storage}
+    for field, value in fields.items():
+        if storage == "lists" or value is None:
+            encoded[field] = value
+        elif field == "overall_nutrient_sheet":
+            encoded[field] = {nutrient: pack(field, values) for nutrient, values in value.items()}
+        else:
+            encoded[field] = pack(field, value)
+    return encoded
+
+def decode_sheet(doc):
+    '''
+    Turns the sheet fields of a document into lists in place, whatever the
+    stored layout, and drops sheet_format. Returns the document.
+    '''
+    if doc is None:
+        return doc
+    if doc.pop("sheet_format", None) != "packed":
+        return doc
+    for field in SHEET_FIELDS:
+        value = doc.get(field)
+        if value is None:
+            continue
+        if field == "overall_nutrient_sheet":
+            doc[field] = {nutrient: _to_list(field, unpack(field, blob)) for nutrient, blob in value.items()}
+        else:
+            doc[field] = _to_list(field, unpack(field, value))
+    return doc
+
+def packed_meal_set(sheet, frequency, attendance, day_scores, index, nutrients, new_day_score):
+    '''
+    Packed arrays cannot be $inc'ed in place, so a meal rewrites the arrays
+    it touches. Takes the unpacked arrays (day_scores may be None) and
+    returns the $set for one meal on day `index`.
+    '''
+    fields = {}
+    for nutrient, val in nutrients.items():
+        values = sheet.get(nutrient)
+        if values is None:
+            values = sheet[nutrient] = np.zeros(len(frequency), dtype=PACKED_DTYPES["overall_nutrient_sheet"])
+        values[index] += val
+        fields[f"overall_nutrient_sheet.{nutrient}"] = pack("overall_nutrient_sheet", values)
+    frequency[index] += 1
+    attendance[index] = 1
+    fields["frequency"] = pack("frequency", frequency)
+    fields["attendance"] = pack("attendance", attendance)
+    if day_scores is not None and new_day_score is not None:
+        day_scores[index] = new_day_score
+        fields["day_scores"] = pack("day_scores", day_scores)
+    return fields
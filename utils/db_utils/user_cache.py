@@ -0,0 +1,68 @@
+import os
+import time
+from bson import ObjectId
+from dotenv import load_dotenv
+load_dotenv()
+from utils.db_utils.db import db
+from utils.db_utils.sheet_store import SHEET_FIELDS, decode_sheet
+from utils.db_utils.cache_events import on_event, publish_soon
+
+# 0 disables the cache
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "0"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+# user id -> (expires_at, fields loaded so far, projected document)
+_cache = {}
+
+def _get(user_id, fields):
+    entry = _cache.get(user_id)
+    if entry is None:
+        return None
+    expires_at, cached_fields, doc = entry
+    if expires_at < time.monotonic():
+        del _cache[user_id]
+        return None
+    if not fields <= cached_fields:
+        return None
+    return {key: value for key, value in doc.items() if key == "_id" or key in fields}
+
+def _put(user_id, fields, doc):
+    entry = _cache.get(user_id)
+    if entry is not None and entry[0] >= time.monotonic():
+        fields = fields | entry[1]
+        doc = {**entry[2], **doc}
+    elif len(_cache) >= USER_CACHE_MAX_ENTRIES:
+        _cache.pop(next(iter(_cache)))
+    _cache[user_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, fields, doc)
+
+async def load_user(user_id, fields=()):
+    '''
+    Reads only `fields` (plus _id) of a user. With USER_CACHE_TTL_SECONDS set,
+    results are kept per process until they expire or the user is written.
+    '''
+    fields = frozenset(fields)
+    if USER_CACHE_TTL_SECONDS > 0:
+        cached = _get(user_id, fields)
+        if cached is not None:
+            return cached
+    projection = {field: 1 for field in fields} or {"_id": 1}
+    if fields & set(SHEET_FIELDS):
+        projection["sheet_format"] = 1
+    doc = decode_sheet(await db.users.find_one({"_id": ObjectId(user_id)}, projection))
+    if doc is not None and USER_CACHE_TTL_SECONDS > 0:
+        _put(user_id, fields, doc)
+        return dict(doc)
+    return doc
+
+def _drop(user_id, data=None):
+    _cache.pop(user_id, None)
+
+def invalidate_user(user_id):
+    '''
+    Drops the user here and, with several workers, in the other workers.
+    '''
+    if USER_CACHE_TTL_SECONDS > 0:
+        _drop(str(user_id))
+        publish_soon("user", str(user_id))
+
+on_event("user", _drop)
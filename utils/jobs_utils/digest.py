@@ -0,0 +1,165 @@
+import asyncio
+import os
+from datetime import date, timedelta
+from bson import ObjectId
+from dotenv import load_dotenv
+load_dotenv()
+from utils.db_utils.db import db
+from utils.db_utils.user_cache import invalidate_user
+from utils.db_utils.nutrient_sheet import load_aggregates, load_miss_dates
+from utils.score_utils.aggregates import missed_days, score_from_aggregates
+from utils.llm_utils.agents import missy_monitor, FAILED_REPLY
+from utils.llm_utils.inflight import singleflight
+from utils.jobs_utils.job_queue import job_handler, daily_job, enqueue
+
+# users digested at once by the nightly run
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "8"))
+DIGEST_BATCH = int(os.getenv("DIGEST_BATCH", "200"))
+# the nightly run starts this long after local midnight
+DAILY_DIGEST_DELAY_MINUTES = float(os.getenv("DAILY_DIGEST_DELAY_MINUTES", "5"))
+
+KUDOS = "Kudos! for your discipline!"
+DATE_FORMAT = "%d-%m-%Y"
+
+# Precomputed once a day per active user, on the user document:
+#
+#   daily_digest = {
+#       "date":                     day it was computed for (isoformat),
+#       "rev":                      sheet_rev it was computed from,
+#       "miss_dates":               missed days before that day,
+#       "missy_monitor":            comment on miss_dates (None without misses),
+#       "missy_monitor_with_today": comment if the day itself stays missed too,
+#       "score", "cheat_dates":     /calculate_score at that rev,
+#   }
+#
+# Days before today cannot change any more, so the comments stay right all
+# day; a meal logged today only decides which of the two applies.
+
+async def _comment(miss_dates):
+    days_string = ", ".join(miss_dates)
+    reply = await singleflight("missy:" + days_string, lambda: missy_monitor(miss_dates))
+    if reply == FAILED_REPLY:
+        # fail the job so it is retried instead of storing the error
+        raise RuntimeError("missy_monitor did not answer")
+    return reply
+
+async def build_digest(user, today, on_demand=False):
+    '''
+    `user` must carry _id, start_date, aggregates, sheet_rev and daily_digest.
+    `on_demand` digests are asked for by a user who is reading their comment.
+    '''
+    aggregates = await load_aggregates(user)
+    start_date = user["start_date"].date()
+    settled_days = min(max((today - start_date).days, 0), aggregates["days"])
+    miss_dates = [d.strftime(DATE_FORMAT) for d in await load_miss_dates(user["_id"], start_date, settled_days)]
+
+    previous = user.get("daily_digest") or {}
+    if not miss_dates:
+        comment = None
+    elif previous.get("miss_dates") == miss_dates and previous.get("missy_monitor"):
+        # nothing new was missed since the last digest
+        comment = previous["missy_monitor"]
+    else:
+        comment = await _comment(miss_dates)
+
+    # shortly after midnight nobody has eaten yet, so today looks missed for
+    # every user; without earlier misses the comment waits until asked for
+    comment_with_today = None
+    if (miss_dates or on_demand) and missed_days(aggregates, start_date, today) == len(miss_dates) + 1:
+        comment_with_today = await _comment(miss_dates + [today.strftime(DATE_FORMAT)])
+
+    score, cheat_dates = score_from_aggregates(aggregates, start_date, today)
+    return {
+        "date": today.isoformat(),
+        "rev": user.get("sheet_rev"),
+        "miss_dates": miss_dates,
+        "missy_monitor": comment,
+        "missy_monitor_with_today": comment_with_today,
+        "score": score,
+        "cheat_dates": sorted(cheat_dates),
+    }
+
+async def digest_user(user, today, on_demand=False):
+    digest = await build_digest(user, today, on_demand)
+    await db.users.update_one({"_id": user["_id"]}, {"$set": {"daily_digest": digest}})
+    invalidate_user(user["_id"])
+    return digest
+
+DIGEST_PROJECTION = {"start_date": 1, "aggregates": 1, "sheet_rev": 1, "daily_digest": 1}
+
+@job_handler("daily_digest")
+async def daily_digest():
+    '''
+    Digests every user with a challenge. Users already digested today are
+    skipped, so a retried or resumed run picks up where it stopped.
+    '''
+    today = date.today()
+    semaphore = asyncio.Semaphore(DIGEST_CONCURRENCY)
+    counts = {"digested": 0, "failed": 0}
+
+    async def one(user):
+        async with semaphore:
+            try:
+                await digest_user(user, today)
+                counts["digested"] += 1
+            except Exception as e:
+                print(f"❌ Daily digest failed for user {user['_id']}: {e!r}")
+                counts["failed"] += 1
+                await request_digest(user, today)
+
+    batch = []
+    cursor = db.users.find({"start_date": {"$ne": None}, "daily_digest.date": {"$ne": today.isoformat()}}, DIGEST_PROJECTION)
+    async for user in cursor:
+        batch.append(user)
+        if len(batch) >= DIGEST_BATCH:
+            await asyncio.gather(*(one(u) for u in batch))
+            batch = []
+    await asyncio.gather(*(one(u) for u in batch))
+    return counts
+
+@job_handler("user_digest")
+async def user_digest(user_id):
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, DIGEST_PROJECTION)
+    if not user or user.get("start_date") is None:
+        return {"skipped": True}
+    digest = await digest_user(user, date.today(), on_demand=True)
+    return {"date": digest["date"], "rev": digest["rev"]}
+
+daily_job("daily_digest", timedelta(minutes=DAILY_DIGEST_DELAY_MINUTES))
+
+async def request_digest(user, today):
+    '''
+    Queues a digest for one user whose stored one no longer fits. Keyed by
+    day and sheet_rev, so repeated requests for the same state queue one job.
+    '''
+    uid = str(user["_id"])
+    await enqueue("user_digest", {"user_id": uid}, job_id=f"user_digest:{uid}:{today.isoformat()}:{user.get('sheet_rev')}")
+
+def _current(digest, today):
+    return digest is not None and digest.get("date") == today.isoformat()
+
+def digest_comment(digest, missed, today):
+    '''
+    The stored missy_monitor comment for `missed` days up to today, or None
+    when the digest is missing or does not cover that many. No missed days
+    need no digest.
+    '''
+    if missed == 0:
+        return KUDOS
+    if not _current(digest, today):
+        return None
+    settled = len(digest["miss_dates"])
+    if missed == settled:
+        return digest["missy_monitor"]
+    if missed == settled + 1:
+        return digest.get("missy_monitor_with_today")
+    return None
+
+def digest_score(digest, sheet_rev, today):
+    '''
+    The stored (score, cheat dates), or None unless the digest is from today
+    and no meal was logged since.
+    '''
+    if not _current(digest, today) or digest.get("rev") != sheet_rev:
+        return None
+    return digest["score"], digest["cheat_dates"]
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import random
+import socket
+from datetime import datetime, date, time, timedelta
+from dotenv import load_dotenv
+load_dotenv()
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from utils.db_utils.db import db
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "2"))
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "5"))
+# a running job whose worker stops renewing this lease is picked up again
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "120"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RETRY_SECONDS = float(os.getenv("JOBS_RETRY_SECONDS", "60"))
+# finished jobs are kept this long for inspection
+JOBS_RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Jobs live in the `jobs` collection:
+#   {_id, kind, payload, status: queued | running | done | failed, run_at,
+#    attempts, worker, locked_until, result | error, created_at, finished_at}
+# Any number of processes may run workers; a job is claimed with one atomic
+# update, so each run happens in one place.
+
+# kind -> async handler(**payload)
+HANDLERS = {}
+# (kind, offset after local midnight) enqueued once a day
+DAILY = []
+
+_tasks = []
+_wake = None
+_stats = {"claimed": 0, "done": 0, "retried": 0, "failed": 0}
+_indexes_ready = False
+
+def job_handler(kind):
+    def register(handler):
+        HANDLERS[kind] = handler
+        return handler
+    return register
+
+def daily_job(kind, after_midnight):
+    DAILY.append((kind, after_midnight))
+
+async def _ensure_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        await db.jobs.create_index([("status", 1), ("run_at", 1)])
+        await db.jobs.create_index("finished_at", expireAfterSeconds=JOBS_RETENTION_SECONDS)
+        _indexes_ready = True
+
+def local_midnight_utc(day):
+    # run_at is stored as naive UTC like every other date in the database
+    return datetime.utcfromtimestamp(datetime.combine(day, time()).timestamp())
+
+async def enqueue(kind, payload=None, run_at=None, job_id=None):
+    '''
+    Queues a job. With job_id, a job that was already queued under the same
+    id (by this or another process) is not queued again; returns False then.
+    '''
+    await _ensure_indexes()
+    now = datetime.utcnow()
+    doc = {
+        "kind": kind,
+        "payload": payload or {},
+        "status": "queued",
+        "run_at": run_at or now,
+        "attempts": 0,
+        "created_at": now,
+    }
+    if job_id is not None:
+        doc["_id"] = job_id
+    try:
+        await db.jobs.insert_one(doc)
+    except DuplicateKeyError:
+        return False
+    if _wake is not None:
+        _wake.set()
+    return True
+
+async def _claim():
+    now = datetime.utcnow()
+    return await db.jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "run_at": {"$lte": now}},
+            {"status": "running", "locked_until": {"$lt": now}},
+        ]},
+        {
+            "$set": {"status": "running", "worker": WORKER_ID, "locked_until": now + timedelta(seconds=JOBS_LEASE_SECONDS)},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def _renew_lease(job_id):
+    while True:
+        await asyncio.sleep(JOBS_LEASE_SECONDS / 3)
+        await db.jobs.update_one(
+            {"_id": job_id, "worker": WORKER_ID, "status": "running"},
+            {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=JOBS_LEASE_SECONDS)}}
+        )
+
+async def _run(job):
+    _stats["claimed"] += 1
+    handler = HANDLERS.get(job["kind"])
+    renew = asyncio.ensure_future(_renew_lease(job["_id"]))
+    try:
+        if handler is None:
+            raise LookupError(f"No handler for job kind {job['kind']!r}")
+        result = await handler(**job.get("payload", {}))
+        update = {"status": "done", "result": result, "finished_at": datetime.utcnow()}
+        _stats["done"] += 1
+    except Exception as e:
+        print(f"❌ Job {job['_id']} ({job['kind']}) failed on attempt {job['attempts']}: {e!r}")
+        if job["attempts"] < JOBS_MAX_ATTEMPTS:
+            delay = JOBS_RETRY_SECONDS * (2 ** (job["attempts"] - 1))
+            update = {"status": "queued", "error": repr(e), "run_at": datetime.utcnow() + timedelta(seconds=delay)}
+            _stats["retried"] += 1
+        else:
+            update = {"status": "failed", "error": repr(e), "finished_at": datetime.utcnow()}
+            _stats["failed"] += 1
+    finally:
+        renew.cancel()
+    await db.jobs.update_one({"_id": job["_id"], "worker": WORKER_ID}, {"$set": update, "$unset": {"locked_until": ""}})
+
+async def _worker():
+    while True:
+        try:
+            job = await _claim()
+        except Exception as e:
+            print(f"❌ Job queue unavailable: {e!r}")
+            job = None
+        if job is not None:
+            await _run(job)
+            continue
+        _wake.clear()
+        try:
+            # a little jitter keeps workers of several processes from polling in step
+            await asyncio.wait_for(_wake.wait(), timeout=JOBS_POLL_SECONDS * random.uniform(0.8, 1.2))
+        except asyncio.TimeoutError:
+            pass
+
+async def schedule_daily(today=None):
+    '''
+    Makes sure today's run of every daily job exists. Its id carries the
+    date, so however many processes call this, each job runs once a day.
+    '''
+    today = today or date.today()
+    for kind, after_midnight in DAILY:
+        run_at = local_midnight_utc(today) + after_midnight
+        await enqueue(kind, run_at=run_at, job_id=f"{kind}:{today.isoformat()}")
+
+async def _scheduler():
+    while True:
+        try:
+            await schedule_daily()
+        except Exception as e:
+            print(f"❌ Could not schedule daily jobs: {e!r}")
+        await asyncio.sleep(JOBS_POLL_SECONDS * 12)
+
+def start_jobs():
+    global _wake, WORKER_ID
+    if not JOBS_ENABLED or _tasks:
+        return
+    # again here: with a preloaded app the import ran in the parent process
+    WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+    _wake = asyncio.Event()
+    _tasks.append(asyncio.ensure_future(_scheduler()))
+    for _ in range(JOBS_CONCURRENCY):
+        _tasks.append(asyncio.ensure_future(_worker()))
+
+async def stop_jobs():
+    '''
+    Stops the workers. A job cut off here keeps its lease until it runs
+    out and is then picked up again, by this or another process.
+    '''
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+def jobs_stats():
+    return {**_stats, "enabled": JOBS_ENABLED, "workers": JOBS_CONCURRENCY if _tasks else 0, "handlers": sorted(HANDLERS)}
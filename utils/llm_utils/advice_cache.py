@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+load_dotenv()
+from utils.db_utils.db import db
+from utils.db_utils.user_cache import invalidate_user
+from utils.config_utils.registry import get_settings, get_prompt
+from utils.llm_utils.agents import FAILED_REPLY
+from utils.llm_utils.inflight import singleflight
+
+ADVICE_CACHE_TTL_SECONDS = int(os.getenv("ADVICE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# deficits are bucketed in steps of this fraction of the ideal intake
+ADVICE_BUCKET = float(os.getenv("ADVICE_BUCKET", "0.1"))
+
+# Two levels:
+#   user doc  advice.<agent> = {"rev", "prompt", "key", "reply"}, valid while
+#             rev equals the user's sheet_rev and prompt the agent's prompt
+#             version, so the next meal log or prompt reload invalidates it
+#   advice_cache collection, keyed by agent + prompt version + bucketed gap
+#             sheet and shared by every user with the same profile
+_stats = {"user_hits": 0, "shared_hits": 0, "misses": 0}
+_indexes_ready = False
+
+def quantize(gap_sheet, balanced_diet_sheet):
+    buckets = {}
+    for nutrient, gap in gap_sheet.items():
+        ideal = balanced_diet_sheet.get(nutrient) or 0
+        buckets[nutrient] = round(gap / ideal / ADVICE_BUCKET) if ideal else round(gap)
+    return buckets
+
+def advice_key(agent, gap_sheet):
+    buckets = quantize(gap_sheet, get_settings().balanced_diet_sheet)
+    payload = json.dumps([agent, get_prompt(agent).version, ADVICE_BUCKET, buckets], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def _ensure_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        await db.advice_cache.create_index("created_at", expireAfterSeconds=ADVICE_CACHE_TTL_SECONDS)
+        _indexes_ready = True
+
+def _user_memo(agent, user):
+    memo = (user.get("advice") or {}).get(agent)
+    if memo and memo.get("rev") == user.get("sheet_rev") and memo.get("prompt") == get_prompt(agent).version:
+        return memo["reply"]
+    return None
+
+async def _remember_for_user(agent, user, key, reply):
+    # only if no meal was logged since the user was read
+    await db.users.update_one(
+        {"_id": user["_id"], "sheet_rev": user.get("sheet_rev")},
+        {"$set": {f"advice.{agent}": {"rev": user.get("sheet_rev"), "prompt": get_prompt(agent).version, "key": key, "reply": reply}}}
+    )
+    invalidate_user(user["_id"])
+
+async def _shared_get(key):
+    doc = await db.advice_cache.find_one({"_id": key}, {"reply": 1})
+    return doc["reply"] if doc else None
+
+async def _shared_put(key, agent, reply):
+    await _ensure_indexes()
+    await db.advice_cache.update_one(
+        {"_id": key},
+        {"$set": {"agent": agent, "reply": reply, "created_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+async def lookup_advice(agent, gap_sheet, user):
+    '''
+    Returns a remembered reply for this user or gap profile, or None.
+    `user` must carry _id, sheet_rev and advice.
+    '''
+    reply = _user_memo(agent, user)
+    if reply is not None:
+        _stats["user_hits"] += 1
+        return reply
+    key = advice_key(agent, gap_sheet)
+    reply = await _shared_get(key)
+    if reply is None:
+        _stats["misses"] += 1
+        return None
+    _stats["shared_hits"] += 1
+    await _remember_for_user(agent, user, key, reply)
+    return reply
+
+async def store_advice(agent, gap_sheet, user, reply):
+    if reply == FAILED_REPLY:
+        return
+    key = advice_key(agent, gap_sheet)
+    await _shared_put(key, agent, reply)
+    await _remember_for_user(agent, user, key, reply)
+
+async def cached_advice(agent, gap_sheet, user, generate):
+    '''
+    generate(gap_sheet) is only awaited when neither the user's memo nor the
+    shared cache has a reply, and concurrent misses for the same gap profile
+    share one call.
+    '''
+    reply = _user_memo(agent, user)
+    if reply is not None:
+        _stats["user_hits"] += 1
+        return reply
+    key = advice_key(agent, gap_sheet)
+
+    async def fill():
+        cached = await _shared_get(key)
+        if cached is not None:
+            _stats["shared_hits"] += 1
+            return cached
+        _stats["misses"] += 1
+        generated = await generate(gap_sheet=gap_sheet)
+        if generated != FAILED_REPLY:
+            await _shared_put(key, agent, generated)
+        return generated
+
+    reply = await singleflight(f"advice:{key}", fill)
+    if reply != FAILED_REPLY:
+        await _remember_for_user(agent, user, key, reply)
+    return reply
+
+def advice_cache_stats():
+    hits = _stats["user_hits"] + _stats["shared_hits"]
+    total = hits + _stats["misses"]
+    return {**_stats, "hit_ratio": round(hits / total, 4) if total else 0.0}
@@ -1,48 +1,100 @@
-import json
 from dotenv import load_dotenv
-import os
 load_dotenv()
-from groq import Groq
+from utils.config_utils.registry import get_prompt
+from utils.llm_utils.gateway import chat_completion, stream_completion
+from utils.llm_utils.model_routing import get_route, record_call
+from utils.llm_utils.fast_classifier import classify
 from datetime import datetime, timedelta,date
-import random
+import time
 import math
-from json_repair import repair_json
+from utils.llm_utils.structured_output import parse_json, SCANNER_JSON_FORMAT
+from utils.metrics_utils.metrics import timed
 
-api_keys = json.loads(os.getenv("API_KEYS"))
+# returned by query() when no model could answer
+FAILED_REPLY = "ERROR: Unable to generate response at the moment."
 
 # utility functions
 
-def query(system_message, user_query):
-    try:
-        messages = [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": user_query}
-        ]
-
-        random_index_api_key = random.randint(0, len(api_keys) - 1)
-        client = Groq(api_key=api_keys[random_index_api_key])
-        models = ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"]
-        random_index_model = random.randint(0, len(models) - 1)
-        response = client.chat.completions.create(
-            model=models[random_index_model],
+async def query(system_message, user_query, agent="default"):
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_query}
+    ]
+    route = get_route(agent)
+    for model, fallback in ((route["model"], False), (route["fallback_model"], True)):
+        if model is None:
+            continue
+        start = time.perf_counter()
+        try:
+            response = await chat_completion(
+                model=model,
+                messages=messages,
+                temperature=route["temperature"],
+                max_tokens=route["max_tokens"],
+                timeout=route.get("timeout"),
+                response_format={"type": "json_object"} if route.get("json_mode") else None
+            )
+            record_call(agent, model, time.perf_counter() - start, usage=response.usage, fallback=fallback)
+            return response.choices[0].message.content
+        except Exception as e:
+            record_call(agent, model, time.perf_counter() - start, fallback=fallback, error=True)
+            print(f"❌ Error during Groq query ({agent}, {model}): {e!r}")
+    return FAILED_REPLY
+
+async def stream_query(system_message, user_query, agent="default"):
+    '''
+    Streaming counterpart of query(): yields the reply as it is generated.
+    The fallback model is only tried if the primary fails before its first
+    token; a failure mid-stream is raised.
+    '''
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_query}
+    ]
+    route = get_route(agent)
+    for model, fallback in ((route["model"], False), (route["fallback_model"], True)):
+        if model is None:
+            continue
+        start = time.perf_counter()
+        meta = {}
+        started = False
+        tokens = stream_completion(
+            model=model,
             messages=messages,
-            temperature=0.6
+            temperature=route["temperature"],
+            max_tokens=route["max_tokens"],
+            timeout=route.get("timeout"),
+            meta=meta
         )
-
-        return response.choices[0].message.content
-
-    except Exception as e:
-        print(f"❌ Error during Groq query: {e}")
-        return "ERROR: Unable to generate response at the moment."
+        recorded = False
+        try:
+            async for token in tokens:
+                started = True
+                yield token
+            record_call(agent, model, time.perf_counter() - start, usage=meta.get("usage"), fallback=fallback)
+            recorded = True
+            return
+        except Exception as e:
+            record_call(agent, model, time.perf_counter() - start, fallback=fallback, error=True)
+            recorded = True
+            print(f"❌ Error during Groq stream ({agent}, {model}): {e!r}")
+            if started:
+                raise
+        finally:
+            # closes the upstream request when our consumer stops early
+            await tokens.aclose()
+            if not recorded:
+                record_call(agent, model, time.perf_counter() - start, usage=meta.get("usage"), fallback=fallback)
+    yield FAILED_REPLY
 
 def clean_json(response: str) -> dict:
     """
-    Removes Markdown formatting and repairs malformed JSON using jsonrepair.
+    Removes Markdown formatting and parses the JSON, repairing it with
+    jsonrepair only if it does not parse as is.
     Returns a Python dictionary.
     """
-    cleaned = response.replace("```json", "").replace("```", "").strip()
-    repaired = repair_json(cleaned)
-    return json.loads(repaired)
+    with timed("parse_json"):
+        return parse_json(response)
 
 def update(overall_nutrient_intake_sheet,nutrient_sheet_per_food_item):
 
@@ -53,20 +105,46 @@ def update(overall_nutrient_intake_sheet,nutrient_sheet_per_food_item):
 
 # agents
 
-def nutri_orchestrator(user_query):
-    classification_prompt = os.getenv("CLASSIFICATION_PROMPT").format(user_query=user_query)
-    classification_system_message = os.getenv("CLASSIFICATION_SYSTEM_PROMPT")
-    return query(system_message=classification_system_message, user_query=classification_prompt)
-
-def omni_knowledge_bot(user_query):
-    omni_knowledge_bot_prompt = os.getenv("OMNI_KNOWLEDGE_BOT_PROMPT").format(user_query=user_query)
-    omni_knowledge_bot_system_message = os.getenv("OMNI_KNOWLEDGE_BOT_SYSTEM_MESSAGE")
-    return query(system_message=omni_knowledge_bot_system_message, user_query=omni_knowledge_bot_prompt)
-
-def nutri_scanner(nutrient_sheet_per_food_item, user_query):
-    nutriscanner_prompt = os.getenv("NUTRISCANNER_PROMPT").format(user_query=user_query,nutrient_sheet_per_food_item=nutrient_sheet_per_food_item)
-    nutriscanner_system_message = os.getenv("NUTRISCANNER_SYSTEM_MESSAGE")
-    return query(system_message=nutriscanner_system_message, user_query=nutriscanner_prompt)
+async def nutri_orchestrator(user_query):
+    prompt = get_prompt("nutri_orchestrator")
+    classification_prompt = prompt.render(user_query=user_query)
+    classification_system_message = prompt.system_message
+    return await query(system_message=classification_system_message, user_query=classification_prompt, agent="nutri_orchestrator")
+
+async def is_food_log(user_query):
+    '''
+    Food-log vs. question decision. The in-process classifier answers when it
+    is confident; only ambiguous queries pay for the nutri_orchestrator call.
+    '''
+    label, _ = classify(user_query)
+    if label is not None:
+        return label
+    response = await nutri_orchestrator(user_query=user_query)
+    return isinstance(response, str) and response.strip().lower() == "yes"
+
+async def omni_knowledge_bot(user_query):
+    prompt = get_prompt("omni_knowledge_bot")
+    omni_knowledge_bot_prompt = prompt.render(user_query=user_query)
+    omni_knowledge_bot_system_message = prompt.system_message
+    return await query(system_message=omni_knowledge_bot_system_message, user_query=omni_knowledge_bot_prompt, agent="omni_knowledge_bot")
+
+def stream_omni_knowledge_bot(user_query):
+    prompt = get_prompt("omni_knowledge_bot")
+    return stream_query(system_message=prompt.system_message, user_query=prompt.render(user_query=user_query), agent="omni_knowledge_bot")
+
+async def nutri_scanner(nutrient_sheet_per_food_item, user_query):
+    prompt = get_prompt("nutri_scanner")
+    nutriscanner_prompt = prompt.render(user_query=user_query,nutrient_sheet_per_food_item=nutrient_sheet_per_food_item)
+    nutriscanner_system_message = prompt.system_message
+    if get_route("nutri_scanner").get("json_mode"):
+        nutriscanner_prompt += SCANNER_JSON_FORMAT
+    return await query(system_message=nutriscanner_system_message, user_query=nutriscanner_prompt, agent="nutri_scanner")
+
+async def nutri_scanner_batch(nutrient_sheet_per_food_item, meals):
+    prompt = get_prompt("nutri_scanner_batch")
+    meals_text = "\n".join(f"{number}. {meal}" for number, meal in enumerate(meals, start=1))
+    batch_prompt = prompt.render(meals=meals_text,nutrient_sheet_per_food_item=nutrient_sheet_per_food_item)
+    return await query(system_message=prompt.system_message, user_query=batch_prompt, agent="nutri_scanner_batch")
 
 def gap_detector(overall_nutrient_intake_sheet,balanced_diet_sheet):
   gap_sheet = {}
@@ -75,21 +153,32 @@ def gap_detector(overall_nutrient_intake_sheet,balanced_diet_sheet):
     gap_sheet[key]=value - sum(intake_list) / len(intake_list) if intake_list else 0
   return gap_sheet
 
-def diet_builder(gap_sheet):
-    diet_builder_prompt = os.getenv("DIET_BUILDER_PROMPT").format(gap_sheet=gap_sheet)
-    diet_builder_system_message = os.getenv("DIET_BUILDER_SYSTEM_MESSAGE")
-    return query(system_message=diet_builder_system_message, user_query=diet_builder_prompt)
+async def diet_builder(gap_sheet):
+    prompt = get_prompt("diet_builder")
+    diet_builder_prompt = prompt.render(gap_sheet=gap_sheet)
+    diet_builder_system_message = prompt.system_message
+    return await query(system_message=diet_builder_system_message, user_query=diet_builder_prompt, agent="diet_builder")
+
+def stream_diet_builder(gap_sheet):
+    prompt = get_prompt("diet_builder")
+    return stream_query(system_message=prompt.system_message, user_query=prompt.render(gap_sheet=gap_sheet), agent="diet_builder")
+
+async def nutri_reflector(gap_sheet):
+    prompt = get_prompt("nutri_reflector")
+    nutri_reflector_prompt = prompt.render(gap_sheet=gap_sheet)
+    nutri_reflector_system_message = prompt.system_message
+    return await query(system_message=nutri_reflector_system_message, user_query=nutri_reflector_prompt, agent="nutri_reflector")
 
-def nutri_reflector(gap_sheet):
-    nutri_reflector_prompt = os.getenv("NUTRI_REFLECTOR_PROMPT").format(gap_sheet=gap_sheet)
-    nutri_reflector_system_message = os.getenv("NUTRI_REFLECTOR_SYSTEM_MESSAGE")
-    return query(system_message=nutri_reflector_system_message, user_query=nutri_reflector_prompt)
+def stream_nutri_reflector(gap_sheet):
+    prompt = get_prompt("nutri_reflector")
+    return stream_query(system_message=prompt.system_message, user_query=prompt.render(gap_sheet=gap_sheet), agent="nutri_reflector")
 
-def missy_monitor(days_skipped):
+async def missy_monitor(days_skipped):
     days_string = ", ".join(str(d) for d in days_skipped)
-    missy_monitor_prompt = os.getenv("MISSY_MONITOR_PROMPT").format(days_string=days_string)
-    missy_monitor_system_message = os.getenv("MISSY_MONITOR_SYSTEM_MESSAGE")
-    return query(system_message=missy_monitor_system_message, user_query=missy_monitor_prompt)
+    prompt = get_prompt("missy_monitor")
+    missy_monitor_prompt = prompt.render(days_string=days_string)
+    missy_monitor_system_message = prompt.system_message
+    return await query(system_message=missy_monitor_system_message, user_query=missy_monitor_prompt, agent="missy_monitor")
 
 def calculate_diet_score_with_penalty(
     overall_nutrient_intake_sheet,
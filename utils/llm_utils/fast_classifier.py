@@ -0,0 +1,112 @@
+import math
+import os
+import re
+from dotenv import load_dotenv
+load_dotenv()
+
+# a label is only trusted when its confidence is at least this high,
+# otherwise the caller falls back to the nutri_orchestrator LLM call
+FAST_CLASSIFIER_THRESHOLD = float(os.getenv("FAST_CLASSIFIER_THRESHOLD", "0.9"))
+
+_TOKEN = re.compile(r"[a-z]+|\d+(?:\.\d+)?|\?")
+
+LOG_VERBS = {
+    "ate": 2.5, "eaten": 2.5, "drank": 2.5, "consumed": 2.5, "snacked": 2.5,
+    "had": 2.0, "having": 1.0, "eating": 1.0, "finished": 1.0, "took": 1.0,
+}
+MEAL_WORDS = {"breakfast", "brunch", "lunch", "dinner", "supper", "snack", "snacks"}
+UNITS = {
+    "g", "gm", "gms", "gram", "grams", "kg", "ml", "l", "litre", "liter",
+    "cup", "cups", "bowl", "bowls", "plate", "plates", "glass", "glasses",
+    "slice", "slices", "piece", "pieces", "pc", "pcs", "tbsp", "tsp",
+    "spoon", "spoons", "katori", "handful", "serving", "servings",
+}
+NUMBER_WORDS = {
+    "a", "an", "one", "two", "three", "four", "five", "six", "seven", "eight",
+    "nine", "ten", "half", "couple", "few", "dozen",
+}
+FOODS = {
+    "idli", "dosa", "sambar", "chutney", "upma", "poha", "vada", "uttapam",
+    "pongal", "chapati", "chapathi", "roti", "phulka", "paratha", "naan",
+    "puri", "rice", "biryani", "pulao", "khichdi", "dal", "daal", "rajma",
+    "chole", "curry", "sabzi", "paneer", "curd", "yogurt", "dahi", "raita",
+    "buttermilk", "lassi", "milk", "tea", "chai", "coffee", "juice", "egg",
+    "omelette", "chicken", "mutton", "fish", "prawn", "bread", "toast",
+    "butter", "ghee", "oats", "cornflakes", "muesli", "banana", "apple",
+    "mango", "orange", "papaya", "grapes", "salad", "sandwich", "burger",
+    "pizza", "pasta", "noodles", "maggi", "samosa", "pakora", "biscuit",
+    "cookie", "cake", "chocolate", "icecream", "sweet", "ladoo", "jalebi",
+    "nuts", "almond", "peanut", "sprouts", "soup", "water",
+}
+QUESTION_STARTERS = {
+    "what", "how", "why", "when", "which", "who", "where", "is", "are",
+    "can", "could", "should", "does", "do", "will", "would", "tell",
+    "explain", "suggest", "recommend", "give", "list",
+}
+QUESTION_WORDS = {
+    "should", "recommend", "suggest", "tips", "benefits", "healthy",
+    "better", "best", "good", "bad", "safe", "avoid", "help", "plan",
+}
+NOT_LOGGED = {"skipped", "skip", "didn", "didnt", "not", "planning", "plan", "want", "will", "going", "tomorrow"}
+
+_stats = {"fast_yes": 0, "fast_no": 0, "llm_fallback": 0}
+
+def _singular(token):
+    if token.endswith("es") and token[:-2] in FOODS:
+        return token[:-2]
+    if token.endswith("s") and token[:-1] in FOODS:
+        return token[:-1]
+    return token
+
+def score(user_query):
+    '''
+    Returns the margin between food-log evidence and question evidence;
+    positive means the text looks like a meal log.
+    '''
+    tokens = [_singular(token) for token in _TOKEN.findall(user_query.lower())]
+    if not tokens:
+        return 0.0
+    log_score = 0.0
+    question_score = 0.0
+
+    log_score += max((LOG_VERBS.get(token, 0.0) for token in tokens), default=0.0)
+    if MEAL_WORDS.intersection(tokens):
+        log_score += 1.0
+    if UNITS.intersection(tokens):
+        log_score += 1.0
+    log_score += min(2.0, float(len(FOODS.intersection(tokens))))
+    for current, following in zip(tokens, tokens[1:]):
+        if (current[0].isdigit() or current in NUMBER_WORDS) and (following in FOODS or following in UNITS):
+            log_score += 1.5
+            break
+    if NOT_LOGGED.intersection(tokens):
+        log_score -= 1.5
+
+    if "?" in tokens:
+        question_score += 3.0
+    if tokens[0] in QUESTION_STARTERS:
+        question_score += 2.5
+    if QUESTION_WORDS.intersection(tokens):
+        question_score += 1.5
+
+    return log_score - question_score
+
+def classify(user_query):
+    '''
+    Returns (is_food_log, confidence). is_food_log is None when the
+    confidence is below FAST_CLASSIFIER_THRESHOLD.
+    '''
+    confidence = 1 / (1 + math.exp(-score(user_query)))
+    if confidence >= FAST_CLASSIFIER_THRESHOLD:
+        _stats["fast_yes"] += 1
+        return True, confidence
+    if 1 - confidence >= FAST_CLASSIFIER_THRESHOLD:
+        _stats["fast_no"] += 1
+        return False, 1 - confidence
+    _stats["llm_fallback"] += 1
+    return None, max(confidence, 1 - confidence)
+
+def classifier_stats():
+    total = sum(_stats.values())
+    fast = _stats["fast_yes"] + _stats["fast_no"]
+    return {**_stats, "fast_path_ratio": round(fast / total, 4) if total else 0.0}
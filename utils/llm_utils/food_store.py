@@ -0,0 +1,128 @@
+import asyncio
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+load_dotenv()
+from utils.db_utils.db import db
+from utils.llm_utils.scanner_batcher import scan_text
+from utils.llm_utils.meal_text import split_meal
+
+FOOD_STORE_ENABLED = os.getenv("FOOD_STORE_ENABLED", "true").lower() == "true"
+
+# weights and volumes are stored per 100 g / 100 ml, everything else per single unit
+REFERENCE_QUANTITY = {"g": 100.0, "ml": 100.0}
+
+# "<unit>|<item>" -> nutrients for the reference quantity
+_index = {}
+_index_loaded = False
+_stats = {"items_from_store": 0, "items_from_llm": 0, "meals_without_llm": 0, "items_not_food": 0, "items_failed": 0}
+
+def item_key(item, unit):
+    return f"{unit}|{item}"
+
+def _reference_quantity(unit):
+    return REFERENCE_QUANTITY.get(unit, 1.0)
+
+def _describe(item, quantity, unit):
+    return " ".join(part for part in (format(quantity, "g"), unit, item) if part)
+
+def _scale(nutrients, factor):
+    return {
+        key: round(value * factor, 2) if isinstance(value, (int, float)) else value
+        for key, value in nutrients.items()
+    }
+
+async def load_index():
+    global _index_loaded
+    async for doc in db.food_items.find({}, {"nutrients": 1}):
+        _index[doc["_id"]] = doc["nutrients"]
+    _index_loaded = True
+
+async def _lookup(keys):
+    '''
+    Items missing from the in-process index may have been added by another
+    worker, so they are looked up in the collection before asking the LLM.
+    '''
+    if not _index_loaded:
+        await load_index()
+    missing = [key for key in keys if key not in _index]
+    if missing:
+        async for doc in db.food_items.find({"_id": {"$in": missing}}, {"nutrients": 1}):
+            _index[doc["_id"]] = doc["nutrients"]
+    return {key: _index[key] for key in keys if key in _index}
+
+def _is_food(nutrients):
+    # the scanner reply is already checked against the nutrient list; an
+    # item with no nutrients at all is not something that was eaten
+    return any(isinstance(value, (int, float)) and value > 0 for value in nutrients.values())
+
+async def _learn_item(item, unit):
+    '''
+    Scans one item and stores it for good. Returns None, storing nothing,
+    when the scanner found no food in it.
+    '''
+    description = _describe(item, _reference_quantity(unit), unit)
+    nutrients, remarks = await scan_text(description)
+    if not _is_food(nutrients):
+        _stats["items_not_food"] += 1
+        return None
+    key = item_key(item, unit)
+    _index[key] = nutrients
+    await db.food_items.update_one(
+        {"_id": key},
+        {"$set": {
+            "item": item,
+            "unit": unit,
+            "reference_quantity": _reference_quantity(unit),
+            "nutrients": nutrients,
+            "remarks": remarks,
+            "created_at": datetime.utcnow(),
+        }},
+        upsert=True
+    )
+    return nutrients, remarks
+
+async def resolve_meal(user_query):
+    '''
+    Splits the meal into items, scales the stored nutrients of every known
+    item by its quantity and asks the LLM only about unknown items, whose
+    answers are written back to the store. Returns (nutrients, remarks), or
+    None if the text could not be split into items or an item is not a food
+    or could not be scanned; the meal is then scanned as a whole.
+    '''
+    items = split_meal(user_query)
+    if not items:
+        return None
+    keys = [item_key(item, unit) for item, _, unit in items]
+    known = await _lookup(keys)
+
+    unknown = [(item, unit) for (item, _, unit), key in zip(items, keys) if key not in known]
+    learned = await asyncio.gather(*(_learn_item(item, unit) for item, unit in unknown), return_exceptions=True)
+    failed = [result for result in learned if isinstance(result, Exception)]
+    if failed:
+        _stats["items_failed"] += len(failed)
+        print(f"❌ Could not learn {len(failed)} food item(s), scanning the whole meal: {failed[0]}")
+        return None
+    if any(result is None for result in learned):
+        return None
+    remarks = [item_remarks for _, item_remarks in learned if item_remarks]
+    for (item, unit), (nutrients, _) in zip(unknown, learned):
+        known[item_key(item, unit)] = nutrients
+
+    _stats["items_from_store"] += len(items) - len(unknown)
+    _stats["items_from_llm"] += len(unknown)
+    if not unknown:
+        _stats["meals_without_llm"] += 1
+
+    total = {}
+    for (item, quantity, unit), key in zip(items, keys):
+        scaled = _scale(known[key], quantity / _reference_quantity(unit))
+        for nutrient, value in scaled.items():
+            if isinstance(value, (int, float)):
+                total[nutrient] = round(total.get(nutrient, 0) + value, 2)
+    if not remarks:
+        remarks = ["Estimated from the food database: " + ", ".join(_describe(item, quantity, unit) for item, quantity, unit in items) + "."]
+    return total, " ".join(str(remark) for remark in remarks)
+
+def food_store_stats():
+    return {**_stats, "items_indexed": len(_index)}
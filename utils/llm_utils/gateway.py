@@ -0,0 +1,254 @@
+import asyncio
+import os
+import random
+from dotenv import load_dotenv
+load_dotenv()
+import httpx
+import groq
+from groq import AsyncGroq
+from utils.config_utils.registry import get_settings, on_reload
+from utils.llm_utils.key_scheduler import KeyScheduler
+from utils.metrics_utils.metrics import inc
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONNECTIONS_PER_KEY = int(os.getenv("LLM_MAX_CONNECTIONS_PER_KEY", "20"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "0.25"))
+# an api key rejected by the provider is parked for this long
+LLM_BAD_KEY_COOLDOWN_SECONDS = float(os.getenv("LLM_BAD_KEY_COOLDOWN_SECONDS", "300"))
+# at shutdown, calls and streams still running get this long to finish
+LLM_DRAIN_SECONDS = float(os.getenv("LLM_DRAIN_SECONDS", "20"))
+
+# built on first use, so importing the gateway reads no settings
+scheduler = None
+
+def _scheduler():
+    global scheduler
+    if scheduler is None:
+        scheduler = KeyScheduler(get_settings().api_keys)
+    return scheduler
+
+def _on_settings_reload(settings):
+    global scheduler
+    if scheduler is not None and list(settings.api_keys) != list(scheduler.api_keys()):
+        scheduler = KeyScheduler(settings.api_keys, previous=scheduler)
+
+on_reload(_on_settings_reload)
+
+# one long-lived client (and so one HTTP connection pool) per api key
+_clients = {}
+_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+# slots held by running calls and open streams; set while none are
+_active = 0
+_idle = asyncio.Event()
+_idle.set()
+
+def _acquired():
+    global _active
+    _active += 1
+    _idle.clear()
+
+def _release():
+    global _active
+    _semaphore.release()
+    _active -= 1
+    if _active == 0:
+        _idle.set()
+
+def get_client(api_key):
+    client = _clients.get(api_key)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS_PER_KEY,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS_PER_KEY
+            )
+        )
+        # retries are handled below so that a retry can move to another key;
+        # GROQ_BASE_URL can point the client at a local stand-in
+        client = AsyncGroq(api_key=api_key, http_client=http_client, max_retries=0)
+        _clients[api_key] = client
+    return client
+
+def _backoff(attempt):
+    delay = LLM_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+    return delay + random.uniform(0, delay)
+
+def _extra(response_format):
+    # left out entirely unless asked for, the API rejects a null response_format
+    return {"response_format": response_format} if response_format is not None else {}
+
+# a call reports back to the scheduler it picked its key from, which a
+# settings reload may have replaced meanwhile
+async def _create_on_key(keys, api_key, model, messages, temperature, max_tokens, response_format=None):
+    keys.started(api_key)
+    headers = None
+    tokens_used = 0
+    outcome = "error"
+    try:
+        raw = await get_client(api_key).chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **_extra(response_format)
+        )
+        headers = raw.headers
+        response = await raw.parse()
+        if response.usage is not None:
+            tokens_used = response.usage.total_tokens
+        outcome = "ok"
+        return response
+    except groq.RateLimitError:
+        outcome = "throttled"
+        raise
+    finally:
+        keys.finished(api_key, headers=headers, tokens_used=tokens_used)
+        inc("llm_key_requests_total", key=keys.label(api_key), outcome=outcome)
+
+async def _open_stream_on_key(keys, api_key, model, messages, temperature, max_tokens):
+    '''
+    Opens a streamed completion. On success the caller owns the stream and
+    must report it to `keys` with keys.finished once done.
+    '''
+    keys.started(api_key)
+    try:
+        raw = await get_client(api_key).chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        opened = keys, api_key, raw.headers, await raw.parse()
+        inc("llm_key_requests_total", key=keys.label(api_key), outcome="ok")
+        return opened
+    except BaseException as e:
+        keys.finished(api_key, headers=None, tokens_used=0)
+        inc("llm_key_requests_total", key=keys.label(api_key), outcome="throttled" if isinstance(e, groq.RateLimitError) else "error")
+        raise
+
+async def _create(model, messages, temperature, max_tokens, stream=False, response_format=None):
+    tried = set()
+    last_error = None
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        await _semaphore.acquire()
+        _acquired()
+        # an opened stream keeps its slot until it is closed
+        release = True
+        try:
+            keys = _scheduler()
+            api_key = keys.pick(exclude=tried) or keys.pick()
+            if api_key is not None:
+                try:
+                    if stream:
+                        opened = await _open_stream_on_key(keys, api_key, model, messages, temperature, max_tokens)
+                        release = False
+                        return opened
+                    return await _create_on_key(keys, api_key, model, messages, temperature, max_tokens, response_format)
+                except groq.RateLimitError as e:
+                    keys.throttled(api_key, headers=e.response.headers)
+                    last_error = e
+                except (groq.AuthenticationError, groq.PermissionDeniedError) as e:
+                    keys.failed(api_key, cooldown=LLM_BAD_KEY_COOLDOWN_SECONDS)
+                    last_error = e
+                except (groq.APIConnectionError, groq.InternalServerError) as e:
+                    keys.failed(api_key)
+                    last_error = e
+                tried.add(api_key)
+        finally:
+            if release:
+                _release()
+        if attempt == LLM_MAX_ATTEMPTS - 1:
+            break
+        # every key is cooling down: wait for the first one to come back
+        wait = _backoff(attempt) if api_key is not None else _scheduler().next_available_in()
+        await asyncio.sleep(wait)
+    raise last_error or RuntimeError("No api key available")
+
+async def chat_completion(model, messages, temperature=0.6, max_tokens=None, timeout=None, response_format=None):
+    '''
+    Awaitable chat completion routed to the api key with the most rate-limit
+    headroom. Throttled or failing calls are retried on another key with
+    backoff. The timeout covers waiting for a slot, retries and the request.
+    response_format, e.g. {"type": "json_object"}, is passed to the API.
+    '''
+    return await asyncio.wait_for(
+        _create(model, messages, temperature, max_tokens, response_format=response_format),
+        timeout=timeout or LLM_TIMEOUT_SECONDS
+    )
+
+# closes of streams that opened after their caller left
+_closing = set()
+
+def _abandoned(opening):
+    if opening.cancelled() or opening.exception() is not None:
+        # _create gave the slot back itself
+        return
+    keys, api_key, headers, stream = opening.result()
+    _release()
+    keys.finished(api_key, headers=headers, tokens_used=0)
+    task = asyncio.ensure_future(stream.close())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+async def stream_completion(model, messages, temperature=0.6, max_tokens=None, timeout=None, meta=None):
+    '''
+    Async generator over the content deltas of a streamed chat completion.
+    Keys and retries work as in chat_completion until the stream is open;
+    after the first chunk a failure is raised to the caller. The timeout
+    bounds opening the stream and every wait for the next chunk. Closing the
+    generator early (e.g. the client went away) closes the upstream request,
+    so no more tokens are generated for it. If given, meta["usage"] is set
+    from the final chunk.
+    '''
+    timeout = timeout or LLM_TIMEOUT_SECONDS
+    # the opening runs as its own task so that a stream it opens after this
+    # caller gave up (timeout or cancel) is still closed and its slot freed
+    opening = asyncio.ensure_future(_create(model, messages, temperature, max_tokens, stream=True))
+    try:
+        keys, api_key, headers, stream = await asyncio.wait_for(asyncio.shield(opening), timeout=timeout)
+    except BaseException:
+        opening.cancel()
+        opening.add_done_callback(_abandoned)
+        raise
+    tokens_used = 0
+    try:
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                break
+            usage = chunk.usage or getattr(chunk.x_groq, "usage", None)
+            if usage is not None:
+                tokens_used = usage.total_tokens
+                if meta is not None:
+                    meta["usage"] = usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        _release()
+        keys.finished(api_key, headers=headers, tokens_used=tokens_used)
+        await stream.close()
+
+def key_stats():
+    return _scheduler().stats()
+
+async def drain(timeout=None):
+    '''
+    Waits up to `timeout` (LLM_DRAIN_SECONDS) for running calls and open
+    streams to finish, so a shutdown does not cut replies that are already
+    paid for. Returns how many were still running.
+    '''
+    try:
+        await asyncio.wait_for(_idle.wait(), timeout=LLM_DRAIN_SECONDS if timeout is None else timeout)
+    except asyncio.TimeoutError:
+        print(f"❌ {_active} model calls still running at shutdown")
+    return _active
+
+async def close_clients():
+    for client in _clients.values():
+        await client.close()
+    _clients.clear()
@@ -0,0 +1,31 @@
+import asyncio
+
+# key -> task computing it; present only while the task runs
+_inflight = {}
+_stats = {"leaders": 0, "joined": 0}
+
+def _forget(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        # marks the exception as retrieved even if every waiter went away
+        task.exception()
+
+async def singleflight(key, factory):
+    '''
+    Runs factory() once per key at a time. Callers arriving while it runs
+    await the same result or exception instead of starting their own call.
+    A caller that is cancelled does not cancel the shared call.
+    '''
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _forget(key, done))
+        _stats["leaders"] += 1
+    else:
+        _stats["joined"] += 1
+    return await asyncio.shield(task)
+
+def inflight_stats():
+    return {**_stats, "running": len(_inflight)}
@@ -0,0 +1,155 @@
+import re
+import time
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_reset(value):
+    '''
+    Groq sends reset windows as "7.66s", "2m59.56s", "1h0m0s" or "250ms".
+    Returns the number of seconds, or None if the header is missing.
+    '''
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNIT_SECONDS[unit] for amount, unit in parts)
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _new_state():
+    return {
+        "limit_requests": None,
+        "remaining_requests": None,
+        "requests_reset_at": 0.0,
+        "limit_tokens": None,
+        "remaining_tokens": None,
+        "tokens_reset_at": 0.0,
+        "cooldown_until": 0.0,
+        "in_flight": 0,
+        "requests": 0,
+        "tokens_used": 0,
+        "throttled": 0,
+        "errors": 0,
+    }
+
+class KeyScheduler:
+    '''
+    Tracks the rate-limit budget of every api key from the x-ratelimit-*
+    response headers and hands out the key with the most headroom. A key
+    that is throttled (429) or out of budget is skipped until its window resets.
+    '''
+
+    def __init__(self, api_keys, previous=None):
+        # keys kept across a settings reload share their state with the
+        # previous scheduler, so calls that started there are still counted
+        kept = previous._states if previous is not None else {}
+        self._states = {api_key: kept.get(api_key) or _new_state() for api_key in api_keys}
+
+    def api_keys(self):
+        return list(self._states)
+
+    def _headroom(self, state, now):
+        fractions = []
+        for kind in ("requests", "tokens"):
+            limit = state[f"limit_{kind}"]
+            remaining = state[f"remaining_{kind}"]
+            if limit and remaining is not None and now < state[f"{kind}_reset_at"]:
+                fractions.append(remaining / limit)
+        headroom = min(fractions) if fractions else 1.0
+        # spread concurrent calls instead of piling them on one key
+        return headroom / (1 + state["in_flight"])
+
+    def pick(self, exclude=()):
+        now = time.monotonic()
+        best_key, best_headroom = None, -1.0
+        for api_key, state in self._states.items():
+            if api_key in exclude or state["cooldown_until"] > now:
+                continue
+            headroom = self._headroom(state, now)
+            if headroom > best_headroom:
+                best_key, best_headroom = api_key, headroom
+        return best_key
+
+    def next_available_in(self):
+        now = time.monotonic()
+        return max(0.0, min(state["cooldown_until"] for state in self._states.values()) - now)
+
+    def started(self, api_key):
+        state = self._states[api_key]
+        state["in_flight"] += 1
+        state["requests"] += 1
+
+    def finished(self, api_key, headers=None, tokens_used=0):
+        state = self._states[api_key]
+        state["in_flight"] = max(state["in_flight"] - 1, 0)
+        state["tokens_used"] += tokens_used or 0
+        if headers is not None:
+            self._update_budget(state, headers)
+
+    def throttled(self, api_key, headers=None):
+        state = self._states[api_key]
+        state["throttled"] += 1
+        now = time.monotonic()
+        wait = None
+        if headers is not None:
+            self._update_budget(state, headers)
+            wait = parse_reset(headers.get("retry-after"))
+        if wait is None:
+            wait = max(state["requests_reset_at"], state["tokens_reset_at"]) - now
+        state["cooldown_until"] = now + max(wait, 1.0)
+
+    def failed(self, api_key, cooldown=0.0):
+        state = self._states[api_key]
+        state["errors"] += 1
+        if cooldown:
+            state["cooldown_until"] = time.monotonic() + cooldown
+
+    def _update_budget(self, state, headers):
+        now = time.monotonic()
+        for kind in ("requests", "tokens"):
+            limit = _to_int(headers.get(f"x-ratelimit-limit-{kind}"))
+            remaining = _to_int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+            if limit is not None:
+                state[f"limit_{kind}"] = limit
+            if remaining is not None:
+                state[f"remaining_{kind}"] = remaining
+            if reset is not None:
+                state[f"{kind}_reset_at"] = now + reset
+            if remaining == 0 and reset is not None:
+                state["cooldown_until"] = max(state["cooldown_until"], now + reset)
+
+    def label(self, api_key):
+        # how a key is shown in stats and metrics, never the key itself
+        keys = list(self._states)
+        index = keys.index(api_key) if api_key in keys else "?"
+        return f"key_{index}...{api_key[-4:]}"
+
+    def stats(self):
+        now = time.monotonic()
+        stats = {}
+        for api_key, state in self._states.items():
+            stats[self.label(api_key)] = {
+                "requests": state["requests"],
+                "tokens_used": state["tokens_used"],
+                "throttled": state["throttled"],
+                "errors": state["errors"],
+                "in_flight": state["in_flight"],
+                "remaining_requests": state["remaining_requests"],
+                "limit_requests": state["limit_requests"],
+                "remaining_tokens": state["remaining_tokens"],
+                "limit_tokens": state["limit_tokens"],
+                "cooling_down_for": round(max(0.0, state["cooldown_until"] - now), 2),
+                "headroom": round(self._headroom(state, now), 3),
+            }
+        return stats
@@ -0,0 +1,127 @@
+import re
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11,
+    "twelve": 12, "half": 0.5, "quarter": 0.25, "couple": 2, "dozen": 12,
+}
+UNIT_ALIASES = {
+    "g": "g", "gm": "g", "gms": "g", "gram": "g", "grams": "g",
+    "kg": "kg", "kgs": "kg",
+    "ml": "ml", "l": "l", "litre": "l", "liter": "l", "litres": "l", "liters": "l",
+    "cup": "cup", "cups": "cup", "bowl": "bowl", "bowls": "bowl",
+    "katori": "bowl", "katoris": "bowl", "plate": "plate", "plates": "plate",
+    "glass": "glass", "glasses": "glass", "slice": "slice", "slices": "slice",
+    "piece": "piece", "pieces": "piece", "pc": "piece", "pcs": "piece",
+    "tbsp": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "tsp": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "spoon": "tbsp", "spoons": "tbsp", "handful": "handful", "handfuls": "handful",
+    "serving": "serving", "servings": "serving", "scoop": "scoop", "scoops": "scoop",
+}
+# words that carry no information about what was eaten
+FILLER = {
+    "i", "ive", "we", "my", "me", "ate", "eaten", "eat", "had", "have", "having",
+    "drank", "drink", "consumed", "took", "just", "today", "now", "some",
+    "of", "the", "for", "in", "at", "as", "was", "were", "is", "also", "then",
+    "breakfast", "brunch", "lunch", "dinner", "supper", "snack", "snacks",
+    "morning", "evening", "night", "tonight",
+}
+# words that do not name a food; a part of the text containing one is
+# commentary ("it was delicious") or too loose to split, so the whole meal
+# goes to the scanner instead
+NOT_FOOD = {
+    "it", "its", "that", "this", "they", "them", "he", "she", "you", "us",
+    "be", "been", "am", "are", "very", "so", "too", "really", "quite", "not",
+    "no", "delicious", "tasty", "yummy", "good", "great", "nice", "bad",
+    "awesome", "amazing", "okay", "ok", "full", "hungry", "felt", "feel",
+    "feeling", "later", "after", "before", "about", "around", "approx",
+    "maybe", "probably", "like", "love", "loved", "liked", "enjoyed",
+}
+UNICODE_FRACTIONS = {"½": 0.5, "¼": 0.25, "¾": 0.75, "⅓": 1 / 3, "⅔": 2 / 3, "⅛": 0.125}
+_MIXED_FRACTION = re.compile(r"(\d+)\s+(\d+)\s*/\s*(\d+)")
+_FRACTION = re.compile(r"(\d+)\s*/\s*(\d+)")
+_SEPARATORS = re.compile(r",|;|&|\+|\band\b|\bwith\b|\bplus\b|\balong\b")
+_TOKEN = re.compile(r"\d+(?:\.\d+)?|[a-z]+")
+_QUANTITY_UNIT = re.compile(r"(\d+(?:\.\d+)?)([a-z]+)")
+
+def _singular(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    # "delicious", "hummus" and "glass" are not plurals
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+def _fraction(match):
+    # "1 1/2" has three groups, "1/2" two
+    *whole, numerator, denominator = (int(part) for part in match.groups())
+    if denominator == 0:
+        return match.group(0)
+    return _format_quantity(sum(whole) + numerator / denominator)
+
+def _numbers(text):
+    '''
+    "1 1/2", "1/2" and "½" become decimals before the text is tokenized,
+    so the slash does not split them into two numbers.
+    '''
+    for symbol, value in UNICODE_FRACTIONS.items():
+        text = re.sub(rf"(\d*)\s*{symbol}", lambda match: " " + _format_quantity(int(match.group(1) or 0) + value), text)
+    text = _MIXED_FRACTION.sub(_fraction, text)
+    return _FRACTION.sub(_fraction, text)
+
+def _format_quantity(quantity):
+    return format(round(quantity, 3), "g")
+
+def split_meal(user_query):
+    '''
+    Splits free-text meal logs such as "I ate 2 idlis and a bowl of sambar"
+    into (item, quantity, unit) tuples: [("idli", 2, ""), ("sambar", 1, "bowl")].
+    The quantity and unit may also follow the item ("paneer 200 g"). Items
+    repeated in the same text are merged. Returns [] if any part of the text
+    does not read as a food, so that the meal is scanned as a whole.
+    '''
+    items = {}
+    order = []
+    text = _numbers(user_query.lower().replace("'", ""))
+    for segment in _SEPARATORS.split(text):
+        # "200g" -> "200 g"
+        segment = _QUANTITY_UNIT.sub(r"\1 \2", segment)
+        quantity = None
+        unit = ""
+        words = []
+        previous = None
+        for token in _TOKEN.findall(segment):
+            if token[0].isdigit():
+                if quantity is not None:
+                    # two amounts in one part, e.g. "2 eggs 3 toasts"
+                    return []
+                quantity = float(token)
+            elif token in NUMBER_WORDS and quantity is None and not words:
+                quantity = float(NUMBER_WORDS[token])
+            elif token in UNIT_ALIASES and not unit and (not words or previous == "quantity"):
+                unit = UNIT_ALIASES[token]
+            elif token in NOT_FOOD:
+                return []
+            elif token not in FILLER:
+                words.append(_singular(token))
+            previous = "quantity" if token[0].isdigit() else token
+        if not words:
+            continue
+        item = " ".join(words)
+        key = (item, unit)
+        if key not in items:
+            items[key] = 0.0
+            order.append(key)
+        items[key] += quantity if quantity is not None else 1.0
+    return [(item, items[(item, unit)], unit) for item, unit in order]
+
+def normalize_meal(user_query):
+    '''
+    Canonical form of a meal log: case, whitespace, number words, units and
+    the order of the items do not matter. Returns "" if nothing was parsed.
+    '''
+    parts = sorted(
+        f"{_format_quantity(quantity)} {unit} {item}".replace("  ", " ")
+        for item, quantity, unit in split_meal(user_query)
+    )
+    return "|".join(parts)
@@ -0,0 +1,81 @@
+from dotenv import load_dotenv
+load_dotenv()
+from utils.config_utils.registry import get_settings, on_reload
+from utils.metrics_utils.metrics import observe, inc, record_stage
+
+FAST_MODEL = "llama-3.1-8b-instant"
+LARGE_MODEL = "llama-3.3-70b-versatile"
+
+# agent name -> model, sampling settings and the model to retry with on timeout or error;
+# json_mode asks the API for a JSON object reply
+DEFAULT_ROUTES = {
+    "nutri_orchestrator": {"model": FAST_MODEL, "temperature": 0.0, "max_tokens": 8, "fallback_model": LARGE_MODEL},
+    "nutri_scanner": {"model": LARGE_MODEL, "temperature": 0.2, "max_tokens": 1024, "fallback_model": FAST_MODEL, "json_mode": True},
+    "nutri_scanner_batch": {"model": LARGE_MODEL, "temperature": 0.2, "max_tokens": 4096, "fallback_model": FAST_MODEL, "json_mode": True},
+    "omni_knowledge_bot": {"model": LARGE_MODEL, "temperature": 0.6, "max_tokens": 1024, "fallback_model": FAST_MODEL},
+    "diet_builder": {"model": LARGE_MODEL, "temperature": 0.6, "max_tokens": 1024, "fallback_model": FAST_MODEL},
+    "nutri_reflector": {"model": LARGE_MODEL, "temperature": 0.6, "max_tokens": 1024, "fallback_model": FAST_MODEL},
+    "missy_monitor": {"model": FAST_MODEL, "temperature": 0.7, "max_tokens": 256, "fallback_model": LARGE_MODEL},
+}
+DEFAULT_ROUTE = {"model": LARGE_MODEL, "temperature": 0.6, "max_tokens": None, "fallback_model": FAST_MODEL, "timeout": None, "json_mode": False}
+
+def load_routes(overrides):
+    '''
+    Starts from DEFAULT_ROUTES and applies the per-agent overrides of the
+    LLM_ROUTING setting, e.g. {"diet_builder": {"model": "llama-3.1-8b-instant"}}.
+    '''
+    routes = {agent: {**DEFAULT_ROUTE, **route} for agent, route in DEFAULT_ROUTES.items()}
+    for agent, route in overrides.items():
+        routes[agent] = {**routes.get(agent, DEFAULT_ROUTE), **route}
+    return routes
+
+# built on first use and again on every settings reload
+routes = None
+
+def _on_settings_reload(settings):
+    global routes
+    routes = load_routes(settings.llm_routing)
+
+on_reload(_on_settings_reload)
+
+def get_route(agent):
+    if routes is None:
+        _on_settings_reload(get_settings())
+    return routes.get(agent, DEFAULT_ROUTE)
+
+# agent name -> latency and token counters
+_agent_stats = {}
+
+def record_call(agent, model, latency, usage=None, fallback=False, error=False):
+    stats = _agent_stats.setdefault(agent, {
+        "calls": 0,
+        "errors": 0,
+        "fallbacks": 0,
+        "total_latency": 0.0,
+        "max_latency": 0.0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "models": {},
+    })
+    stats["calls"] += 1
+    stats["errors"] += int(error)
+    stats["fallbacks"] += int(fallback)
+    stats["total_latency"] += latency
+    stats["max_latency"] = max(stats["max_latency"], latency)
+    stats["models"][model] = stats["models"].get(model, 0) + 1
+    if usage is not None:
+        stats["prompt_tokens"] += usage.prompt_tokens
+        stats["completion_tokens"] += usage.completion_tokens
+        inc("llm_tokens_total", usage.prompt_tokens, agent=agent, model=model, kind="prompt")
+        inc("llm_tokens_total", usage.completion_tokens, agent=agent, model=model, kind="completion")
+    observe("llm_call_duration_seconds", latency, agent=agent, model=model, outcome="error" if error else "ok")
+    record_stage(f"llm_{agent}", latency)
+
+def agent_stats():
+    return {
+        agent: {
+            **stats,
+            "avg_latency": round(stats["total_latency"] / stats["calls"], 4) if stats["calls"] else 0.0,
+        }
+        for agent, stats in _agent_stats.items()
+    }
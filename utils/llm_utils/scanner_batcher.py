@@ -0,0 +1,122 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+load_dotenv()
+from utils.config_utils.registry import get_settings
+from utils.llm_utils.agents import nutri_scanner, nutri_scanner_batch, clean_json
+from utils.llm_utils.inflight import singleflight
+from utils.llm_utils.structured_output import scanner_result
+
+# how long the first meal of a batch waits for company; 0 disables batching
+SCANNER_BATCH_WINDOW_MS = float(os.getenv("SCANNER_BATCH_WINDOW_MS", "10"))
+SCANNER_BATCH_MAX = int(os.getenv("SCANNER_BATCH_MAX", "8"))
+
+# [(meal text, future)] waiting for the next batch
+_pending = []
+_timer = None
+# running batches, kept here so they are not garbage collected mid-call
+_batches = set()
+_stats = {"batches": 0, "batched_meals": 0, "single_calls": 0, "fallbacks": 0, "max_batch": 0}
+
+async def _scan_one(user_query):
+    json_output = await nutri_scanner(nutrient_sheet_per_food_item=get_settings().nutrient_sheet_per_food_item, user_query=user_query)
+    return scanner_result(clean_json(json_output))
+
+def _meal_result(value):
+    '''
+    One meal of a batch reply: [nutrients, remarks] or
+    {"nutrients": ..., "remarks": ...}. Returns None if unusable.
+    '''
+    try:
+        return scanner_result(value)
+    except ValueError:
+        return None
+
+async def _answer(meals):
+    '''
+    Returns one (nutrients, remarks) or exception per meal.
+    '''
+    _stats["max_batch"] = max(_stats["max_batch"], len(meals))
+    if len(meals) == 1:
+        _stats["single_calls"] += 1
+        results = [None]
+    else:
+        _stats["batches"] += 1
+        _stats["batched_meals"] += len(meals)
+        try:
+            reply = clean_json(await nutri_scanner_batch(nutrient_sheet_per_food_item=get_settings().nutrient_sheet_per_food_item, meals=meals))
+        except Exception as e:
+            print(f"❌ Batched nutri_scanner reply could not be parsed: {e!r}")
+            reply = {}
+        if not isinstance(reply, dict):
+            reply = {}
+        results = [_meal_result(reply.get(str(number))) for number in range(1, len(meals) + 1)]
+
+    # meals the batch did not answer are scanned on their own
+    missing = [position for position, result in enumerate(results) if result is None]
+    if len(meals) > 1:
+        _stats["fallbacks"] += len(missing)
+    retried = await asyncio.gather(*(_scan_one(meals[position]) for position in missing), return_exceptions=True)
+    for position, result in zip(missing, retried):
+        results[position] = result
+    return results
+
+async def _run_batch(batch):
+    try:
+        results = await _answer([meal for meal, _ in batch])
+    except BaseException as e:
+        results = [e] * len(batch)
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+def _batch_done(task):
+    _batches.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"❌ nutri_scanner batch failed: {task.exception()!r}")
+
+def _flush():
+    global _timer
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+    while _pending:
+        batch = _pending[:SCANNER_BATCH_MAX]
+        del _pending[:SCANNER_BATCH_MAX]
+        task = asyncio.ensure_future(_run_batch(batch))
+        _batches.add(task)
+        task.add_done_callback(_batch_done)
+
+async def _enqueue(user_query):
+    global _timer
+    future = asyncio.get_running_loop().create_future()
+    _pending.append((user_query, future))
+    if len(_pending) >= SCANNER_BATCH_MAX:
+        _flush()
+    elif _timer is None:
+        _timer = asyncio.get_running_loop().call_later(SCANNER_BATCH_WINDOW_MS / 1000, _flush)
+    return await future
+
+async def scan_text(user_query):
+    '''
+    nutri_scanner for one meal text, returning (nutrients, remarks).
+    Meals arriving within SCANNER_BATCH_WINDOW_MS of each other are sent as
+    one batched prompt, and identical texts in flight share one answer.
+    Meals a batch reply leaves out are retried on their own.
+    '''
+    key = "scan:" + " ".join(user_query.lower().split())
+    if SCANNER_BATCH_WINDOW_MS <= 0:
+        return await singleflight(key, lambda: _scan_one(user_query))
+    return await singleflight(key, lambda: _enqueue(user_query))
+
+def batcher_stats():
+    return {
+        **_stats,
+        "pending": len(_pending),
+        "running": len(_batches),
+        "avg_batch": round(_stats["batched_meals"] / _stats["batches"], 2) if _stats["batches"] else 0.0,
+    }
@@ -0,0 +1,94 @@
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+load_dotenv()
+from utils.db_utils.db import db
+from utils.config_utils.registry import get_settings, get_prompt
+from utils.llm_utils.scanner_batcher import scan_text
+from utils.llm_utils.meal_text import normalize_meal
+from utils.llm_utils.food_store import FOOD_STORE_ENABLED, resolve_meal
+
+SCANNER_CACHE_SIZE = int(os.getenv("SCANNER_CACHE_SIZE", "4096"))
+SCANNER_CACHE_TTL_SECONDS = int(os.getenv("SCANNER_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# key -> (nutrients, remarks), most recently used last
+_lru = OrderedDict()
+_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+_indexes_ready = False
+
+def _prompt_fingerprint():
+    # a different prompt or food sheet may produce different numbers
+    return f"{get_prompt('nutri_scanner').version}:{get_prompt('nutri_scanner_batch').version}:{get_settings().food_sheet_version}"
+
+def cache_key(normalized):
+    return hashlib.sha256(f"{_prompt_fingerprint()}|{normalized}".encode()).hexdigest()
+
+def _remember(key, value):
+    _lru[key] = value
+    _lru.move_to_end(key)
+    while len(_lru) > SCANNER_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+async def _ensure_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        await db.scanner_cache.create_index("created_at", expireAfterSeconds=SCANNER_CACHE_TTL_SECONDS)
+        _indexes_ready = True
+
+async def get(key):
+    value = _lru.get(key)
+    if value is not None:
+        _lru.move_to_end(key)
+        _stats["memory_hits"] += 1
+        return value
+    doc = await db.scanner_cache.find_one({"_id": key}, {"nutrients": 1, "remarks": 1})
+    if doc is not None:
+        value = (doc["nutrients"], doc["remarks"])
+        _remember(key, value)
+        _stats["db_hits"] += 1
+        return value
+    _stats["misses"] += 1
+    return None
+
+async def put(key, normalized, nutrients, remarks):
+    _remember(key, (nutrients, remarks))
+    await _ensure_indexes()
+    await db.scanner_cache.update_one(
+        {"_id": key},
+        {"$set": {
+            "normalized": normalized,
+            "nutrients": nutrients,
+            "remarks": remarks,
+            "created_at": datetime.utcnow(),
+        }},
+        upsert=True
+    )
+
+async def scan_meal(user_query):
+    '''
+    Cache keyed by the normalized meal text in front of the food-item store,
+    with a whole-meal nutri_scanner call for text that cannot be split into
+    items. Returns (nutrients, remarks).
+    '''
+    normalized = normalize_meal(user_query)
+    key = cache_key(normalized) if normalized else None
+    if key is not None:
+        cached = await get(key)
+        if cached is not None:
+            return cached
+
+    resolved = await resolve_meal(user_query) if FOOD_STORE_ENABLED else None
+    if resolved is not None:
+        nutrients, remarks = resolved
+    else:
+        nutrients, remarks = await scan_text(user_query)
+    if key is not None:
+        await put(key, normalized, nutrients, remarks)
+    return nutrients, remarks
+
+def cache_stats():
+    hits = _stats["memory_hits"] + _stats["db_hits"]
+    total = hits + _stats["misses"]
+    return {**_stats, "size": len(_lru), "hit_ratio": round(hits / total, 4) if total else 0.0}
@@ -0,0 +1,41 @@
+import json
+from fastapi.responses import StreamingResponse
+
+# proxies such as nginx buffer responses unless told not to
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def token_events(request, tokens, key, on_done=None):
+    '''
+    Forwards an agent's tokens as "token" events, then sends "done" with the
+    body the non-streaming endpoint would have returned ({key: full reply}).
+    Stops and closes the agent stream as soon as the client disconnects.
+    on_done(reply) is awaited only when the whole reply was streamed.
+    '''
+    parts = []
+    try:
+        async for token in tokens:
+            if await request.is_disconnected():
+                return
+            parts.append(token)
+            yield sse_event("token", {"text": token})
+        reply = "".join(parts)
+        if on_done is not None:
+            await on_done(reply)
+        yield sse_event("done", {key: reply})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"An error occurred while streaming {key}: {str(e)}"})
+    finally:
+        await tokens.aclose()
+
+async def replay(text):
+    # a remembered reply, sent as one token
+    yield text
+
+async def single_event(data):
+    yield sse_event("done", data)
+
+def sse_response(events):
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,94 @@
+import json
+from functools import lru_cache
+from typing import Optional
+from json_repair import repair_json
+from pydantic import ConfigDict, Field, ValidationError, create_model
+from utils.config_utils.registry import get_settings
+
+# appended to scanner prompts of routes with json_mode, where the model
+# must answer with a JSON object
+SCANNER_JSON_FORMAT = (
+    '\n\nReply with a single JSON object and nothing else: '
+    '{"nutrients": <the filled nutrient sheet, numbers only>, "remarks": "<a short remark about the meal>"}'
+)
+
+_stats = {"strict": 0, "repaired": 0, "unparseable": 0, "rejected": 0}
+
+def _strip_fences(text):
+    text = text.strip()
+    if text.startswith("```"):
+        text = text[3:]
+        if text.startswith("json"):
+            text = text[4:]
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+def parse_json(response):
+    '''
+    json.loads on the reply, without Markdown fences. repair_json is only
+    used when that fails, which parse_stats() counts.
+    '''
+    text = _strip_fences(response)
+    try:
+        value = json.loads(text)
+        _stats["strict"] += 1
+        return value
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = json.loads(repair_json(text))
+    except json.JSONDecodeError:
+        _stats["unparseable"] += 1
+        raise
+    _stats["repaired"] += 1
+    return value
+
+@lru_cache(maxsize=4)
+def nutrient_model(nutrients):
+    '''
+    Pydantic model of one meal's nutrients: every key of NUTRIENTS_LIST is
+    optional, must be a non-negative number, and any other key is an error.
+    '''
+    fields = {
+        f"n{position}": (Optional[float], Field(default=None, alias=nutrient, ge=0, allow_inf_nan=False))
+        for position, nutrient in enumerate(nutrients)
+    }
+    return create_model("MealNutrients", __config__=ConfigDict(extra="forbid"), **fields)
+
+def validate_nutrients(nutrients):
+    '''
+    Returns the nutrients as {nutrient: float}, dropping empty ones. Raises
+    ValueError for unknown keys or values that are not amounts.
+    '''
+    model = nutrient_model(tuple(get_settings().nutrients_list))
+    try:
+        meal = model.model_validate(nutrients)
+    except ValidationError as e:
+        _stats["rejected"] += 1
+        raise ValueError(f"nutri_scanner reply does not fit the nutrient sheet: {e}")
+    return {key: value for key, value in meal.model_dump(by_alias=True).items() if value is not None}
+
+def scanner_result(value):
+    '''
+    One scanner answer, either {"nutrients": {...}, "remarks": "..."} or the
+    older [nutrients, remarks] array. Returns validated (nutrients, remarks).
+    '''
+    if isinstance(value, dict) and "nutrients" in value:
+        nutrients, remarks = value["nutrients"], value.get("remarks", "")
+    elif isinstance(value, list) and value:
+        nutrients, remarks = value[0], value[1] if len(value) > 1 else ""
+    else:
+        _stats["rejected"] += 1
+        raise ValueError(f"Unexpected nutri_scanner reply: {str(value)[:200]}")
+    if not isinstance(nutrients, dict):
+        _stats["rejected"] += 1
+        raise ValueError(f"Unexpected nutri_scanner nutrients: {str(nutrients)[:200]}")
+    return validate_nutrients(nutrients), remarks if isinstance(remarks, str) else str(remarks)
+
+def parse_stats():
+    parsed = _stats["strict"] + _stats["repaired"]
+    return {
+        **_stats,
+        "repair_rate": round(_stats["repaired"] / parsed, 4) if parsed else 0.0,
+    }
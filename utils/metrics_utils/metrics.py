@@ -0,0 +1,211 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bson
+from pymongo.monitoring import CommandListener
+from dotenv import load_dotenv
+load_dotenv()
+
+# off:   nothing is recorded, /metrics is empty
+# basic: counters and histograms only, a few dict lookups per event (production)
+# full:  also Server-Timing per request and Mongo document sizes, which
+#        costs a BSON encode per command
+METRICS_MODE = os.getenv("METRICS_MODE", "basic")
+METRICS_MODES = ("off", "basic", "full")
+
+if METRICS_MODE not in METRICS_MODES:
+    raise ValueError(f"METRICS_MODE must be one of {METRICS_MODES}, got {METRICS_MODE!r}")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Request latency by route", LATENCY_BUCKETS),
+    "llm_call_duration_seconds": ("histogram", "Model call latency by agent and model", LATENCY_BUCKETS),
+    "llm_tokens_total": ("counter", "Tokens used by agent, model and kind", None),
+    "llm_key_requests_total": ("counter", "Completion requests by api key and outcome", None),
+    "stage_duration_seconds": ("histogram", "In-process stages such as reply parsing", LATENCY_BUCKETS),
+    "mongo_command_duration_seconds": ("histogram", "Mongo command latency by command and collection", LATENCY_BUCKETS),
+    "mongo_command_failures_total": ("counter", "Failed Mongo commands by command", None),
+    "mongo_request_bytes": ("histogram", "Size of Mongo commands sent (full mode)", SIZE_BUCKETS),
+    "mongo_reply_bytes": ("histogram", "Size of Mongo replies (full mode)", SIZE_BUCKETS),
+}
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# (name, sorted label items) -> Histogram or number
+_series = {}
+# Mongo events arrive on driver threads
+_lock = threading.Lock()
+# per request (name, seconds) list for Server-Timing, full mode only
+_stages = ContextVar("metrics_stages", default=None)
+
+def observe(name, value, **labels):
+    if METRICS_MODE == "off":
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _series.get(key)
+        if histogram is None:
+            histogram = _series[key] = Histogram(METRICS[name][2])
+        histogram.observe(value)
+
+def inc(name, value=1, **labels):
+    if METRICS_MODE == "off":
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _series[key] = _series.get(key, 0) + value
+
+def record_stage(name, seconds):
+    stages = _stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+@contextmanager
+def timed(stage):
+    '''
+    Times a block as stage_duration_seconds{stage=...} and, in full mode,
+    adds it to the request's Server-Timing header.
+    '''
+    if METRICS_MODE == "off":
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_duration_seconds", elapsed, stage=stage)
+        record_stage(stage, elapsed)
+
+def server_timing(stages, total):
+    '''
+    Stages of the same name are summed, e.g. three finds -> one db_find entry.
+    '''
+    merged = {}
+    for name, seconds in stages:
+        count, duration = merged.get(name, (0, 0.0))
+        merged[name] = (count + 1, duration + seconds)
+    parts = [f'{name};dur={duration * 1000:.1f};desc="x{count}"' for name, (count, duration) in merged.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+class MetricsMiddleware:
+    '''
+    Plain ASGI middleware, so streamed responses pass through untouched and
+    handlers run in the context that carries the request's stage list.
+    Routes are labelled by their path template, not the requested path.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or METRICS_MODE == "off":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        stages = [] if METRICS_MODE == "full" else None
+        token = _stages.set(stages)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if stages is not None:
+                    header = server_timing(stages, time.perf_counter() - start)
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _stages.reset(token)
+            route = scope.get("route")
+            observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - start,
+                route=getattr(route, "path", "unmatched"),
+                method=scope["method"],
+                status=str(status)
+            )
+
+class MongoCommandMetrics(CommandListener):
+    '''
+    Times every Mongo command by name and collection. In full mode it also
+    measures command and reply sizes and adds db_<command> to Server-Timing.
+    '''
+
+    def __init__(self):
+        # request_id -> collection, between started and succeeded/failed
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+        if METRICS_MODE == "full" and event.command_name in ("insert", "update", "findAndModify", "aggregate", "find"):
+            observe("mongo_request_bytes", len(bson.encode(event.command)), command=event.command_name)
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        seconds = event.duration_micros / 1e6
+        observe("mongo_command_duration_seconds", seconds, command=event.command_name, collection=collection)
+        if METRICS_MODE == "full":
+            observe("mongo_reply_bytes", len(bson.encode(event.reply)), command=event.command_name)
+            record_stage(f"db_{event.command_name}", seconds)
+
+    def failed(self, event):
+        self._collections.pop(event.request_id, None)
+        inc("mongo_command_failures_total", command=event.command_name)
+
+def mongo_listeners():
+    return [MongoCommandMetrics()] if METRICS_MODE != "off" else []
+
+def _labels(items, extra=()):
+    pairs = [f'{key}="{str(value)}"' for key, value in (*items, *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def render_prometheus():
+    '''
+    All series in the Prometheus text format.
+    '''
+    with _lock:
+        series = sorted(
+            (key, (value.buckets, list(value.counts), value.sum, value.count) if isinstance(value, Histogram) else value)
+            for key, value in _series.items()
+        )
+    lines = []
+    described = set()
+    for (name, labels), value in series:
+        kind, description, _ = METRICS[name]
+        if name not in described:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+        if kind == "counter":
+            lines.append(f"{name}{_labels(labels)} {value}")
+            continue
+        buckets, counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip((*buckets, "+Inf"), counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,155 @@
+import hashlib
+import json
+from datetime import datetime
+import numpy as np
+from utils.score_utils.scoring_engine import HIGH_RISK_NUTRIENTS, cell_scores, final_score, format_day, scored_nutrients
+
+# the parameters /calculate_score has always used; changing any of them
+# changes AGGREGATES_PARAMS and so the version stored with the aggregates
+IDEAL_FREQUENCY = 3
+PENALTY_STRENGTH = 2
+OVER_PENALTY_MULTIPLIER = 1.5
+CHEAT_THRESHOLD_FREQ = 6
+MAX_DISCIPLINE_DAYS = 60
+
+AGGREGATES_PARAMS = {
+    "ideal_frequency": IDEAL_FREQUENCY,
+    "penalty_strength": PENALTY_STRENGTH,
+    "over_penalty_multiplier": OVER_PENALTY_MULTIPLIER,
+    "high_risk_nutrients": list(HIGH_RISK_NUTRIENTS),
+    "cheat_threshold_freq": CHEAT_THRESHOLD_FREQ,
+}
+
+# Running aggregates kept on the user document next to the sheet:
+#
+#   aggregates = {
+#       "version":          balanced sheet + scoring parameters they were built with,
+#       "days":             challenge length,
+#       "nutrients":        nutrients that count towards the score,
+#       "nutrient_totals":  {nutrient: intake summed over all days},
+#       "attended_days":    days with at least one meal,
+#       "day_score_total":  sum of day_scores,
+#       "freq_score_total": sum over days of 1 / (1 + |meals - ideal|),
+#       "cheat_days":       day indices with more than CHEAT_THRESHOLD_FREQ meals,
+#   }
+#   day_scores = [sum of the nutrient scores of each day]
+#
+# day_scores lives outside `aggregates` so reads of the aggregates stay
+# O(nutrients); only meal logs touch it, one day at a time.
+
+def aggregates_version(balanced_diet_sheet):
+    payload = json.dumps([balanced_diet_sheet, AGGREGATES_PARAMS], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:12]
+
+def _frequency_score(meals):
+    return 1 / (1 + abs(meals - IDEAL_FREQUENCY))
+
+def _day_scores(rows, nutrients, balanced_diet_sheet):
+    '''
+    rows: one list of daily values per nutrient. Returns the per-day sum of
+    the nutrient scores.
+    '''
+    scores = cell_scores(
+        np.array(rows, dtype=float),
+        np.array([[balanced_diet_sheet[nutrient]] for nutrient in nutrients], dtype=float),
+        np.array([[nutrient in HIGH_RISK_NUTRIENTS] for nutrient in nutrients]),
+        PENALTY_STRENGTH,
+        OVER_PENALTY_MULTIPLIER
+    )
+    return scores.sum(axis=0)
+
+def initial_aggregates(nutrients_list, time_frame, balanced_diet_sheet):
+    '''
+    Aggregates and day_scores of a freshly started, all-zero sheet.
+    '''
+    sheet = {nutrient: [0] for nutrient in nutrients_list}
+    nutrients = scored_nutrients(sheet, balanced_diet_sheet)
+    empty_day = float(_day_scores([[0] for _ in nutrients], nutrients, balanced_diet_sheet)[0]) if nutrients else 0.0
+    aggregates = {
+        "version": aggregates_version(balanced_diet_sheet),
+        "days": time_frame,
+        "nutrients": nutrients,
+        "nutrient_totals": {nutrient: 0 for nutrient in nutrients_list},
+        "attended_days": 0,
+        "day_score_total": empty_day * time_frame,
+        "freq_score_total": _frequency_score(0) * time_frame,
+        "cheat_days": [],
+    }
+    return aggregates, [empty_day] * time_frame
+
+def build_aggregates(overall_nutrient_sheet, attendance, frequency, balanced_diet_sheet):
+    '''
+    Full rebuild from the stored sheet, for documents written before the
+    aggregates existed or built with another balanced sheet.
+    '''
+    nutrients = scored_nutrients(overall_nutrient_sheet, balanced_diet_sheet)
+    days = len(frequency)
+    if nutrients:
+        day_scores = _day_scores([overall_nutrient_sheet[nutrient] for nutrient in nutrients], nutrients, balanced_diet_sheet)
+    else:
+        day_scores = np.zeros(days)
+    aggregates = {
+        "version": aggregates_version(balanced_diet_sheet),
+        "days": days,
+        "nutrients": nutrients,
+        "nutrient_totals": {nutrient: sum(values) for nutrient, values in overall_nutrient_sheet.items()},
+        "attended_days": sum(1 for attended in attendance if attended),
+        "day_score_total": float(day_scores.sum()),
+        "freq_score_total": float(sum(_frequency_score(meals) for meals in frequency)),
+        "cheat_days": [day for day, meals in enumerate(frequency) if meals > CHEAT_THRESHOLD_FREQ],
+    }
+    return aggregates, [float(score) for score in day_scores]
+
+def meal_aggregates_update(aggregates, day_values, day_score, meals, index, nutrients, balanced_diet_sheet):
+    '''
+    The $inc / $addToSet parts that move the aggregates along with one meal
+    on day `index`, and the day's new score for day_scores. day_values,
+    day_score and meals are that day's values before the meal.
+    '''
+    scored = aggregates["nutrients"]
+    after = [day_values[nutrient] + nutrients.get(nutrient, 0) for nutrient in scored]
+    new_day_score = float(_day_scores([[value] for value in after], scored, balanced_diet_sheet)[0]) if scored else 0.0
+
+    increments = {f"aggregates.nutrient_totals.{key}": val for key, val in nutrients.items()}
+    increments["aggregates.day_score_total"] = new_day_score - day_score
+    increments["aggregates.freq_score_total"] = _frequency_score(meals + 1) - _frequency_score(meals)
+    if meals == 0:
+        increments["aggregates.attended_days"] = 1
+    update = {"$inc": increments}
+    if meals + 1 > CHEAT_THRESHOLD_FREQ:
+        update["$addToSet"] = {"aggregates.cheat_days": index}
+    return update, new_day_score
+
+def _start_day(start_date):
+    return start_date.date() if isinstance(start_date, datetime) else start_date
+
+def missed_days(aggregates, start_date, today):
+    '''
+    Days up to today without a meal: elapsed days minus attended ones.
+    '''
+    elapsed = min(max((today - _start_day(start_date)).days + 1, 0), aggregates["days"])
+    return max(elapsed - aggregates["attended_days"], 0)
+
+def gap_from_aggregates(aggregates, balanced_diet_sheet):
+    '''
+    Same result as gap_detector, from the running totals.
+    '''
+    days = aggregates["days"]
+    totals = aggregates["nutrient_totals"]
+    return {
+        key: value - totals[key] / days if key in totals and days else 0
+        for key, value in balanced_diet_sheet.items()
+    }
+
+def score_from_aggregates(aggregates, start_date, today):
+    '''
+    Same result as calculate_diet_score_vectorized, from the running totals.
+    '''
+    days = aggregates["days"]
+    nutrients = aggregates["nutrients"]
+    avg_nutrient_score = aggregates["day_score_total"] / (len(nutrients) * days) if nutrients and days else 0
+    avg_freq_penalty = aggregates["freq_score_total"] / days if days else 0
+    frequency_of_missing = missed_days(aggregates, start_date, today)
+    start_ordinal = _start_day(start_date).toordinal()
+    cheat_days = {format_day(start_ordinal + day) for day in aggregates["cheat_days"]}
+    return final_score(avg_nutrient_score, avg_freq_penalty, frequency_of_missing, days, MAX_DISCIPLINE_DAYS), cheat_days
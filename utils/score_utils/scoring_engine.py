@@ -0,0 +1,196 @@
+from datetime import datetime, date
+import math
+from functools import lru_cache
+import numpy as np
+
+HIGH_RISK_NUTRIENTS = ("Calories (kcal)","Sodium (mg)","Potassium (mg)","Iron (mg)","Vitamin D (mg)")
+
+# Sums below go through np.cumsum(...)[-1]: unlike np.sum (pairwise) it adds
+# left to right like the builtin sum(), so results match
+# calculate_diet_score_with_penalty in agents.py instead of drifting in the
+# last bits.
+
+def _sequential_sum(values, axis=-1):
+    if values.shape[axis] == 0:
+        return np.zeros(np.delete(values.shape, axis % values.ndim))
+    return np.take(np.cumsum(values, axis=axis), -1, axis=axis)
+
+def _start_datetime(start_date):
+    if isinstance(start_date, datetime):
+        return start_date
+    if isinstance(start_date, date):
+        return datetime.combine(start_date, datetime.min.time())
+    if isinstance(start_date, str):
+        return datetime.strptime(start_date, "%d-%m-%Y")
+    return None
+
+def scored_nutrients(overall_nutrient_intake_sheet, balanced_diet_sheet):
+    return [
+        nutrient for nutrient, ideal_val in balanced_diet_sheet.items()
+        if overall_nutrient_intake_sheet.get(nutrient) and ideal_val != 0
+    ]
+
+def cell_scores(intake, ideal, high_risk, penalty_strength=2, over_penalty_multiplier=1.5):
+    '''
+    intake: (..., nutrients, days) array, ideal and high_risk: (nutrients, 1).
+    Returns exp(-penalty * deviation) for every cell.
+    '''
+    deviation_ratio = np.abs(intake - ideal) / ideal
+    overshoot_factor = (intake / ideal) - 1
+    overshoot_penalty = 1 + overshoot_factor ** 2
+    penalty_factor = np.where(
+        intake > ideal,
+        penalty_strength * np.where(high_risk, over_penalty_multiplier * overshoot_penalty, overshoot_penalty),
+        penalty_strength
+    )
+    return np.exp(-penalty_factor * deviation_ratio)
+
+def nutrient_scores(intake, ideal, high_risk, penalty_strength=2, over_penalty_multiplier=1.5):
+    '''
+    Mean day score per nutrient, shape (..., nutrients).
+    '''
+    return _sequential_sum(cell_scores(intake, ideal, high_risk, penalty_strength, over_penalty_multiplier)) / intake.shape[-1]
+
+def frequency_scores(frequency, ideal_frequency=3):
+    return _sequential_sum(1 / (1 + np.abs(frequency - ideal_frequency))) / max(frequency.shape[-1], 1)
+
+@lru_cache(maxsize=4096)
+def format_day(ordinal):
+    return date.fromordinal(ordinal).strftime("%d-%m-%Y")
+
+def cheat_days_from_frequency(daily_frequency_list, start_dt, cheat_threshold_freq):
+    indices = np.nonzero(np.asarray(daily_frequency_list) > cheat_threshold_freq)[0]
+    if not len(indices):
+        return set()
+    start_ordinal = start_dt.toordinal()
+    return {format_day(start_ordinal + int(day_idx)) for day_idx in indices}
+
+def final_score(avg_nutrient_score, avg_freq_penalty, frequency_of_missing, num_days, max_discipline_days):
+    missing_penalty = 1 / (1 + frequency_of_missing)
+    discipline_bonus = math.log1p(min(num_days, max_discipline_days)) / math.log1p(max_discipline_days)
+    base_score = avg_nutrient_score * 0.7 + avg_freq_penalty * 0.2 + missing_penalty * 0.1
+    final_score = base_score * (0.8 + 0.2 * discipline_bonus)
+    final_score *= 100
+    return round(final_score, 2)
+
+def calculate_diet_score_vectorized(
+    overall_nutrient_intake_sheet,
+    balanced_diet_sheet,
+    daily_frequency_list,
+    frequency_of_missing,
+    start_date,
+    ideal_frequency=3,
+    penalty_strength=2,
+    over_penalty_multiplier=1.5,
+    high_risk_nutrients=HIGH_RISK_NUTRIENTS,
+    cheat_threshold_over=2.0,
+    cheat_threshold_freq=6,
+    max_discipline_days=60
+):
+    '''
+    Same inputs and result as calculate_diet_score_with_penalty, computed on
+    a (nutrients x days) array instead of cell by cell.
+    '''
+    start_dt = _start_datetime(start_date)
+    num_days = len(next(iter(overall_nutrient_intake_sheet.values()))) if overall_nutrient_intake_sheet else 0
+
+    scored = scored_nutrients(overall_nutrient_intake_sheet, balanced_diet_sheet)
+    lengths = {len(overall_nutrient_intake_sheet[nutrient]) for nutrient in scored}
+    per_nutrient = []
+    if len(lengths) == 1:
+        per_nutrient = list(nutrient_scores(
+            np.array([overall_nutrient_intake_sheet[nutrient] for nutrient in scored], dtype=float),
+            np.array([[balanced_diet_sheet[nutrient]] for nutrient in scored], dtype=float),
+            np.array([[nutrient in high_risk_nutrients] for nutrient in scored]),
+            penalty_strength,
+            over_penalty_multiplier
+        ))
+    else:
+        # ragged sheet: one row at a time
+        for nutrient in scored:
+            per_nutrient.append(nutrient_scores(
+                np.array([overall_nutrient_intake_sheet[nutrient]], dtype=float),
+                np.array([[balanced_diet_sheet[nutrient]]], dtype=float),
+                np.array([[nutrient in high_risk_nutrients]]),
+                penalty_strength,
+                over_penalty_multiplier
+            )[0])
+    avg_nutrient_score = float(_sequential_sum(np.array(per_nutrient))) / len(per_nutrient) if per_nutrient else 0
+
+    frequency = np.array(daily_frequency_list, dtype=float)
+    avg_freq_penalty = float(frequency_scores(frequency, ideal_frequency)) if len(daily_frequency_list) else 0
+    cheat_days = cheat_days_from_frequency(daily_frequency_list, start_dt, cheat_threshold_freq)
+
+    return final_score(avg_nutrient_score, avg_freq_penalty, frequency_of_missing, num_days, max_discipline_days), cheat_days
+
+def score_batch(
+    users,
+    balanced_diet_sheet,
+    ideal_frequency=3,
+    penalty_strength=2,
+    over_penalty_multiplier=1.5,
+    high_risk_nutrients=HIGH_RISK_NUTRIENTS,
+    cheat_threshold_freq=6,
+    max_discipline_days=60
+):
+    '''
+    Scores many users in one pass. Each user is a dict with the keyword
+    arguments of calculate_diet_score_vectorized (overall_nutrient_intake_sheet,
+    daily_frequency_list, frequency_of_missing, start_date). Users sharing the
+    same nutrients and challenge length are stacked into one
+    (users x nutrients x days) array. Returns [(score, cheat_days), ...] in input order.
+    '''
+    params = dict(
+        ideal_frequency=ideal_frequency,
+        penalty_strength=penalty_strength,
+        over_penalty_multiplier=over_penalty_multiplier,
+        high_risk_nutrients=high_risk_nutrients,
+        cheat_threshold_freq=cheat_threshold_freq,
+        max_discipline_days=max_discipline_days
+    )
+    results = [None] * len(users)
+    groups = {}
+    for position, user in enumerate(users):
+        sheet = user["overall_nutrient_intake_sheet"]
+        scored = tuple(scored_nutrients(sheet, balanced_diet_sheet))
+        lengths = {len(sheet[nutrient]) for nutrient in scored}
+        first_length = len(next(iter(sheet.values()))) if sheet else 0
+        if not scored or lengths != {first_length}:
+            results[position] = calculate_diet_score_vectorized(balanced_diet_sheet=balanced_diet_sheet, **user, **params)
+            continue
+        key = (scored, first_length, len(user["daily_frequency_list"]))
+        groups.setdefault(key, []).append(position)
+
+    for (scored, num_days, num_frequency_days), positions in groups.items():
+        intake = np.array(
+            [[users[position]["overall_nutrient_intake_sheet"][nutrient] for nutrient in scored] for position in positions],
+            dtype=float
+        )
+        ideal = np.array([[balanced_diet_sheet[nutrient]] for nutrient in scored], dtype=float)
+        high_risk = np.array([[nutrient in high_risk_nutrients] for nutrient in scored])
+        avg_nutrient_scores = _sequential_sum(
+            nutrient_scores(intake, ideal, high_risk, penalty_strength, over_penalty_multiplier)
+        ) / len(scored)
+        if num_frequency_days:
+            frequency = np.array([users[position]["daily_frequency_list"] for position in positions], dtype=float)
+            avg_freq_penalties = frequency_scores(frequency, ideal_frequency)
+        else:
+            avg_freq_penalties = np.zeros(len(positions))
+        for row, position in enumerate(positions):
+            user = users[position]
+            start_dt = _start_datetime(user["start_date"])
+            results[position] = (
+                final_score(float(avg_nutrient_scores[row]), float(avg_freq_penalties[row]), user["frequency_of_missing"], num_days, max_discipline_days),
+                cheat_days_from_frequency(user["daily_frequency_list"], start_dt, cheat_threshold_freq)
+            )
+    return results
+
+def gap_detector_vectorized(overall_nutrient_intake_sheet, balanced_diet_sheet):
+    '''
+    Same result as gap_detector: ideal minus the average daily intake.
+    '''
+    gap_sheet = {}
+    for key, value in balanced_diet_sheet.items():
+        intake_list = overall_nutrient_intake_sheet.get(key, [])
+        gap_sheet[key] = value - float(_sequential_sum(np.array(intake_list, dtype=float))) / len(intake_list) if intake_list else 0
+    return gap_sheet